@@ -0,0 +1,135 @@
+"""
+Benchmark of the string cleaning done by preprocessing/run.py,
+comparing the former per-row `Series.apply` implementation with
+the vectorized functions from common/cleaning.py.
+
+Usage:
+    python benchmarks/bench_cleaning.py --sizes 10000 1000000 10000000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cleaning import clean_bathrooms_text, clean_percentage, clean_price  # noqa: E402
+from synthetic_data import iter_synthetic_listings  # noqa: E402
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s %(message)s",
+                    datefmt='%d-%m-%Y %H:%M:%S')
+
+LOGGER = logging.getLogger()
+
+STRING_COLUMNS = ['bathrooms_text', 'price', 'host_response_rate']
+
+
+def treat_bathroom_text(value):
+    """Former per-row implementation for the bathrooms_text column"""
+    if not isinstance(value, str):
+        return value
+
+    try:
+        return float(value.split(' ')[0])
+    except ValueError:
+        return 0.5
+
+
+def legacy_cleaning(data):
+    """Clean the string columns with the former Series.apply path
+    Args:
+        data(pd.DataFrame): Synthetic frame with raw string columns
+    Returns:
+        (pd.DataFrame): Cleaned columns
+    """
+    return pd.DataFrame({
+        'bathrooms': data['bathrooms_text'].apply(treat_bathroom_text),
+        'price': data['price'].apply(
+            lambda x: float(x[1:].replace(',', '')) if isinstance(x, str) else x),
+        'host_response_rate': data['host_response_rate'].apply(
+            lambda x: float(x.replace('%', ''))/100 if isinstance(x, str) else x)
+    })
+
+
+def vectorized_cleaning(data):
+    """Clean the string columns with the vectorized functions
+    Args:
+        data(pd.DataFrame): Synthetic frame with raw string columns
+    Returns:
+        (pd.DataFrame): Cleaned columns
+    """
+    return pd.DataFrame({
+        'bathrooms': clean_bathrooms_text(data['bathrooms_text']),
+        'price': clean_price(data['price']),
+        'host_response_rate': clean_percentage(data['host_response_rate'])
+    })
+
+
+def synthetic_frame(n_rows, seed=42):
+    """Return a frame with n_rows of raw bathrooms_text, price and
+    host_response_rate values from the synthetic listings generator
+    Args:
+        n_rows(int): Number of rows
+        seed(int): Seed for the random number generator
+    Returns:
+        (pd.DataFrame): Synthetic raw frame
+    """
+    return pd.concat((chunk[STRING_COLUMNS] for chunk in
+                      iter_synthetic_listings(n_rows, seed=seed)), ignore_index=True)
+
+
+def timed(function, data):
+    """Return the result of function(data) and the elapsed seconds"""
+    start = time.perf_counter()
+    result = function(data)
+    return result, time.perf_counter() - start
+
+
+def process_args(args):
+    """Run the benchmark for every requested size
+    Args:
+        args - command line arguments
+        args.sizes: Number of rows of each synthetic frame
+        args.skip_legacy_above: Largest size to run the legacy path on
+    """
+    for n_rows in args.sizes:
+        data = synthetic_frame(n_rows)
+
+        vectorized, vectorized_time = timed(vectorized_cleaning, data)
+        LOGGER.info("%d rows: vectorized %.3fs (%.0f rows/s)",
+                    n_rows, vectorized_time, n_rows / vectorized_time)
+
+        if n_rows > args.skip_legacy_above:
+            LOGGER.info("%d rows: legacy path skipped", n_rows)
+            continue
+
+        legacy, legacy_time = timed(legacy_cleaning, data)
+        pd.testing.assert_frame_equal(legacy, vectorized)
+        LOGGER.info("%d rows: legacy %.3fs, speedup %.1fx",
+                    n_rows, legacy_time, legacy_time / vectorized_time)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Benchmark the string cleaning of the preprocessing step",
+        fromfile_prefix_chars="@"
+    )
+
+    PARSER.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        help="Number of rows of each synthetic frame",
+        default=[10_000, 1_000_000, 10_000_000]
+    )
+
+    PARSER.add_argument(
+        "--skip_legacy_above",
+        type=int,
+        help="Largest frame the legacy Series.apply path runs on",
+        default=10_000_000
+    )
+    ARGS = PARSER.parse_args()
+    process_args(ARGS)
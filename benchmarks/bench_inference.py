@@ -0,0 +1,114 @@
+"""
+Benchmark of the random forest inference, comparing sklearn's
+`predict_proba`, which loops over the estimators in Python, with the
+vectorized engine of common/forest_io.py walking all the trees at once.
+
+Both run on one core: sklearn with n_jobs=1 adds the trees in the same
+order as the engine, so their probabilities are checked to be equal.
+
+Usage:
+    python benchmarks/bench_inference.py --batch_sizes 1 10 100 1000 10000 100000 1000000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.forest_io import CompactForest  # noqa: E402
+from bench_model_export import synthetic_forest  # noqa: E402
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s %(message)s",
+                    datefmt='%d-%m-%Y %H:%M:%S')
+
+LOGGER = logging.getLogger()
+
+
+def seconds_per_call(function, data, min_seconds):
+    """Return the result of function(data) and its mean time, repeating
+    the call for at least min_seconds"""
+    calls, start = 0, time.perf_counter()
+    while True:
+        result = function(data)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return result, elapsed / calls
+
+
+def process_args(args):
+    """Run the benchmark for every requested batch size
+    Args:
+        args - command line arguments
+        args.batch_sizes: Number of rows of each predicted batch
+        args.n_estimators: Number of trees of the forest
+        args.n_rows: Number of training rows
+        args.min_seconds: Minimum time spent on each measure
+    """
+    rf = synthetic_forest(args.n_estimators, args.n_rows)
+    rf.set_params(n_jobs=1)
+    engine = CompactForest.from_estimator(rf)
+    rng = np.random.default_rng(0)
+
+    for batch_size in args.batch_sizes:
+        x = rng.normal(size=(batch_size, rf.n_features_in_)).astype(np.float32)
+
+        # sklearn checks the feature names, not the engine, compare on arrays
+        expected, sklearn_time = seconds_per_call(
+            lambda data: rf.predict_proba(data), x, args.min_seconds)
+        proba, engine_time = seconds_per_call(engine.predict_proba, x, args.min_seconds)
+
+        if not np.array_equal(proba, expected):
+            raise AssertionError(f"Engine probabilities differ for {batch_size} rows")
+
+        LOGGER.info("%8d rows: sklearn %10.3f ms (%10.0f rows/s), "
+                    "engine %10.3f ms (%10.0f rows/s), speedup %.1fx",
+                    batch_size, sklearn_time * 1000, batch_size / sklearn_time,
+                    engine_time * 1000, batch_size / engine_time,
+                    sklearn_time / engine_time)
+
+
+if __name__ == "__main__":
+    import warnings
+
+    # The forest is fitted on a DataFrame and predicts plain arrays
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+    PARSER = argparse.ArgumentParser(
+        description="Benchmark the random forest inference engine",
+        fromfile_prefix_chars="@"
+    )
+
+    PARSER.add_argument(
+        "--batch_sizes",
+        type=int,
+        nargs="+",
+        help="Number of rows of each predicted batch",
+        default=[1, 10, 100, 1_000, 10_000, 100_000, 1_000_000]
+    )
+
+    PARSER.add_argument(
+        "--n_estimators",
+        type=int,
+        help="Number of trees of the forest",
+        default=100
+    )
+
+    PARSER.add_argument(
+        "--n_rows",
+        type=int,
+        help="Number of synthetic training rows",
+        default=50_000
+    )
+
+    PARSER.add_argument(
+        "--min_seconds",
+        type=float,
+        help="Minimum time spent measuring each batch size",
+        default=1.0
+    )
+    ARGS = PARSER.parse_args()
+    process_args(ARGS)
@@ -0,0 +1,165 @@
+"""
+Benchmark of the model export of random_forest/run.py, comparing the
+cloudpickled estimator saved by mlflow with the compact memory-mappable
+export of common/forest_io.py on export size, cold load time and
+memory of the loading process.
+
+Each load runs in a fresh interpreter, so the import of the libraries
+needed to rebuild the model is part of the load time. Resident memory is
+split into anonymous pages, private to each process, and file pages,
+which the processes mapping the same export share through the page cache.
+
+Usage:
+    python benchmarks/bench_model_export.py --n_estimators 10 100 500
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.forest_io import load_forest, save_forest  # noqa: E402
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s %(message)s",
+                    datefmt='%d-%m-%Y %H:%M:%S')
+
+LOGGER = logging.getLogger()
+
+# Code run in a fresh interpreter to time the load of an export
+LOAD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+if sys.argv[1] == "cloudpickle":
+    import cloudpickle
+    with open(sys.argv[2], "rb") as fp:
+        model = cloudpickle.load(fp)
+else:
+    sys.path.append(sys.argv[3])
+    from common.forest_io import load_forest
+    model = load_forest(sys.argv[2])
+load_seconds = time.perf_counter() - start
+
+
+def memory():
+    with open("/proc/self/status") as fp:
+        status = dict(line.split(":", 1) for line in fp)
+    return {key: int(status[key].split()[0]) / 1024 for key in ("RssAnon", "RssFile")}
+
+
+loaded = memory()
+import numpy as np
+model.predict(np.random.default_rng(0).normal(size=(int(sys.argv[4]), model.n_features_in_)))
+print(json.dumps({"load_seconds": load_seconds, "loaded": loaded, "predicted": memory()}))
+"""
+
+
+def synthetic_forest(n_estimators, n_rows, seed=42):
+    """Fit a forest shaped like the random_forest step one on synthetic data
+    Args:
+        n_estimators(int): Number of trees
+        n_rows(int): Number of training rows
+        seed(int): Seed for the random number generator
+    Returns:
+        (RandomForestClassifier): Fitted forest
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(seed)
+    x = pd.DataFrame(rng.normal(size=(n_rows, 14)),
+                     columns=[f"feature_{i}" for i in range(14)])
+    score = x.iloc[:, :4].sum(axis=1) + rng.normal(size=n_rows)
+    y = np.array(["Entire home/apt", "Private room", "Shared room", "Hotel room"])[
+        np.digitize(score, [-1.0, 1.0, 2.5])]
+
+    return RandomForestClassifier(n_estimators=n_estimators, criterion="entropy",
+                                  max_depth=13, class_weight="balanced",
+                                  n_jobs=-1, random_state=seed).fit(x, y)
+
+
+def measure_load(export_format, path, predict_rows):
+    """Load an export in a fresh interpreter
+    Returns:
+        (dict): Load seconds and memory in MB after loading and predicting
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    output = subprocess.run(
+        [sys.executable, "-c", LOAD_SCRIPT, export_format, path, root, str(predict_rows)],
+        check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def process_args(args):
+    """Run the benchmark for every requested forest size
+    Args:
+        args - command line arguments
+        args.n_estimators: Number of trees of each forest
+        args.n_rows: Number of training rows
+        args.predict_rows: Number of rows predicted after loading
+    """
+    import cloudpickle
+
+    for n_estimators in args.n_estimators:
+        rf = synthetic_forest(n_estimators, args.n_rows)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pickle_path = os.path.join(temp_dir, "model.pkl")
+            with open(pickle_path, "wb") as fp:
+                cloudpickle.dump(rf, fp)
+            compact_path = os.path.join(temp_dir, "compact_forest")
+            sizes = {"cloudpickle": os.path.getsize(pickle_path),
+                     "compact": save_forest(rf, compact_path)}
+
+            # Both exports must predict the same classes and probabilities
+            x = pd.DataFrame(np.random.default_rng(1).normal(size=(1000, rf.n_features_in_)),
+                             columns=rf.feature_names_in_)
+            np.testing.assert_allclose(load_forest(compact_path).predict_proba(x),
+                                       rf.predict_proba(x))
+
+            for export_format, path in (("cloudpickle", pickle_path),
+                                        ("compact", compact_path)):
+                result = measure_load(export_format, path, args.predict_rows)
+                LOGGER.info(
+                    "%d trees, %-11s: %7.1f MB on disk, cold load %.3fs, "
+                    "loaded %.1f MB private + %.1f MB shared, "
+                    "after predicting %.1f MB private + %.1f MB shared",
+                    n_estimators, export_format, sizes[export_format] / 1024 ** 2,
+                    result["load_seconds"],
+                    result["loaded"]["RssAnon"], result["loaded"]["RssFile"],
+                    result["predicted"]["RssAnon"], result["predicted"]["RssFile"])
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Benchmark the size and load time of the model exports",
+        fromfile_prefix_chars="@"
+    )
+
+    PARSER.add_argument(
+        "--n_estimators",
+        type=int,
+        nargs="+",
+        help="Number of trees of each forest",
+        default=[10, 100, 500]
+    )
+
+    PARSER.add_argument(
+        "--n_rows",
+        type=int,
+        help="Number of synthetic training rows",
+        default=50_000
+    )
+
+    PARSER.add_argument(
+        "--predict_rows",
+        type=int,
+        help="Number of rows predicted after loading",
+        default=10_000
+    )
+    ARGS = PARSER.parse_args()
+    process_args(ARGS)
@@ -0,0 +1,325 @@
+"""
+End-to-end benchmark of the pipeline on synthetic listings. For each size
+a raw dataset is generated by benchmarks/synthetic_data.py and stored in
+a local artifact store, then the steps run in this interpreter, as with
+`main.runner=in_process`, with the parameters main.py gives them: no W&B
+project or network access is needed.
+
+Each stage is timed with its peak resident memory and throughput in raw
+rows per second, the steps also write their own phase traces, and the
+measures are compared to a stored baseline: a stage slower or using more
+memory than its baseline by more than the tolerance is reported as a
+regression and the benchmark exits with an error.
+
+Usage:
+    python benchmarks/bench_pipeline.py --sizes 10000 1000000 10000000
+    python benchmarks/bench_pipeline.py --sizes 10000 --update_baseline
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+from omegaconf import OmegaConf
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+from common.artifact_cache import clear_memory_handoff  # noqa: E402
+from common.instrumentation import Tracer  # noqa: E402
+from common.publisher import local_store  # noqa: E402
+from common.runner import run_in_process  # noqa: E402
+from main import STEP_PATHS, step_parameters  # noqa: E402
+from synthetic_data import write_synthetic_listings  # noqa: E402
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s %(message)s",
+                    datefmt='%d-%m-%Y %H:%M:%S')
+
+LOGGER = logging.getLogger()
+
+# Stages in the order they run, scoring is not a step of main.py
+STAGES = ["preprocess", "segregate", "profile", "check_data",
+          "random_forest", "evaluate", "scoring"]
+
+# Measures compared to the baseline, with the absolute difference below
+# which a change is considered noise
+COMPARED = {"seconds": "min_seconds", "rss_peak_mb": "min_rss_mb"}
+
+
+def scoring_parameters(config, output_dir, workers):
+    """Return the parameters of a batch scoring of the test split with the
+    exported model
+    Args:
+        config(DictConfig): Pipeline configuration
+        output_dir(str): Directory receiving the predictions
+        workers(int): Worker processes of the scoring
+    Returns:
+        (dict): Parameters of scoring/run.py
+    """
+    store = local_store()
+    export_artifact = config["random_forest_pipeline"]["export_artifact"]
+    return {
+        "model_export": store.use_artifact(f"{export_artifact}:latest").download(),
+        "mode": "batch",
+        "input_file": store.use_artifact("test_data.csv:latest").file(),
+        "output_file": os.path.join(output_dir, "predictions.csv"),
+        "chunksize": 100000,
+        "workers": workers,
+        "host": None,
+        "port": None,
+        "max_batch_size": None,
+        "max_wait_ms": None
+    }
+
+
+def run_size(n_rows, config, args):
+    """Generate n_rows raw listings and run the stages on them
+    Args:
+        n_rows(int): Number of raw rows
+        config(DictConfig): Pipeline configuration
+        args(argparse.Namespace): Command line arguments
+    Returns:
+        (dict): Seconds, rows per second and memory of each stage
+    """
+    size_dir = os.path.join(args.workdir, str(n_rows))
+    os.makedirs(size_dir, exist_ok=True)
+    os.environ["ARTIFACT_STORE_DIR"] = os.path.join(size_dir, "store")
+    # Tables of the previous size must not be handed over to this one
+    clear_memory_handoff()
+
+    tracer = Tracer(f"benchmark_{n_rows}", profile="none")
+    tracer.start()
+    try:
+        with tracer.phase("generate", rows=n_rows):
+            raw_path = write_synthetic_listings(os.path.join(size_dir, "raw_data.csv"),
+                                                n_rows, seed=args.seed)
+            local_store().log_artifact("raw_data.csv", "raw_data",
+                                       "Synthetic raw listings", raw_path)
+            os.remove(raw_path)
+
+        for stage in args.stages:
+            LOGGER.info("Running %s on %d rows", stage, n_rows)
+            with tracer.phase(stage, rows=n_rows):
+                if stage == "scoring":
+                    run_in_process(stage, os.path.join(ROOT, "scoring"),
+                                   scoring_parameters(config, size_dir, args.workers))
+                else:
+                    run_in_process(stage, os.path.join(ROOT, STEP_PATHS[stage]),
+                                   step_parameters(stage, config))
+    finally:
+        tracer.finish()
+
+    return {timing.name: {
+        "seconds": timing.seconds,
+        "rows_per_second": timing.rows_per_second,
+        "rss_peak_mb": timing.rss_peak / 2 ** 20,
+        "rss_growth_mb": (timing.rss_peak - timing.rss_start) / 2 ** 20
+    } for timing in tracer.phases}
+
+
+def find_regressions(results, baseline, args):
+    """Compare the measures of each stage to the baseline
+    Args:
+        results(dict): Measures keyed by size then stage
+        baseline(dict): Baseline measures, with the same keys
+        args(argparse.Namespace): Command line arguments with the
+    tolerance and the noise thresholds
+    Returns:
+        (list): (size, stage, measure, baseline, measured) of every
+    regression
+    """
+    regressions = []
+    for size, stages in results.items():
+        for stage, measures in stages.items():
+            reference = baseline.get(size, {}).get(stage)
+            if reference is None:
+                continue
+
+            for measure, threshold in COMPARED.items():
+                limit = reference[measure] * (1 + args.tolerance)
+                if measures[measure] > limit and \
+                        measures[measure] - reference[measure] > getattr(args, threshold):
+                    regressions.append((size, stage, measure,
+                                        reference[measure], measures[measure]))
+    return regressions
+
+
+def log_results(results):
+    """Log a table with the measures of each size and stage"""
+    LOGGER.info("%10s %-15s %10s %12s %12s %12s", "rows", "stage", "seconds",
+                "rows/s", "peak RSS MB", "growth MB")
+    for size, stages in results.items():
+        for stage, measures in stages.items():
+            LOGGER.info("%10s %-15s %10.2f %12.0f %12.0f %12.0f", size, stage,
+                        measures["seconds"], measures["rows_per_second"],
+                        measures["rss_peak_mb"], measures["rss_growth_mb"])
+
+
+def process_args(args):
+    """Run the benchmark for every requested size
+    Args:
+        args - command line arguments
+        args.sizes: Number of raw rows of each run
+        args.stages: Stages to run, in order
+        args.config: Pipeline configuration file
+        args.overrides: Dotted key=value overrides of the configuration
+        args.workdir: Directory of the artifact stores, traces and results
+        args.seed: Seed of the synthetic data
+        args.workers: Worker processes of the scoring stage
+        args.baseline: Json file with the baseline measures
+        args.update_baseline: Store the measures as the new baseline
+        args.tolerance: Relative slowdown or memory growth reported
+        args.min_seconds: Slowdowns below this many seconds are ignored
+        args.min_rss_mb: Memory growths below this many MB are ignored
+    """
+    config = OmegaConf.merge(OmegaConf.load(args.config),
+                             OmegaConf.from_dotlist(args.overrides))
+
+    args.baseline = os.path.abspath(args.baseline)
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="bench-"))
+    os.makedirs(args.workdir, exist_ok=True)
+    LOGGER.info("Benchmark artifacts and traces in %s", args.workdir)
+
+    # Every artifact goes to a local store, the runs log to local W&B files
+    os.environ.setdefault("WANDB_MODE", "offline")
+    os.environ["WANDB_PROJECT"] = config["main"]["project_name"]
+    os.environ["ARTIFACT_STORE_BACKEND"] = "local"
+    os.environ["ARTIFACT_CACHE_ENABLED"] = str(config["main"]["artifact_cache"]["enabled"]).lower()
+    os.environ["ARTIFACT_CACHE_DIR"] = os.path.join(args.workdir, "cache")
+    os.environ["INSTRUMENTATION_TRACE_DIR"] = os.path.join(args.workdir, "traces")
+    os.environ["INSTRUMENTATION_PROFILE"] = config["main"]["instrumentation"]["profile"]
+
+    # The random_forest step parameters write its configuration here
+    os.chdir(args.workdir)
+
+    results = {str(n_rows): run_size(n_rows, config, args) for n_rows in args.sizes}
+    log_results(results)
+
+    with open(os.path.join(args.workdir, "results.json"), "w") as fp:
+        json.dump(results, fp, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as fp:
+            json.dump(baseline, fp, indent=2)
+        LOGGER.info("Baseline of %s rows written to %s", list(results), args.baseline)
+        return
+
+    if not baseline:
+        LOGGER.warning("No baseline in %s, run with --update_baseline to store one",
+                       args.baseline)
+        return
+
+    regressions = find_regressions(results, baseline, args)
+    for size, stage, measure, reference, measured in regressions:
+        LOGGER.error("Regression on %s rows, %s %s: %.2f, baseline %.2f (%+.0f%%)",
+                     size, stage, measure, measured, reference,
+                     100 * (measured / reference - 1))
+    if regressions:
+        sys.exit(1)
+    LOGGER.info("No regression against %s", args.baseline)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Benchmark the pipeline end to end on synthetic listings",
+        fromfile_prefix_chars="@"
+    )
+
+    PARSER.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        help="Number of raw rows of each run",
+        default=[10_000, 1_000_000, 10_000_000]
+    )
+
+    PARSER.add_argument(
+        "--stages",
+        type=str,
+        nargs="+",
+        choices=STAGES,
+        help="Stages to run, in order, each needs the artifacts of the previous ones",
+        default=STAGES
+    )
+
+    PARSER.add_argument(
+        "--config",
+        type=str,
+        help="Pipeline configuration file",
+        default=os.path.join(ROOT, "config.yaml")
+    )
+
+    PARSER.add_argument(
+        "--overrides",
+        type=str,
+        nargs="*",
+        help="Configuration overrides as dotted key=value pairs, exact LOF "
+             "does not scale to millions of rows so lof_sample is the default",
+        default=["random_forest_pipeline.outlier.method=lof_sample"]
+    )
+
+    PARSER.add_argument(
+        "--workdir",
+        type=str,
+        help="Directory of the artifact stores, traces and results, "
+             "a temporary directory by default",
+        default=None
+    )
+
+    PARSER.add_argument(
+        "--seed",
+        type=int,
+        help="Seed of the synthetic data",
+        default=42
+    )
+
+    PARSER.add_argument(
+        "--workers",
+        type=int,
+        help="Worker processes of the scoring stage",
+        default=os.cpu_count()
+    )
+
+    PARSER.add_argument(
+        "--baseline",
+        type=str,
+        help="Json file with the baseline measures",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "baseline.json")
+    )
+
+    PARSER.add_argument(
+        "--update_baseline",
+        action="store_true",
+        help="Store the measures as the baseline of their sizes"
+    )
+
+    PARSER.add_argument(
+        "--tolerance",
+        type=float,
+        help="Relative slowdown or memory growth reported as a regression",
+        default=0.2
+    )
+
+    PARSER.add_argument(
+        "--min_seconds",
+        type=float,
+        help="Slowdowns shorter than this are ignored as noise",
+        default=0.5
+    )
+
+    PARSER.add_argument(
+        "--min_rss_mb",
+        type=float,
+        help="Memory growths smaller than this are ignored as noise",
+        default=50
+    )
+    ARGS = PARSER.parse_args()
+    process_args(ARGS)
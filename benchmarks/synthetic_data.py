@@ -0,0 +1,333 @@
+"""
+Generator of synthetic raw listings shaped like the Rio de Janeiro Airbnb
+dataset, with the 22 columns preprocessing/run.py selects and their raw
+formats: prices like '$1,234.00', bathrooms like '1.5 shared baths',
+response rates like '95%', amenities as json lists and host
+verifications as python lists. Missing values and exact duplicate rows
+are injected at configurable rates, and the numerical columns depend on
+the room type so the random forest has something to learn.
+
+Rows are generated in chunks from independent seeds, so any number of
+rows can be written to a csv, parquet or feather file with constant
+memory, and the same seed always gives the same file.
+
+Usage:
+    python benchmarks/synthetic_data.py --n_rows 1000000 --output raw_data.csv
+"""
+import argparse
+import logging
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.artifact_io import TableWriter  # noqa: E402
+from common.cleaning import COLUMNS, COLUMNS_DROP  # noqa: E402
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s %(message)s",
+                    datefmt='%d-%m-%Y %H:%M:%S')
+
+LOGGER = logging.getLogger()
+
+ROOM_TYPES = {'Entire home/apt': 0.70, 'Private room': 0.25,
+              'Shared room': 0.02, 'Hotel room': 0.03}
+
+# Mean accommodates above one and median nightly price of each room type
+ACCOMMODATES = {'Entire home/apt': 3.0, 'Private room': 1.0,
+                'Shared room': 0.5, 'Hotel room': 1.0}
+PRICES = {'Entire home/apt': 350.0, 'Private room': 120.0,
+          'Shared room': 70.0, 'Hotel room': 250.0}
+
+BATHROOMS_TEXT = {
+    'Entire home/apt': {'1 bath': 0.45, '1.5 baths': 0.10, '2 baths': 0.22,
+                        '2.5 baths': 0.05, '3 baths': 0.08, '4 baths': 0.04,
+                        '0 baths': 0.01, 'Half-bath': 0.05},
+    'Private room': {'1 private bath': 0.30, '1 shared bath': 0.35,
+                     '1.5 shared baths': 0.10, '2 shared baths': 0.15,
+                     '1 bath': 0.08, 'Shared half-bath': 0.02},
+    'Shared room': {'1 shared bath': 0.50, '2 shared baths': 0.30,
+                    '3 shared baths': 0.15, 'Shared half-bath': 0.05},
+    'Hotel room': {'1 private bath': 0.60, '1 bath': 0.30,
+                   'Private half-bath': 0.05, '1 shared bath': 0.05}
+}
+
+NEIGHBOURHOODS = ['Copacabana', 'Barra da Tijuca', 'Ipanema', 'Jacarepaguá',
+                  'Botafogo', 'Recreio dos Bandeirantes', 'Leblon', 'Santa Teresa',
+                  'Centro', 'Flamengo', 'Laranjeiras', 'Tijuca', 'Lagoa', 'Camorim',
+                  'Leme', 'Glória', 'Catete', 'Humaitá', 'Gávea', 'São Conrado',
+                  'Vidigal', 'Jardim Botânico', 'Urca', 'Vargem Grande']
+
+RESPONSE_TIMES = {'within an hour': 0.60, 'within a few hours': 0.18,
+                  'within a day': 0.15, 'a few days or more': 0.07}
+
+AMENITIES = ['Wifi', 'Kitchen', 'Air conditioning', 'Essentials', 'Long term stays allowed',
+             'Hangers', 'TV', 'Iron', 'Hair dryer', 'Washer', 'Elevator', 'Hot water',
+             'Dedicated workspace', 'Dishes and silverware', 'Refrigerator', 'Cooking basics',
+             'Bed linens', 'Microwave', 'Stove', 'Oven', 'Coffee maker', 'Smoke alarm',
+             'Free parking on premises', 'Pool', 'Shampoo', 'Cable TV', 'Private entrance',
+             'Building staff', 'Balcony', 'Beachfront', 'Gym', 'Hot tub', 'Patio or balcony',
+             'Extra pillows and blankets', 'Fire extinguisher', 'First aid kit', 'Heating',
+             'Luggage dropoff allowed', 'Host greets you', 'Lock on bedroom door',
+             'Room-darkening shades', 'Ceiling fan', 'Bathtub', 'Dishwasher', 'Crib',
+             'Security cameras on property', 'Paid parking off premises', 'Beach essentials',
+             'Outdoor furniture', 'BBQ grill', 'Ocean view', 'Sound system', 'Breakfast',
+             'Self check-in', 'Keypad', 'Lockbox', 'Pets allowed', 'Smoking allowed',
+             'Waterfront', 'Baby bath']
+
+VERIFICATIONS = ['phone', 'email', 'reviews', 'government_id', 'jumio', 'offline_government_id',
+                 'selfie', 'identity_manual', 'facebook', 'work_email', 'google']
+
+
+def _zipf_weights(n_items, exponent=1.0):
+    """Return normalized weights decreasing with the rank of each item"""
+    weights = 1.0 / np.arange(1, n_items + 1) ** exponent
+    return weights / weights.sum()
+
+
+def _choice(rng, options, size):
+    """Draw size values from a dict of options and their probabilities"""
+    values = np.array(list(options), dtype=object)
+    probabilities = np.array(list(options.values()))
+    return values[rng.choice(len(values), size=size, p=probabilities / probabilities.sum())]
+
+
+def _list_pool(rng, items, size, mean_items, quote):
+    """Return size distinct-looking string lists of items, more popular
+    items being in more lists
+    Args:
+        rng(np.random.Generator): Random number generator
+        items(list): Items the lists are made of
+        size(int): Number of lists
+        mean_items(float): Mean number of items per list
+        quote(str): Quote around each item, '"' for json lists and "'"
+    for python lists
+    Returns:
+        (np.ndarray): Object array of list strings
+    """
+    # Inclusion probability of each item, scaled to the mean list length
+    probabilities = np.minimum(_zipf_weights(len(items), 0.6) * mean_items, 0.95)
+    included = rng.random((size, len(items))) < probabilities
+    order = rng.permuted(np.tile(np.arange(len(items)), (size, 1)), axis=1)
+
+    names = np.array([f"{quote}{item}{quote}" for item in items], dtype=object)
+    return np.array(["[" + ", ".join(names[row[mask[row]]]) + "]"
+                     for row, mask in zip(order, included)], dtype=object)
+
+
+def _format_prices(prices):
+    """Format prices as '$1,234.00', formatting each distinct price once"""
+    uniques, inverse = np.unique(prices, return_inverse=True)
+    return np.array([f"${price:,.2f}" for price in uniques], dtype=object)[inverse]
+
+
+def _listings(rng, n_rows, pools, missing_rate, duplicate_rate):
+    """Return n_rows raw listings drawn with rng
+    Args:
+        rng(np.random.Generator): Random number generator
+        n_rows(int): Number of rows
+        pools(dict): Amenities and host verifications list strings the
+    rows pick from
+        missing_rate(float): Fraction of missing values of each column
+        duplicate_rate(float): Fraction of rows copied from other rows
+    Returns:
+        (pd.DataFrame): Raw listings with the columns of the raw dataset
+    """
+    room_type = _choice(rng, ROOM_TYPES, n_rows)
+
+    accommodates = np.empty(n_rows)
+    price = np.empty(n_rows)
+    bathrooms_text = np.empty(n_rows, dtype=object)
+    for kind in ROOM_TYPES:
+        mask = room_type == kind
+        size = int(mask.sum())
+        accommodates[mask] = 1 + np.minimum(rng.poisson(ACCOMMODATES[kind], size), 15)
+        price[mask] = PRICES[kind] * rng.lognormal(0.0, 0.6, size)
+        bathrooms_text[mask] = _choice(rng, BATHROOMS_TEXT[kind], size)
+
+    # Bigger places have more rooms and beds and cost more per night
+    bedrooms = np.maximum(1, np.round(accommodates / 2 + rng.normal(0, 0.5, n_rows)))
+    bedrooms[room_type != 'Entire home/apt'] = 1
+    beds = bedrooms + np.minimum(rng.poisson(0.6, n_rows), accommodates)
+    price = np.round(price * (1 + 0.1 * (accommodates - 1)))
+
+    availability_30 = rng.integers(0, 31, n_rows)
+    availability_60 = availability_30 + rng.integers(0, 31, n_rows)
+    availability_90 = availability_60 + rng.integers(0, 31, n_rows)
+    availability_365 = availability_90 + rng.integers(0, 276, n_rows)
+
+    minimum_nights = np.minimum(rng.geometric(0.35, n_rows), 365)
+    maximum_nights = np.maximum(minimum_nights, _choice(
+        rng, {1125: 0.6, 365: 0.15, 30: 0.1, 90: 0.1, 15: 0.05}, n_rows).astype(float))
+
+    # Most hosts answer every message, the others a share of them
+    response_rate = np.where(rng.random(n_rows) < 0.7, 100,
+                             rng.integers(0, 100, n_rows))
+
+    data = pd.DataFrame({
+        'room_type': room_type,
+        'accommodates': accommodates,
+        'bathrooms_text': bathrooms_text,
+        'bedrooms': bedrooms,
+        'beds': beds,
+        'price': _format_prices(price),
+        'host_listings_count': np.minimum(rng.zipf(1.8, n_rows), 500).astype(float),
+        'availability_30': availability_30.astype(float),
+        'availability_60': availability_60.astype(float),
+        'availability_90': availability_90.astype(float),
+        'availability_365': availability_365.astype(float),
+        'number_of_reviews': np.minimum(rng.geometric(0.04, n_rows) - 1, 999).astype(float),
+        'minimum_nights': minimum_nights.astype(float),
+        'maximum_nights': maximum_nights,
+        'neighbourhood_cleansed': np.array(NEIGHBOURHOODS, dtype=object)[
+            rng.choice(len(NEIGHBOURHOODS), n_rows, p=_zipf_weights(len(NEIGHBOURHOODS)))],
+        'host_is_superhost': np.where(rng.random(n_rows) < 0.25, 't', 'f').astype(object),
+        'host_response_time': _choice(rng, RESPONSE_TIMES, n_rows),
+        'host_response_rate': np.char.add(response_rate.astype(str), '%').astype(object),
+        'instant_bookable': np.where(rng.random(n_rows) < 0.4, 't', 'f').astype(object),
+        'host_identity_verified': np.where(rng.random(n_rows) < 0.7, 't', 'f').astype(object),
+        'host_verifications': pools['host_verifications'][
+            rng.integers(0, len(pools['host_verifications']), n_rows)],
+        'amenities': pools['amenities'][rng.integers(0, len(pools['amenities']), n_rows)]
+    }, columns=COLUMNS)
+
+    # The columns dropped on missing values are missing less often
+    for column in COLUMNS:
+        rate = missing_rate / 5 if column in COLUMNS_DROP else missing_rate
+        data.loc[rng.random(n_rows) < rate, column] = np.nan
+
+    rows = np.arange(n_rows)
+    duplicates = rng.random(n_rows) < duplicate_rate
+    rows[duplicates] = rng.integers(0, n_rows, int(duplicates.sum()))
+    return data.take(rows).reset_index(drop=True)
+
+
+def iter_synthetic_listings(n_rows, chunksize=1_000_000, seed=42, missing_rate=0.05,
+                            duplicate_rate=0.01, list_pool_size=100_000):
+    """Yield synthetic raw listings in chunks
+    Args:
+        n_rows(int): Total number of rows
+        chunksize(int): Number of rows of each chunk
+        seed(int): Seed of the generator, each chunk gets its own stream
+        missing_rate(float): Fraction of missing values of each column,
+    a fifth of it for the columns the preprocessing drops rows on
+        duplicate_rate(float): Fraction of rows duplicating another row of
+    their chunk
+        list_pool_size(int): Number of distinct amenities and host
+    verifications lists, at most n_rows
+    Yields:
+        (pd.DataFrame): Chunk of raw listings
+    """
+    seeds = np.random.SeedSequence(seed).spawn(2 + -(-n_rows // chunksize))
+
+    pool_rng = np.random.default_rng(seeds[0])
+    pool_size = max(1, min(n_rows, list_pool_size))
+    pools = {
+        'amenities': _list_pool(pool_rng, AMENITIES, pool_size, 20, '"'),
+        'host_verifications': _list_pool(pool_rng, VERIFICATIONS, min(pool_size, 1000), 3, "'")
+    }
+
+    for index, offset in enumerate(range(0, n_rows, chunksize)):
+        yield _listings(np.random.default_rng(seeds[index + 1]),
+                        min(chunksize, n_rows - offset), pools,
+                        missing_rate, duplicate_rate)
+
+
+def synthetic_listings(n_rows, seed=42, **kwargs):
+    """Return synthetic raw listings as a single DataFrame
+    Args:
+        n_rows(int): Number of rows
+        seed(int): Seed of the generator
+        kwargs: Other arguments of iter_synthetic_listings
+    Returns:
+        (pd.DataFrame): Raw listings
+    """
+    return pd.concat(iter_synthetic_listings(n_rows, seed=seed, **kwargs),
+                     ignore_index=True)
+
+
+def write_synthetic_listings(path, n_rows, chunksize=1_000_000, seed=42, **kwargs):
+    """Write synthetic raw listings chunk by chunk
+    Args:
+        path(str): csv, parquet or feather file to write
+        n_rows(int): Number of rows
+        chunksize(int): Number of rows generated and written at a time
+        seed(int): Seed of the generator
+        kwargs: Other arguments of iter_synthetic_listings
+    Returns:
+        (str): path
+    """
+    with TableWriter(path) as writer:
+        for chunk in iter_synthetic_listings(n_rows, chunksize, seed, **kwargs):
+            writer.write(chunk)
+    return path
+
+
+def process_args(args):
+    """Write a synthetic raw dataset
+    Args:
+        args - command line arguments
+        args.n_rows: Number of rows
+        args.output: csv, parquet or feather file to write
+        args.chunksize: Number of rows generated at a time
+        args.seed: Seed of the generator
+        args.missing_rate: Fraction of missing values of each column
+        args.duplicate_rate: Fraction of duplicated rows
+    """
+    LOGGER.info("Writing %d synthetic listings to %s", args.n_rows, args.output)
+    write_synthetic_listings(args.output, args.n_rows, args.chunksize, args.seed,
+                             missing_rate=args.missing_rate,
+                             duplicate_rate=args.duplicate_rate)
+    LOGGER.info("Wrote %d bytes", os.path.getsize(args.output))
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Generate synthetic raw Airbnb listings",
+        fromfile_prefix_chars="@"
+    )
+
+    PARSER.add_argument(
+        "--n_rows",
+        type=int,
+        help="Number of rows",
+        default=100_000
+    )
+
+    PARSER.add_argument(
+        "--output",
+        type=str,
+        help="csv, parquet or feather file to write",
+        default="raw_data.csv"
+    )
+
+    PARSER.add_argument(
+        "--chunksize",
+        type=int,
+        help="Number of rows generated and written at a time",
+        default=1_000_000
+    )
+
+    PARSER.add_argument(
+        "--seed",
+        type=int,
+        help="Seed of the generator",
+        default=42
+    )
+
+    PARSER.add_argument(
+        "--missing_rate",
+        type=float,
+        help="Fraction of missing values of each column",
+        default=0.05
+    )
+
+    PARSER.add_argument(
+        "--duplicate_rate",
+        type=float,
+        help="Fraction of rows duplicating another row",
+        default=0.01
+    )
+    ARGS = PARSER.parse_args()
+    process_args(ARGS)
@@ -0,0 +1,3 @@
+"""
+Modules shared by the steps of the pipeline.
+"""
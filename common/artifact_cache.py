@@ -0,0 +1,264 @@
+"""
+Local cache of W&B artifacts keyed by the artifact digest. Every step
+goes through it instead of calling `.file()` or `.download()` on the
+artifact, so a rerun of the pipeline does not fetch the same bytes
+again. Csv files also keep a parsed feather copy next to the raw file,
+so a cache hit skips the csv parse as well. A step reading a subset of
+the columns only parses, and keeps, those columns.
+
+The cache is configured by `main.artifact_cache` in config.yaml, which
+main.py exports to the steps through environment variables.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import pandas as pd
+
+from common.artifact_io import get_format, read_table
+from common.instrumentation import phase
+from common.publisher import use_artifact
+from common.schema import downcast
+
+LOGGER = logging.getLogger()
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "mlops_airbnb", "artifacts")
+
+PARSED_FILENAME = "parsed.feather"
+
+# Tables handed between steps running in the same interpreter, None
+# unless main.py runs the steps in process
+_MEMORY_TABLES = None
+
+
+def _parsed_path(entry, columns=None):
+    """Return the path to the parsed copy of a csv artifact, one per set
+    of columns read from it"""
+    if columns is None:
+        return os.path.join(entry, PARSED_FILENAME)
+
+    key = hashlib.sha256(json.dumps(sorted(columns)).encode()).hexdigest()[:16]
+    return os.path.join(entry, f"parsed-{key}.feather")
+
+
+def _directory_size(path):
+    """Return the total size in bytes of the files under path"""
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+class ArtifactCache:
+    """Content-addressed cache of artifacts with a size limit and least
+    recently used eviction. Each entry is a directory named after the
+    artifact digest, holding the downloaded files in `files/` and, for
+    csv artifacts, a parsed feather copy of the table.
+    """
+    def __init__(self, cache_dir=None, max_size_mb=None, enabled=None):
+        self.enabled = enabled if enabled is not None else \
+            os.environ.get("ARTIFACT_CACHE_ENABLED", "true").lower() == "true"
+        self.cache_dir = cache_dir or os.environ.get(
+            "ARTIFACT_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = int(float(max_size_mb or os.environ.get(
+            "ARTIFACT_CACHE_MAX_SIZE_MB", 10240)) * 1024 ** 2)
+
+    def _entry(self, artifact):
+        """Return the cache directory for an artifact"""
+        return os.path.join(self.cache_dir, artifact.digest)
+
+    def download(self, artifact):
+        """Return a local directory with the artifact files, downloading
+        them only on a cache miss
+        Args:
+            artifact(wandb.Artifact): Artifact returned by use_artifact
+        Returns:
+            (str): Path to the directory with the artifact files
+        """
+        if not self.enabled:
+            return artifact.download()
+
+        entry = self._entry(artifact)
+        files = os.path.join(entry, "files")
+
+        if os.path.isdir(files):
+            LOGGER.info("Artifact cache hit for %s", artifact.name)
+            # The modification time of the entry tracks the last use
+            os.utime(entry)
+            return files
+
+        LOGGER.info("Artifact cache miss for %s", artifact.name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.cache_dir, prefix=".staging-")
+        artifact.download(root=os.path.join(staging, "files"))
+
+        try:
+            # Renaming is atomic, a concurrent step may have won the race
+            os.rename(staging, entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict(keep=entry)
+        return files
+
+    def file(self, artifact):
+        """Return the path to the single file of an artifact
+        Args:
+            artifact(wandb.Artifact): Artifact returned by use_artifact
+        Returns:
+            (str): Path to the artifact file
+        """
+        if not self.enabled:
+            return artifact.file()
+
+        files = self.download(artifact)
+        names = os.listdir(files)
+        if len(names) != 1:
+            raise ValueError(
+                f"Artifact {artifact.name} has {len(names)} files, expected one")
+
+        return os.path.join(files, names[0])
+
+    def read_table(self, artifact, columns=None):
+        """Return the table stored in an artifact
+        Args:
+            artifact(wandb.Artifact): Artifact returned by use_artifact
+            columns(list): Columns to read, None reads all of them
+        Returns:
+            (pd.DataFrame): Artifact data, with the columns in the order
+        of columns when given
+        """
+        path = self.file(artifact)
+        if not self.enabled or get_format(path) != "csv":
+            return read_table(path, columns=columns)
+
+        # The parsed copy of the whole table serves any subset of columns
+        entry = self._entry(artifact)
+        for parsed in dict.fromkeys([_parsed_path(entry), _parsed_path(entry, columns)]):
+            if os.path.exists(parsed):
+                return pd.read_feather(parsed, columns=columns)
+
+        # Only the requested columns are parsed and kept
+        data = read_table(path, columns=columns)
+        parsed = _parsed_path(entry, columns)
+        try:
+            # Write then rename so readers never see a partial file
+            data.reset_index(drop=True).to_feather(parsed + ".tmp")
+            os.replace(parsed + ".tmp", parsed)
+        except (ImportError, ValueError, TypeError) as excep:
+            # e.g. pyarrow missing or object columns with mixed types
+            LOGGER.warning("Could not keep a parsed copy of %s: %s",
+                           artifact.name, excep)
+
+        self.evict(keep=entry)
+        if columns is not None and list(data.columns) != list(columns):
+            # The csv parser returns the columns in the order of the file
+            data = data[list(columns)]
+        return data
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits
+        in its size limit
+        Args:
+            keep(str): Entry that must not be evicted
+        """
+        entries = [os.path.join(self.cache_dir, name)
+                   for name in os.listdir(self.cache_dir)
+                   if not name.startswith(".")]
+        sizes = {entry: _directory_size(entry) for entry in entries}
+        total = sum(sizes.values())
+
+        for entry in sorted(entries, key=os.path.getmtime):
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+
+            LOGGER.info("Evicting %s from the artifact cache (last used %s)",
+                        os.path.basename(entry),
+                        time.ctime(os.path.getmtime(entry)))
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
+
+
+def enable_memory_handoff():
+    """Keep the tables published by the steps in memory, so the next steps
+    of an in-process pipeline run read them without touching the disk"""
+    global _MEMORY_TABLES
+    if _MEMORY_TABLES is None:
+        _MEMORY_TABLES = {}
+
+
+def clear_memory_handoff():
+    """Forget the tables handed over in memory, before running the steps
+    again on other data"""
+    if _MEMORY_TABLES is not None:
+        _MEMORY_TABLES.clear()
+
+
+def _memory_key(artifact_name):
+    """Return the in-memory key of an artifact, or None when the name
+    points to a version other than the latest one"""
+    name, _, alias = artifact_name.rpartition("/")[2].partition(":")
+    return name if alias in ("", "latest") else None
+
+
+def keep_table(artifact_name, data):
+    """Hand a published table over to the next in-process steps
+    Args:
+        artifact_name(str): Name of the artifact storing the table
+        data(pd.DataFrame): Table with the dtypes it has when read back
+    """
+    if _MEMORY_TABLES is not None:
+        _MEMORY_TABLES[_memory_key(artifact_name)] = data
+
+
+def artifact_file(run, artifact_name):
+    """Declare the use of an artifact and return the path to its file
+    Args:
+        run(wandb.Run): Current run
+        artifact_name(str): Fully qualified name for the artifact
+    Returns:
+        (str): Path to the artifact file
+    """
+    return ArtifactCache().file(use_artifact(run, artifact_name))
+
+
+def artifact_dir(run, artifact_name):
+    """Declare the use of an artifact and return a directory with its files
+    Args:
+        run(wandb.Run): Current run
+        artifact_name(str): Fully qualified name for the artifact
+    Returns:
+        (str): Path to the directory with the artifact files
+    """
+    return ArtifactCache().download(use_artifact(run, artifact_name))
+
+
+def read_artifact(run, artifact_name, columns=None, schema=None):
+    """Declare the use of an artifact and return the table it stores
+    Args:
+        run(wandb.Run): Current run
+        artifact_name(str): Fully qualified name for the artifact
+        columns(list): Columns to read, None reads all of them
+        schema(dict): Compact dtypes applied to the table, see
+    common/schema.py, None keeps the dtypes of the file
+    Returns:
+        (pd.DataFrame): Artifact data, which must not be modified in place
+    since it may be shared with other in-process steps
+    """
+    artifact = use_artifact(run, artifact_name)
+
+    key = _memory_key(artifact_name)
+    if _MEMORY_TABLES is not None and key in _MEMORY_TABLES:
+        LOGGER.info("Reading %s from memory", artifact_name)
+        data = _MEMORY_TABLES[key]
+        data = data if columns is None else data[columns]
+    else:
+        with phase("read") as timing:
+            data = ArtifactCache().read_table(artifact, columns)
+            timing.rows = len(data)
+
+    return data if schema is None else downcast(data, schema)
@@ -0,0 +1,213 @@
+"""
+Reading and writing of tabular artifacts in csv, parquet or feather
+format. The format is chosen by `main.artifact_format` in config.yaml
+when writing and inferred from the file extension when reading, so
+every step can read the artifacts of the previous one.
+"""
+import pandas as pd
+
+from common.schema import downcast
+
+FORMATS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "feather": ".feather"
+}
+
+# Columns stored as dictionary-encoded categoricals in parquet and feather
+CATEGORICAL_COLUMNS = ['room_type', 'neighbourhood_cleansed']
+
+
+def artifact_filename(name, artifact_format):
+    """Return the file name for an artifact in the given format
+    Args:
+        name(str): File name without extension
+        artifact_format(str): One of csv, parquet or feather
+    Returns:
+        (str): File name with the extension of the format
+    """
+    if artifact_format not in FORMATS:
+        raise ValueError(
+            f"Unknown artifact format {artifact_format}, "
+            f"expected one of {list(FORMATS)}")
+
+    return name + FORMATS[artifact_format]
+
+
+def get_format(path):
+    """Return the artifact format of a file from its extension
+    Args:
+        path(str): Path to the file
+    Returns:
+        (str): One of csv, parquet or feather
+    """
+    for artifact_format, extension in FORMATS.items():
+        if path.endswith(extension) or path.endswith(extension + ".gz"):
+            return artifact_format
+
+    raise ValueError(f"Could not infer the artifact format of {path}")
+
+
+def _categorical_columns(columns):
+    """Return the categorical columns present in columns"""
+    return [column for column in CATEGORICAL_COLUMNS if column in columns]
+
+
+def _to_categorical(data):
+    """Convert the categorical columns of data to pandas categoricals"""
+    for column in _categorical_columns(data.columns):
+        if not pd.api.types.is_categorical_dtype(data[column]):
+            data[column] = data[column].astype("category")
+    return data
+
+
+def as_read(data, path):
+    """Return data with the dtypes read_table gives for a file at path,
+    so tables handed over in memory match the ones read from disk
+    Args:
+        data(pd.DataFrame): Table written to path
+        path(str): Path to a csv, parquet or feather file
+    Returns:
+        (pd.DataFrame): Table with the dtypes of the artifact format
+    """
+    if get_format(path) == "csv":
+        return data
+    return _to_categorical(data)
+
+
+def read_table(path, columns=None, schema=None):
+    """Read a tabular artifact
+    Args:
+        path(str): Path to a csv, parquet or feather file
+        columns(list): Columns to read, None reads all of them
+        schema(dict): Compact dtypes applied to the table, see
+    common/schema.py, None keeps the dtypes of the file
+    Returns:
+        (pd.DataFrame): Artifact data
+    """
+    artifact_format = get_format(path)
+
+    if artifact_format == "csv":
+        data = pd.read_csv(path, usecols=columns)
+    elif artifact_format == "parquet":
+        import pyarrow.parquet as pq
+
+        names = columns if columns is not None else pq.read_schema(path).names
+        table = pq.read_table(path, columns=columns,
+                              read_dictionary=_categorical_columns(names))
+        data = _to_categorical(table.to_pandas())
+    else:
+        data = _to_categorical(pd.read_feather(path, columns=columns))
+
+    return data if schema is None else downcast(data, schema)
+
+
+def _iter_chunks(path, columns, chunksize):
+    """Yield the chunks of a tabular artifact with the dtypes of the file"""
+    artifact_format = get_format(path)
+
+    if artifact_format == "csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+
+    if artifact_format == "parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield _to_categorical(batch.to_pandas())
+        return
+
+    import pyarrow as pa
+
+    # Feather files are memory mapped, slicing them does not copy data
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    for offset in range(0, table.num_rows, chunksize):
+        yield _to_categorical(table.slice(offset, chunksize).to_pandas())
+
+
+def iter_table(path, columns=None, chunksize=100000, schema=None):
+    """Yield a tabular artifact in chunks of rows
+    Args:
+        path(str): Path to a csv, parquet or feather file
+        columns(list): Columns to read, None reads all of them
+        chunksize(int): Number of rows of each chunk
+        schema(dict): Compact dtypes applied to each chunk, see
+    common/schema.py, None keeps the dtypes of the file
+    Yields:
+        (pd.DataFrame): Chunk of the artifact data
+    """
+    for chunk in _iter_chunks(path, columns, chunksize):
+        yield chunk if schema is None else downcast(chunk, schema)
+
+
+def write_table(data, path):
+    """Write a DataFrame as a tabular artifact
+    Args:
+        data(pd.DataFrame): Data to write
+        path(str): Path to the file, its extension sets the format
+    """
+    artifact_format = get_format(path)
+
+    if artifact_format == "csv":
+        data.to_csv(path, index=False)
+    elif artifact_format == "parquet":
+        _to_categorical(data.copy()).to_parquet(path, index=False)
+    else:
+        _to_categorical(data.reset_index(drop=True)).to_feather(path)
+
+
+class TableWriter:
+    """Append DataFrame chunks to a tabular artifact, keeping only the
+    current chunk in memory. Categorical columns are written as plain
+    strings and turned back into categoricals by read_table, since
+    their categories may differ between chunks.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.artifact_format = get_format(path)
+        self.schema = None
+        self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, chunk):
+        """Append a chunk to the artifact
+        Args:
+            chunk(pd.DataFrame): Rows to append
+        """
+        if self.artifact_format == "csv":
+            chunk.to_csv(self.path, index=False, header=self.schema is None,
+                         mode='w' if self.schema is None else 'a')
+            self.schema = list(chunk.columns)
+            return
+
+        import pyarrow as pa
+
+        # Every categorical column, not only CATEGORICAL_COLUMNS, since
+        # feather files hold a single dictionary per column
+        chunk = chunk.astype({column: object for column in chunk.columns
+                              if pd.api.types.is_categorical_dtype(chunk[column])})
+        if self.writer is None:
+            self.schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+            if self.artifact_format == "parquet":
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.path, self.schema)
+
+        self.writer.write_table(
+            pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        """Flush and close the artifact file"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
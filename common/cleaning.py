@@ -0,0 +1,289 @@
+"""
+Cleaning of the raw Airbnb listings, shared by the preprocessing step,
+which fits it on the raw data, and the model export, which carries the
+fitted cleaner so new listings are cleaned exactly as the training data.
+
+Columns such as price, bathrooms_text and host_response_rate hold
+few distinct strings, so each function factorizes the column once,
+cleans only the unique values with the pandas `.str` accessor and
+broadcasts the result back to every row with NumPy indexing.
+"""
+import logging
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.validation import check_is_fitted
+
+LOGGER = logging.getLogger()
+
+COLUMNS = ['room_type', 'accommodates', 'bathrooms_text',
+           'bedrooms', 'beds', 'price', 'host_listings_count',
+           'availability_30', 'availability_60', 'availability_90',
+           'availability_365', 'number_of_reviews', 'minimum_nights',
+           'maximum_nights', 'neighbourhood_cleansed', 'host_is_superhost',
+           'host_response_time', 'host_response_rate', 'instant_bookable',
+           'host_identity_verified', 'host_verifications', 'amenities']
+
+COLUMNS_DROP = ['room_type', 'bathrooms_text', 'price']
+
+COLUMNS_IMPUTER_NUMERICAL = [
+        'accommodates', 'bedrooms', 'beds', 'host_listings_count',
+        'availability_30', 'availability_60', 'availability_90',
+        'availability_365', 'number_of_reviews', 'minimum_nights',
+        'maximum_nights']
+
+COLUMNS_IMPUTER_CATEGORICAL = [
+        'neighbourhood_cleansed', 'host_is_superhost', 'host_response_time',
+        'host_response_rate', 'instant_bookable', 'host_identity_verified',
+        'host_verifications', 'amenities']
+
+INTEGER_COLUMNS = COLUMNS_IMPUTER_NUMERICAL
+
+# Columns of the clean data, in order, bathrooms replaces bathrooms_text
+CLEAN_COLUMNS = COLUMNS_DROP + COLUMNS_IMPUTER_CATEGORICAL + \
+    COLUMNS_IMPUTER_NUMERICAL + ['bathrooms']
+
+# Raw columns kept by the cleaning, in the order fill returns them
+FILL_COLUMNS = [column for column in CLEAN_COLUMNS if column in COLUMNS]
+
+
+def _map_unique(series, clean_unique):
+    """Apply clean_unique over the distinct values of series only
+    Args:
+        series(pd.Series): Column to clean
+        clean_unique(Callable): Function receiving a pd.Series of the
+    distinct non-null values and returning their float values
+    Returns:
+        (pd.Series): Float column aligned with series
+    """
+    if not (pd.api.types.is_object_dtype(series)
+            or pd.api.types.is_string_dtype(series)):
+        return series.astype(float)
+
+    codes, uniques = pd.factorize(series)
+    uniques = pd.Series(uniques, dtype=object)
+
+    # The .str accessor returns NaN for every non-string item, those
+    # values are kept as they are
+    is_string = uniques.str.len().notna()
+    cleaned = uniques.where(~is_string, clean_unique(uniques.where(is_string)))
+
+    # Missing values get the code -1, which points to the appended NaN
+    lookup = np.append(cleaned.to_numpy(dtype=float), np.nan)
+    return pd.Series(lookup[codes], index=series.index, name=series.name)
+
+
+def clean_price(series):
+    """Convert price strings like '$1,234.00' to float
+    Args:
+        series(pd.Series): Raw price column
+    Returns:
+        (pd.Series): Float price column, non-string items are kept as is
+    """
+    return _map_unique(
+        series,
+        lambda values: values.str.slice(1).str.replace(
+            ',', '', regex=False).astype(float))
+
+
+def clean_percentage(series):
+    """Convert percentage strings like '95%' to a float ratio
+    Args:
+        series(pd.Series): Raw percentage column
+    Returns:
+        (pd.Series): Float column with values between 0 and 1
+    """
+    return _map_unique(
+        series,
+        lambda values: values.str.replace(
+            '%', '', regex=False).astype(float) / 100)
+
+
+def clean_bathrooms_text(series):
+    """Extract the number of bathrooms from text like '1.5 shared baths'
+    Args:
+        series(pd.Series): Raw bathrooms_text column
+    Returns:
+        (pd.Series): Float column, text without a leading number
+        (e.g. 'Half-bath') becomes 0.5
+    """
+    def _first_number(values):
+        first_token = values.str.split(' ', n=1).str[0]
+        numbers = pd.to_numeric(first_token, errors='coerce')
+        # Strings whose first token is not a number fall back to half bath
+        return numbers.where(numbers.notna() | values.isna(), 0.5)
+
+    return _map_unique(series, _first_number)
+
+
+def clean_columns(clean_data):
+    """Return the DataFrame with the string and integer columns treated,
+    columns missing from clean_data are skipped
+    Args:
+        clean_data(pd.DataFrame): DataFrame without missing values
+    Returns:
+        (pd.DataFrame): DataFrame with the treated columns
+    """
+    if 'bathrooms_text' in clean_data:
+        LOGGER.debug("Treating bathrooms_text column")
+        clean_data['bathrooms'] = clean_bathrooms_text(clean_data['bathrooms_text'])
+        del clean_data['bathrooms_text']
+
+    if 'price' in clean_data:
+        LOGGER.debug("Treating price column")
+        clean_data['price'] = clean_price(clean_data['price'])
+
+    if 'host_response_rate' in clean_data:
+        LOGGER.debug("Treating host_response_rate column")
+        clean_data["host_response_rate"] = clean_percentage(
+            clean_data["host_response_rate"])
+
+    LOGGER.debug("Treating integer column")
+    integer_columns = [column for column in INTEGER_COLUMNS if column in clean_data]
+    clean_data[integer_columns] = clean_data[integer_columns].round(
+        0).astype(int)
+
+    return clean_data
+
+
+def _median_from_counts(counts):
+    """Return the median of the values counted in counts"""
+    if counts.empty:
+        return np.nan
+
+    counts = counts.sort_index()
+    cumulative = counts.cumsum().to_numpy()
+    total = cumulative[-1]
+    lower = counts.index[np.searchsorted(cumulative, (total - 1) // 2, side='right')]
+    upper = counts.index[np.searchsorted(cumulative, total // 2, side='right')]
+    return (lower + upper) / 2
+
+
+def _most_frequent_from_counts(counts):
+    """Return the most frequent value, the smallest one on ties,
+    as SimpleImputer does"""
+    if counts.empty:
+        return np.nan
+
+    return min(counts.index[counts == counts.max()])
+
+
+class ListingCleaner(BaseEstimator, TransformerMixin):
+    """Fill the missing values of the raw listings and clean their string
+    columns. fit learns the median of each numerical column and the most
+    frequent value of each categorical column, the values SimpleImputer
+    learns, and transform applies them to any batch, from a single listing
+    to a whole dataset, without refitting.
+
+    fit counts every value exactly. partial_fit updates the statistics one
+    chunk at a time: numerical columns keep exact value counts, which stay
+    small since they hold few distinct values, while categorical columns
+    keep a Misra-Gries sketch of the max_categories largest counters, exact
+    unless the column has more distinct values than that. The counts are not kept when the cleaner is
+    pickled, only the learned fill_values_.
+
+    transform leaves the listings already clean unchanged, so the cleaner
+    can be put in front of the model whatever data it receives.
+    """
+    def __init__(self, max_categories=10000):
+        self.max_categories = max_categories
+
+    def fit(self, X, y=None):
+        """Learn the fill values of the listings in X, from exact counts
+        Args:
+            X(pd.DataFrame): Raw listings
+            y: Ignored
+        Returns:
+            (ListingCleaner): Fitted cleaner
+        """
+        for attribute in ("counts_", "fill_values_"):
+            if hasattr(self, attribute):
+                delattr(self, attribute)
+
+        return self._update(X, max_categories=None)
+
+    def partial_fit(self, X, y=None):
+        """Update the fill values with a chunk of listings
+        Args:
+            X(pd.DataFrame): Chunk of raw listings
+            y: Ignored
+        Returns:
+            (ListingCleaner): Fitted cleaner
+        """
+        return self._update(X, max_categories=self.max_categories)
+
+    def _update(self, X, max_categories):
+        """Add the value counts of X and learn the fill values, the
+        categorical counts are truncated to max_categories counters, None
+        keeps them exact"""
+        if not hasattr(self, "counts_"):
+            self.counts_ = {column: pd.Series(dtype=float) for column in
+                            COLUMNS_IMPUTER_NUMERICAL + COLUMNS_IMPUTER_CATEGORICAL}
+
+        for column, column_counts in self.counts_.items():
+            column_counts = column_counts.add(X[column].value_counts(), fill_value=0)
+
+            if max_categories is not None and len(column_counts) > max_categories and \
+                    column in COLUMNS_IMPUTER_CATEGORICAL:
+                # Largest counts first, the smallest value first on ties, so
+                # the max_categories counters kept are always the same ones
+                # and hold the value SimpleImputer picks when all counts tie
+                column_counts = column_counts.sort_index().sort_values(
+                    ascending=False, kind="mergesort")
+                threshold = column_counts.iloc[max_categories]
+                column_counts = column_counts.iloc[:max_categories] - threshold
+
+            self.counts_[column] = column_counts
+
+        self.fill_values_ = {}
+        for column in COLUMNS_IMPUTER_NUMERICAL:
+            self.fill_values_[column] = _median_from_counts(self.counts_[column])
+        for column in COLUMNS_IMPUTER_CATEGORICAL:
+            self.fill_values_[column] = _most_frequent_from_counts(self.counts_[column])
+
+        return self
+
+    def transform(self, X):
+        """Return the clean listings
+        Args:
+            X(pd.DataFrame): Raw or clean listings
+        Returns:
+            (pd.DataFrame): Listings with the columns of the clean data
+        present in X, without missing values in the imputed columns
+        """
+        return clean_columns(self.fill(X))
+
+    def fill(self, X, copy=True):
+        """Return the listings with their missing values filled, before
+        the string columns are cleaned. The columns are filled in place,
+        inside the blocks of the frame, so their dtypes are kept and no
+        column is copied
+        Args:
+            X(pd.DataFrame): Raw or clean listings
+            copy(bool): Fill a copy of X, with False X is filled in place
+        when it holds exactly the columns of the clean data, in order
+        Returns:
+            (pd.DataFrame): Listings with the columns of the clean data
+        present in X, without missing values in the imputed columns
+        """
+        check_is_fitted(self, "fill_values_")
+
+        columns = [column for column in CLEAN_COLUMNS if column in X]
+        if copy or list(X.columns) != columns:
+            # A new frame, not a view of X, so it can be filled in place
+            X = X.reindex(columns=columns)
+
+        values = {column: value for column, value in self.fill_values_.items()
+                  if column in columns}
+        for column, value in values.items():
+            if pd.api.types.is_categorical_dtype(X[column]) and \
+                    value not in X[column].cat.categories:
+                X[column] = X[column].cat.add_categories([value])
+
+        X.fillna(values, inplace=True)
+        return X
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("counts_", None)
+        return state
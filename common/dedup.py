@@ -0,0 +1,118 @@
+"""
+Deduplication of the raw listings by row fingerprint. A FingerprintSet
+keeps the sorted 64-bit fingerprints of the rows kept so far, 8 bytes a
+row whatever the width of the row, so duplicates are found across the
+chunks of a streamed dataset without holding its rows in memory.
+
+Given a file, the set starts from the fingerprints saved there by a
+previous run and saves the union back once the run succeeds: rows of an
+earlier snapshot of the listings are then dropped from the next one, so
+each monthly snapshot only brings the listings not seen before. Running
+the same snapshot twice against the same file keeps no row the second
+time; remove the file to start over.
+"""
+import logging
+import os
+import numpy as np
+
+LOGGER = logging.getLogger()
+
+
+def _isin_sorted(values, sorted_values):
+    """Return whether each value is in the sorted array sorted_values"""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+
+    position = np.searchsorted(sorted_values, values).clip(max=len(sorted_values) - 1)
+    return sorted_values[position] == values
+
+
+def _merge_sorted(values, other):
+    """Return the sorted union of two disjoint sorted arrays"""
+    return np.insert(values, np.searchsorted(values, other), other)
+
+
+class FingerprintSet:
+    """Set of the fingerprints of the rows kept, optionally persisted
+    Args:
+        path(str): .npy file the set is loaded from, when it exists, and
+    saved to, None keeps the set in memory only
+    """
+    def __init__(self, path=None):
+        self.path = os.path.expanduser(path) if path is not None else None
+
+        self.previous = np.array([], dtype=np.uint64)
+        if self.path is not None and os.path.exists(self.path):
+            self.previous = np.load(self.path)
+            LOGGER.info("Loaded %d fingerprints from %s", len(self.previous), self.path)
+        # Fingerprints kept by this run, as sorted runs of decreasing sizes
+        self._runs = []
+
+        # Rows dropped for repeating a row of this run, and for repeating
+        # a row of a previous run
+        self.duplicates = 0
+        self.seen = 0
+
+    @property
+    def kept(self):
+        """Sorted fingerprints of the rows kept by this run"""
+        while len(self._runs) > 1:
+            last = self._runs.pop()
+            self._runs[-1] = _merge_sorted(self._runs[-1], last)
+        return self._runs[0] if self._runs else np.array([], dtype=np.uint64)
+
+    @property
+    def removed(self):
+        """Number of rows dropped so far"""
+        return self.duplicates + self.seen
+
+    def keep(self, fingerprints):
+        """Return the rows to keep, those whose fingerprint is new, and
+        add their fingerprints to the set
+        Args:
+            fingerprints(np.ndarray): uint64 fingerprint of each row
+        Returns:
+            (np.ndarray): Boolean mask, True for the first occurrence of
+        each fingerprint not in the set
+        """
+        # Looked up in sorted order, which walks the sorted sets forward
+        # instead of jumping at random in them. The stable sort puts the
+        # first occurrence of a repeated fingerprint first
+        order = np.argsort(fingerprints, kind="stable")
+        ordered = fingerprints[order]
+
+        seen = _isin_sorted(ordered, self.previous)
+        repeated = np.zeros(len(ordered), dtype=bool)
+        repeated[1:] = ordered[1:] == ordered[:-1]
+        for run in self._runs:
+            repeated |= _isin_sorted(ordered, run)
+        new = ~seen & ~repeated
+
+        self.seen += int(seen.sum())
+        self.duplicates += int((~seen & repeated).sum())
+
+        # A run is merged into the older one once it is half its size, so
+        # each fingerprint is merged a logarithmic number of times and a
+        # chunk is looked up in a logarithmic number of runs
+        if new.any():
+            self._runs.append(ordered[new])
+        while len(self._runs) > 1 and 2 * len(self._runs[-1]) >= len(self._runs[-2]):
+            last = self._runs.pop()
+            self._runs[-1] = _merge_sorted(self._runs[-1], last)
+
+        keep = np.empty(len(fingerprints), dtype=bool)
+        keep[order] = new
+        return keep
+
+    def save(self):
+        """Write the fingerprints of the previous runs and of this one to
+        the file of the set, the file is replaced only once written"""
+        if self.path is None:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fingerprints = np.union1d(self.previous, self.kept)
+        with open(self.path + ".tmp", "wb") as fp:
+            np.save(fp, fingerprints)
+        os.replace(self.path + ".tmp", self.path)
+        LOGGER.info("Saved %d fingerprints to %s", len(fingerprints), self.path)
@@ -0,0 +1,297 @@
+"""
+Download of the raw dataset over HTTP with the standard library. When the
+server accepts byte ranges the file is fetched as fixed-size chunks by a
+thread pool, each written at its offset of a `.part` file, and the chunks
+already on disk are listed in a `.part.json` state file. A download that
+fails partway is resumed from that state by the next run, as long as the
+remote file did not change, instead of starting from zero.
+
+The completed file is checked against an expected sha256 when one is
+given, and gzip sources are decompressed as a stream into the csv file
+the artifact is made of, without holding the data in memory. Servers
+without range support get a single streamed request.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger()
+
+BLOCK_SIZE = 2 ** 20
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Direct download endpoint of Google Drive, which accepts byte ranges and
+# skips the confirmation page of large files
+DRIVE_URL = "https://drive.usercontent.google.com/download?id={}&export=download&confirm=t"
+
+
+def resolve_url(url):
+    """Return the direct download url of a Google Drive sharing url, or
+    the url itself
+    Args:
+        url(str): Url of the file
+    Returns:
+        (str): Url to download from
+    """
+    parsed = urllib.parse.urlparse(url)
+    if not parsed.netloc.endswith("drive.google.com"):
+        return url
+
+    file_id = urllib.parse.parse_qs(parsed.query).get("id", [None])[0]
+    match = re.search(r"/file/d/([^/]+)", parsed.path)
+    if match:
+        file_id = match.group(1)
+    if file_id is None:
+        raise ValueError(f"Could not find the file id of {url}")
+
+    return DRIVE_URL.format(file_id)
+
+
+def _request(url, start=None, end=None, method="GET"):
+    """Open a request, for the bytes start to end included when given"""
+    request = urllib.request.Request(url, method=method)
+    if start is not None:
+        request.add_header("Range", f"bytes={start}-{end}")
+    return urllib.request.urlopen(request, timeout=60)
+
+
+def probe(url):
+    """Return what the server tells about a file before downloading it
+    Args:
+        url(str): Url of the file
+    Returns:
+        (int, bool, str): Size in bytes (None when unknown), whether byte
+    ranges are accepted, and a validator of the remote version (ETag or
+    Last-Modified, None when missing)
+    """
+    # A one-byte range request works on servers not answering HEAD
+    with _request(url, 0, 0) as response:
+        headers = response.headers
+        validator = headers.get("ETag") or headers.get("Last-Modified")
+
+        content_range = headers.get("Content-Range", "")
+        if response.status == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            return (int(total) if total != "*" else None), True, validator
+
+        length = headers.get("Content-Length")
+        return (int(length) if length else None), False, validator
+
+
+def sha256_file(path):
+    """Return the sha256 hex digest of a file
+    Args:
+        path(str): Path to the file
+    Returns:
+        (str): Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ChunkedDownload:
+    """Resumable download of a url to a file, in parallel byte ranges
+    Args:
+        url(str): Url of the file
+        path(str): Destination of the downloaded bytes
+        chunk_size(int): Bytes of each range request
+        n_workers(int): Range requests in flight at the same time
+        max_retries(int): Attempts per chunk before giving up
+    """
+    def __init__(self, url, path, chunk_size=8 * 2 ** 20, n_workers=4, max_retries=5):
+        self.url = url
+        self.path = path
+        self.chunk_size = chunk_size
+        self.n_workers = n_workers
+        self.max_retries = max_retries
+
+        self.part_path = path + ".part"
+        self.state_path = path + ".part.json"
+        self.lock = threading.Lock()
+        self.state = None
+
+    def _load_state(self, size, validator):
+        """Return the chunks already downloaded by a previous attempt of the
+        same remote file, forgetting them when anything changed"""
+        expected = {"url": self.url, "size": size, "validator": validator,
+                    "chunk_size": self.chunk_size}
+        state = None
+        if os.path.exists(self.state_path) and os.path.exists(self.part_path):
+            with open(self.state_path) as fp:
+                state = json.load(fp)
+
+        if state is None or validator is None or \
+                any(state.get(key) != value for key, value in expected.items()):
+            if state is not None:
+                LOGGER.info("Remote file changed, restarting the download")
+            with open(self.part_path, "wb") as fp:
+                fp.truncate(size)
+            state = dict(expected, done=[])
+        elif state["done"]:
+            LOGGER.info("Resuming the download, %d chunks already on disk",
+                        len(state["done"]))
+
+        self.state = state
+        self._save_state()
+
+    def _save_state(self):
+        """Write the state file, then rename it so it is never partial"""
+        with open(self.state_path + ".tmp", "w") as fp:
+            json.dump(self.state, fp)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _fetch_chunk(self, index, size):
+        """Download one chunk into its place of the part file, retrying
+        with an exponential backoff"""
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, size) - 1
+
+        for attempt in range(self.max_retries):
+            try:
+                with _request(self.url, start, end) as response, \
+                        open(self.part_path, "r+b") as fp:
+                    if response.status != 206:
+                        raise IOError(f"Range request answered with {response.status}")
+                    fp.seek(start)
+                    written = 0
+                    for block in iter(lambda: response.read(BLOCK_SIZE), b""):
+                        fp.write(block)
+                        written += len(block)
+                if written != end - start + 1:
+                    raise IOError(f"Chunk {index} truncated at {written} bytes")
+                break
+            except (IOError, OSError) as excep:
+                if attempt + 1 == self.max_retries:
+                    raise
+                LOGGER.warning("Chunk %d failed (%s), retrying", index, excep)
+                time.sleep(2 ** attempt)
+
+        with self.lock:
+            self.state["done"].append(index)
+            self._save_state()
+
+    def _fetch_stream(self):
+        """Download the whole file in a single request"""
+        with _request(self.url) as response, open(self.part_path, "wb") as fp:
+            shutil.copyfileobj(response, fp, length=BLOCK_SIZE)
+
+    def run(self):
+        """Download the file, resuming a previous attempt when possible
+        Returns:
+            (str): Path to the downloaded file
+        """
+        size, accepts_ranges, validator = probe(self.url)
+
+        if not accepts_ranges or size is None:
+            LOGGER.info("Server does not accept byte ranges, downloading in one request")
+            self._fetch_stream()
+        else:
+            self._load_state(size, validator)
+            n_chunks = -(-size // self.chunk_size)
+            missing = sorted(set(range(n_chunks)) - set(self.state["done"]))
+            LOGGER.info("Downloading %d bytes in %d chunks (%d missing) with %d workers",
+                        size, n_chunks, len(missing), self.n_workers)
+
+            with ThreadPoolExecutor(self.n_workers) as executor:
+                # Raises the first error, the chunks done so far are kept
+                list(executor.map(lambda index: self._fetch_chunk(index, size), missing))
+
+        os.replace(self.part_path, self.path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return self.path
+
+
+def is_gzip(path):
+    """Check whether a file starts with the gzip magic number"""
+    with open(path, "rb") as fp:
+        return fp.read(2) == GZIP_MAGIC
+
+
+def decompress_file(path, output_path):
+    """Decompress a gzip file as a stream, block by block
+    Args:
+        path(str): Path to the gzip file
+        output_path(str): Path to the decompressed file
+    Returns:
+        (str): output_path
+    """
+    with gzip.open(path, "rb") as source, open(output_path, "wb") as target:
+        shutil.copyfileobj(source, target, length=BLOCK_SIZE)
+    return output_path
+
+
+def validate_csv(path):
+    """Check that a downloaded file looks like a csv table rather than an
+    error or confirmation html page
+    Args:
+        path(str): Path to the csv file, gzip compressed or not
+    """
+    opener = gzip.open if is_gzip(path) else open
+    with opener(path, "rb") as fp:
+        header = fp.readline(BLOCK_SIZE).decode("utf-8", errors="replace").strip()
+
+    if header.lower().startswith(("<!doctype", "<html")):
+        raise ValueError(f"{path} is an html page, not a csv file")
+    if header.count(",") < 1:
+        raise ValueError(f"{path} does not have a csv header: {header[:100]}")
+
+
+def download_csv(url, output_dir, filename, sha256=None, chunk_size=8 * 2 ** 20,
+                 n_workers=4, decompress=True):
+    """Download a csv, or gzip compressed csv, file
+    Args:
+        url(str): Url of the file, Google Drive sharing urls are resolved
+        output_dir(str): Directory of the download, where partial
+    downloads are kept to be resumed
+        filename(str): Name of the csv file to produce
+        sha256(str): Expected sha256 of the downloaded bytes, None skips
+    the check
+        chunk_size(int): Bytes of each range request
+        n_workers(int): Range requests in flight at the same time
+        decompress(bool): Decompress gzip sources into filename, otherwise
+    keep them as filename.gz
+    Returns:
+        (str): Path to the csv file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    url = resolve_url(url)
+
+    # One partial download per url, resumed by the next run
+    key = hashlib.sha1(url.encode()).hexdigest()[:16]
+    path = ChunkedDownload(url, os.path.join(output_dir, f"{key}.download"),
+                           chunk_size, n_workers).run()
+
+    if sha256 is not None:
+        digest = sha256_file(path)
+        if digest != sha256.lower():
+            os.remove(path)
+            raise ValueError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+        LOGGER.info("Checksum verified: %s", digest)
+
+    output_path = os.path.join(output_dir, filename)
+    if is_gzip(path):
+        if decompress:
+            LOGGER.info("Decompressing the gzip source into %s", filename)
+            decompress_file(path, output_path)
+            os.remove(path)
+        else:
+            output_path += ".gz"
+            os.replace(path, output_path)
+    else:
+        os.replace(path, output_path)
+
+    validate_csv(output_path)
+    return output_path
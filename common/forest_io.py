@@ -0,0 +1,263 @@
+"""
+Compact export and vectorized inference of a fitted random forest. The
+nodes of all the trees are packed into a few flat numpy arrays (split
+feature, threshold, children and leaf class probabilities) saved as .npy
+files, next to a small json file with the classes and feature names.
+
+Loading maps the arrays into memory instead of unpickling the estimator,
+so it costs a few milliseconds whatever the size of the forest, and
+several scoring processes reading the same export share one copy of the
+trees through the page cache.
+
+When the model is a Pipeline ending with the forest, as with the list
+features of common/list_features.py, the steps before the forest are
+pickled next to the arrays and applied to each block of rows.
+
+Prediction walks every tree over a whole batch at once, one tree level
+per step, instead of calling `predict_proba` on each estimator. The
+children of a leaf are the leaf itself, so after as many steps as the
+depth of the deepest tree every row sits on a leaf of every tree without
+any per-row branching.
+"""
+import json
+import os
+import pickle
+import numpy as np
+from scipy import sparse
+
+COMPACT_DIRNAME = "compact_forest"
+META_FILENAME = "forest.json"
+FEATURES_FILENAME = "features.pkl"
+
+# Arrays of the export: one entry per tree in roots, one entry per node
+# of every tree in the others
+ARRAYS = ("roots", "feature", "threshold", "children", "value")
+
+# Number of (row, tree) pairs walked at once, bounding the memory used
+# by the intermediate arrays of a prediction
+BLOCK_SIZE = 2 ** 20
+
+
+def _normalized_values(tree):
+    """Return the class probabilities of the nodes of a tree, as returned
+    by DecisionTreeClassifier.predict_proba for the rows reaching them"""
+    import sklearn
+    from sklearn.utils.fixes import parse_version
+
+    value = tree.value[:, 0, :].astype(np.float64)
+    # From sklearn 1.4 tree_.value holds class fractions, used as is
+    if parse_version(sklearn.__version__) >= parse_version("1.4"):
+        return value
+
+    normalizer = value.sum(axis=1, keepdims=True)
+    normalizer[normalizer == 0.0] = 1.0
+    return value / normalizer
+
+
+def pack_forest(rf, feature_names=None):
+    """Pack the trees of a fitted forest into flat arrays
+    Args:
+        rf(RandomForestClassifier): Fitted single-output forest
+        feature_names(list): Names of the features, defaults to the ones
+    the forest was fitted on
+    Returns:
+        (dict, dict): Arrays keyed by name and the forest metadata
+    """
+    if rf.n_outputs_ != 1:
+        raise ValueError("Only single-output forests can be packed")
+
+    trees = [estimator.tree_ for estimator in rf.estimators_]
+    roots = np.cumsum([0] + [tree.node_count for tree in trees])[:-1]
+
+    features, children = [], []
+    for tree, root in zip(trees, roots):
+        nodes = np.arange(tree.node_count)
+        leaf = tree.children_left == -1
+
+        # Leaves loop onto themselves and read any feature, here the first
+        features.append(np.where(leaf, 0, tree.feature))
+        children.append(root + np.where(
+            leaf[:, None], nodes[:, None],
+            np.column_stack([tree.children_left, tree.children_right])))
+
+    arrays = {
+        "roots": roots.astype(np.int64),
+        "feature": np.concatenate(features).astype(np.int32),
+        "threshold": np.concatenate([tree.threshold for tree in trees]),
+        "children": np.concatenate(children).astype(np.int32),
+        "value": np.concatenate([_normalized_values(tree) for tree in trees])
+    }
+
+    if feature_names is None:
+        feature_names = getattr(rf, "feature_names_in_", None)
+
+    meta = {
+        "classes": rf.classes_.tolist(),
+        "n_features": int(rf.n_features_in_),
+        "feature_names": None if feature_names is None else list(feature_names),
+        "max_depth": int(max(tree.max_depth for tree in trees))
+    }
+    return arrays, meta
+
+
+def save_forest(rf, path, feature_names=None):
+    """Save the trees of a fitted forest as flat memory-mappable arrays
+    Args:
+        rf(RandomForestClassifier or Pipeline): Fitted single-output
+    forest, or Pipeline whose last step is one
+        path(str): Directory receiving the export, created if needed
+        feature_names(list): Names of the features, defaults to the ones
+    the model was fitted on
+    Returns:
+        (int): Size in bytes of the export
+    """
+    features = None
+    if hasattr(rf, "steps"):
+        features = rf[:-1]
+        if feature_names is None:
+            feature_names = getattr(features, "feature_names_in_", None)
+        rf = rf[-1]
+
+    arrays, meta = pack_forest(rf, feature_names)
+
+    os.makedirs(path, exist_ok=True)
+    features_path = os.path.join(path, FEATURES_FILENAME)
+    if features is not None:
+        with open(features_path, "wb") as fp:
+            pickle.dump(features, fp)
+    elif os.path.exists(features_path):
+        os.remove(features_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+    with open(os.path.join(path, META_FILENAME), "w") as fp:
+        json.dump(meta, fp)
+
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class CompactForest:
+    """Random forest packed into flat arrays, predicting the same classes
+    and probabilities as the RandomForestClassifier it was packed from.
+    features, when given, turns the rows received into the forest inputs
+    """
+    def __init__(self, arrays, meta, features=None):
+        self.features = features
+        self.roots = arrays["roots"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.children = arrays["children"]
+        self.value = arrays["value"]
+        self.max_depth = meta["max_depth"]
+
+        self.classes_ = np.array(meta["classes"])
+        self.n_features_in_ = meta["n_features"]
+        if meta["feature_names"] is not None:
+            self.feature_names_in_ = np.array(meta["feature_names"], dtype=object)
+
+    @classmethod
+    def from_estimator(cls, rf):
+        """Pack a fitted RandomForestClassifier"""
+        return cls(*pack_forest(rf))
+
+    @property
+    def n_estimators(self):
+        """Number of trees of the forest"""
+        return len(self.roots)
+
+    def _validate(self, X):
+        """Return X as a C-ordered float32 array, as sklearn casts it
+        before walking the trees"""
+        if self.features is not None:
+            X = self.features.transform(X)
+        if sparse.issparse(X):
+            X = X.toarray()
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has shape {X.shape}, expected "
+                             f"{self.n_features_in_} features")
+        return X
+
+    def _apply(self, X):
+        """Return the leaf reached by each row of a validated X in each
+        tree, shape (n_estimators, n_rows)"""
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        children = self.children.ravel()
+
+        node = np.repeat(np.asarray(self.roots)[:, None], n_rows, axis=1)
+        row_start = np.arange(n_rows) * n_features
+
+        # One tree level per step for every (tree, row) pair, rows go
+        # left when x <= threshold so missing values go right as in sklearn
+        for _ in range(self.max_depth):
+            go_right = ~(flat[row_start + self.feature[node]] <= self.threshold[node])
+            node = children[2 * node + go_right]
+
+        return node
+
+    def apply(self, X):
+        """Return the leaf reached by each row in each tree
+        Args:
+            X(array-like): Rows to predict, features in the fitted order
+        Returns:
+            (np.ndarray): Leaf positions, shape (n_rows, n_estimators)
+        """
+        block = max(1, BLOCK_SIZE // self.n_estimators)
+        if len(X) == 0:
+            return self._apply(self._validate(X)).T
+
+        return np.concatenate(
+            [self._apply(self._validate(X[start:start + block])).T
+             for start in range(0, len(X), block)])
+
+    def predict_proba(self, X):
+        """Return the class probabilities averaged over the trees
+        Args:
+            X(array-like): Rows to predict, features in the fitted order
+        Returns:
+            (np.ndarray): Probabilities, shape (n_rows, n_classes)
+        """
+        proba = np.empty((len(X), len(self.classes_)))
+        block = max(1, BLOCK_SIZE // self.n_estimators)
+
+        # Rows are validated block by block, so the features of a large
+        # batch are never densified at once
+        for start in range(0, len(X), block):
+            leaves = self._apply(self._validate(X[start:start + block]))
+            # Reducing the first axis adds the trees one after the other,
+            # in the same order and rounding as sklearn
+            proba[start:start + block] = np.add.reduce(self.value[leaves], axis=0)
+
+        return proba / self.n_estimators
+
+    def predict(self, X):
+        """Return the class with the highest mean probability
+        Args:
+            X(array-like): Rows to predict, features in the fitted order
+        Returns:
+            (np.ndarray): Predicted classes
+        """
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+def load_forest(path, mmap=True):
+    """Load a compact forest export
+    Args:
+        path(str): Directory written by save_forest
+        mmap(bool): Map the arrays read-only instead of reading them
+    Returns:
+        (CompactForest): Forest ready to predict
+    """
+    with open(os.path.join(path, META_FILENAME)) as fp:
+        meta = json.load(fp)
+
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"),
+                            mmap_mode="r" if mmap else None)
+              for name in ARRAYS}
+
+    features = None
+    if os.path.exists(os.path.join(path, FEATURES_FILENAME)):
+        with open(os.path.join(path, FEATURES_FILENAME), "rb") as fp:
+            features = pickle.load(fp)
+
+    return CompactForest(arrays, meta, features)
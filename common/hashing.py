@@ -0,0 +1,124 @@
+"""
+Deterministic hashing of table rows. A row hash depends only on the
+values of the row, not on its position, the chunk it was read in or the
+dtype a column happened to be parsed with, so the same listing hashes
+the same way in every run and after new rows are appended.
+
+Mixing a row hash with a seed gives a number uniform in [0, 1) used to
+assign the row to a split without shuffling, or reading, the whole
+table.
+
+Row fingerprints serve the same purpose for deduplication, computed
+faster on wide rows of long strings: each distinct value of a column is
+hashed once, as listings share their amenities and verifications lists,
+and the column hashes are mixed into one 64-bit number per row.
+"""
+import numpy as np
+import pandas as pd
+
+# Constants of the splitmix64 finalizer
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_2 = np.uint64(0x94D049BB133111EB)
+
+# Hash of a missing value in a row fingerprint
+MISSING_HASH = np.uint64(0x5BD1E9955BD1E995)
+
+
+def row_hashes(data, columns=None):
+    """Return a 64-bit hash of each row
+    Args:
+        data(pd.DataFrame): Rows to hash
+        columns(list): Columns making the key of a row, None uses all
+    Returns:
+        (np.ndarray): uint64 hash of each row
+    """
+    key = data if columns is None else data[list(columns)]
+
+    # Numbers are hashed as floats, so 3 and 3.0 hash alike whether a
+    # column was read as integers or as floats with missing values
+    key = key.apply(lambda column: column.astype(np.float64)
+                    if pd.api.types.is_numeric_dtype(column)
+                    and not pd.api.types.is_bool_dtype(column)
+                    else column.astype(object))
+
+    return pd.util.hash_pandas_object(key, index=False).to_numpy(dtype=np.uint64)
+
+
+def mix_seed(hashes, seed):
+    """Return the hashes mixed with a seed by the splitmix64 finalizer
+    Args:
+        hashes(np.ndarray): uint64 hashes
+        seed(int): Seed, different seeds give independent results
+    Returns:
+        (np.ndarray): uint64 mixed hashes
+    """
+    with np.errstate(over="ignore"):
+        mixed = hashes ^ (np.uint64(seed) * GOLDEN_GAMMA)
+        mixed = (mixed ^ (mixed >> np.uint64(30))) * MIX_1
+        mixed = (mixed ^ (mixed >> np.uint64(27))) * MIX_2
+        return mixed ^ (mixed >> np.uint64(31))
+
+
+def unit_interval(hashes):
+    """Map uint64 hashes to floats uniform in [0, 1)
+    Args:
+        hashes(np.ndarray): uint64 hashes
+    Returns:
+        (np.ndarray): float64 values, from the 53 highest bits
+    """
+    return (hashes >> np.uint64(11)).astype(np.float64) / float(2 ** 53)
+
+
+def hash_split(data, test_size, seed, columns=None):
+    """Assign each row to the test split from the hash of its key
+    Args:
+        data(pd.DataFrame): Rows to assign
+        test_size(float): Expected fraction of rows in the test split
+        seed(int): Seed of the assignment
+        columns(list): Columns making the key of a row, None uses all
+    Returns:
+        (np.ndarray): Boolean mask, True for the rows of the test split
+    """
+    return unit_interval(mix_seed(row_hashes(data, columns), seed)) < test_size
+
+
+def _column_hashes(column):
+    """Return a uint64 hash of each value of a column, hashing each
+    distinct value once"""
+    if pd.api.types.is_categorical_dtype(column):
+        codes, uniques = column.cat.codes.to_numpy(), column.cat.categories
+    else:
+        codes, uniques = pd.factorize(column)
+        uniques = pd.Index(uniques)
+
+    # Numbers are hashed as floats, as in row_hashes
+    if pd.api.types.is_numeric_dtype(uniques) and \
+            not pd.api.types.is_bool_dtype(uniques):
+        values = uniques.to_numpy(dtype=np.float64)
+    else:
+        values = uniques.to_numpy(dtype=object)
+
+    # Missing values get the code -1, which points to the appended hash
+    lookup = np.append(pd.util.hash_array(values, categorize=False), MISSING_HASH)
+    return lookup[codes]
+
+
+def row_fingerprints(data, columns=None):
+    """Return a 64-bit fingerprint of each row, equal for rows with equal
+    values. Two distinct rows share a fingerprint with a probability of
+    about 2^-64, negligible for the size of the listings datasets
+    Args:
+        data(pd.DataFrame): Rows to fingerprint
+        columns(list): Columns making the key of a row, None uses all
+    Returns:
+        (np.ndarray): uint64 fingerprint of each row
+    """
+    columns = list(data.columns if columns is None else columns)
+
+    fingerprints = np.zeros(len(data), dtype=np.uint64)
+    for position, column in enumerate(columns):
+        # Mixing with the position makes the fingerprint depend on the
+        # column order, as for a tuple
+        fingerprints = mix_seed(fingerprints ^ _column_hashes(data[column]), position)
+    return fingerprints
@@ -0,0 +1,145 @@
+"""
+Skip-if-unchanged execution of the pipeline steps. A step fingerprint
+combines the digests of its input artifacts, its slice of config.yaml
+and the hash of its source files. After a successful run main.py
+records the fingerprint with the digests of the produced artifacts, and
+a later run with the same fingerprint is skipped while those artifacts
+are still the latest versions.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from common.publisher import ArtifactNotFoundError, local_store
+
+LOGGER = logging.getLogger()
+
+
+def hash_sources(paths):
+    """Return the hash of every source file under paths
+    Args:
+        paths(list): Files or directories to hash
+    Returns:
+        (str): Hex digest of the files content
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        files = [path] if os.path.isfile(path) else []
+        for root, dirs, names in os.walk(path):
+            # Skip caches such as __pycache__ and .pytest_cache
+            dirs[:] = sorted(name for name in dirs
+                             if not name.startswith((".", "__")))
+            files.extend(os.path.join(root, name) for name in sorted(names)
+                         if not name.endswith(".pyc"))
+
+        for filename in files:
+            digest.update(os.path.relpath(filename, os.path.dirname(path)).encode())
+            with open(filename, "rb") as fp:
+                digest.update(fp.read())
+
+    return digest.hexdigest()
+
+
+class StepState:
+    """Fingerprints of the last successful run of each step, stored in a
+    local json file
+    """
+    def __init__(self, state_file, project_name):
+        self.state_file = state_file
+        self.project_name = project_name
+        self.api = None
+        self.lock = threading.Lock()
+
+        self.state = {}
+        if os.path.exists(state_file):
+            with open(state_file) as fp:
+                self.state = json.load(fp)
+
+    def _artifact_digest(self, artifact_name):
+        """Return the digest of an artifact in the W&B project, or in the
+        local store when configured, or None if it does not exist"""
+        import wandb
+
+        store = local_store()
+        if store is not None:
+            try:
+                return store.use_artifact(artifact_name).digest
+            except ArtifactNotFoundError:
+                return None
+
+        if self.api is None:
+            self.api = wandb.Api()
+        if "/" not in artifact_name:
+            artifact_name = f"{self.project_name}/{artifact_name}"
+        if ":" not in artifact_name:
+            artifact_name = f"{artifact_name}:latest"
+
+        try:
+            return self.api.artifact(artifact_name).digest
+        except Exception as excep:  # wandb raises CommError and ValueError
+            LOGGER.debug("Artifact %s not found: %s", artifact_name, excep)
+            return None
+
+    def fingerprint(self, inputs, config_slice, sources, files=()):
+        """Return the fingerprint of a step
+        Args:
+            inputs(list): Fully qualified names of the input artifacts
+            config_slice(dict): Configuration values used by the step
+            sources(list): Source files and directories of the step
+            files(list): Local files holding state the step reads besides
+    its inputs, a missing file counts as empty
+        Returns:
+            (str): Fingerprint, or None when an input artifact is missing
+        """
+        digests = {name: self._artifact_digest(name) for name in inputs}
+        if None in digests.values():
+            return None
+
+        content = json.dumps({
+            "inputs": digests,
+            "config": config_slice,
+            "sources": hash_sources(sources),
+            "files": {path: hash_sources([path]) if os.path.exists(path) else None
+                      for path in files}
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def is_up_to_date(self, step, fingerprint):
+        """Check if the last run of step had the same fingerprint and its
+        outputs are still the latest artifact versions
+        Args:
+            step(str): Name of the step
+            fingerprint(str): Current fingerprint of the step
+        Returns:
+            (bool): True when the step can be skipped
+        """
+        last_run = self.state.get(step)
+        if fingerprint is None or last_run is None or \
+                last_run["fingerprint"] != fingerprint:
+            return False
+
+        return all(self._artifact_digest(name) == digest
+                   for name, digest in last_run["outputs"].items())
+
+    def record(self, step, fingerprint, outputs):
+        """Store the fingerprint and output digests of a successful run
+        Args:
+            step(str): Name of the step
+            fingerprint(str): Fingerprint the step ran with
+            outputs(list): Names of the artifacts produced by the step
+        """
+        digests = {name: self._artifact_digest(name) for name in outputs}
+
+        # Steps running concurrently record their runs from several threads
+        with self.lock:
+            if fingerprint is None:
+                # An input artifact was missing, the run can not be matched
+                self.state.pop(step, None)
+            else:
+                self.state[step] = {"fingerprint": fingerprint, "outputs": digests}
+
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            with open(self.state_file, "w") as fp:
+                json.dump(self.state, fp, indent=2)
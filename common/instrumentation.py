@@ -0,0 +1,352 @@
+"""
+Instrumentation of the pipeline steps. A step decorated with `traced`
+gets a Tracer, and the code it runs, including the shared modules of
+common/, times its phases with the `phase` context manager:
+
+    with phase("read") as timing:
+        data = read_artifact(run, name)
+        timing.rows = len(data)
+
+Each phase records its wall time, the resident memory of the process at
+its start and end, the peak resident memory sampled while it runs and,
+when rows are given, its throughput. Phases are logged to the W&B run of
+the step as they end, summed per name in the run summary, and written to
+a local json trace in the Chrome trace event format, which
+chrome://tracing and Perfetto open as a timeline. Outside a traced step
+`phase` does nothing, so library code can use it unconditionally.
+
+With `main.instrumentation.profile: cprofile` in config.yaml the whole
+step also runs under cProfile, whose stats and top functions are logged
+as a `profile` artifact of the step.
+"""
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+
+LOGGER = logging.getLogger()
+
+DEFAULT_TRACE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "mlops_airbnb", "traces")
+
+# Number of functions listed in the text report of a profile
+PROFILE_TOP_FUNCTIONS = 50
+
+_CURRENT = None
+
+
+def rss_bytes():
+    """Return the resident memory of the process in bytes"""
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs, fall back to the peak resident memory of the process
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PhaseTiming:
+    """Measures of one run of a phase, rows can be set inside the block"""
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.start = None
+        self.seconds = None
+        self.rss_start = None
+        self.rss_end = None
+        self.rss_peak = None
+        self.thread = threading.get_ident()
+
+    @property
+    def rows_per_second(self):
+        """Rows processed per second, None when rows were not given"""
+        if self.rows is None or not self.seconds:
+            return None
+        return self.rows / self.seconds
+
+    def as_dict(self):
+        """Return the measures as a json serializable dict"""
+        return {
+            "phase": self.name,
+            "seconds": self.seconds,
+            "rows": self.rows,
+            "rows_per_second": self.rows_per_second,
+            "rss_start_mb": self.rss_start / 2 ** 20,
+            "rss_end_mb": self.rss_end / 2 ** 20,
+            "rss_peak_mb": self.rss_peak / 2 ** 20
+        }
+
+
+class Tracer:
+    """Collects the phases of a step and samples its resident memory
+    Args:
+        step(str): Name of the step
+        trace_dir(str): Directory of the json traces, defaults to
+    INSTRUMENTATION_TRACE_DIR
+        profile(str): none or cprofile, defaults to INSTRUMENTATION_PROFILE
+        interval(float): Seconds between two memory samples, defaults to
+    INSTRUMENTATION_RSS_INTERVAL
+    """
+    def __init__(self, step, trace_dir=None, profile=None, interval=None):
+        self.step = step
+        self.trace_dir = os.path.expanduser(trace_dir or os.environ.get(
+            "INSTRUMENTATION_TRACE_DIR", DEFAULT_TRACE_DIR))
+        self.profile = profile or os.environ.get("INSTRUMENTATION_PROFILE", "none")
+        if self.profile not in ("none", "cprofile"):
+            raise ValueError(f"Unknown profile mode {self.profile}")
+        self.interval = float(interval or os.environ.get(
+            "INSTRUMENTATION_RSS_INTERVAL", 0.05))
+
+        self.phases = []
+        self.active = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.start_time = time.time()
+        self.profiler = None
+        self.previous = None
+
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        """Raise the peak memory of the running phases until stopped"""
+        while not self._stop.wait(self.interval):
+            rss = rss_bytes()
+            with self.lock:
+                for timing in self.active:
+                    timing.rss_peak = max(timing.rss_peak, rss)
+
+    def start(self):
+        """Start the memory sampler and, when enabled, the profiler"""
+        self._sampler.start()
+        if self.profile == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name, rows=None):
+        """Time a phase of the step
+        Args:
+            name(str): Name of the phase, phases run several times are
+    summed in the summary
+            rows(int): Rows processed, can also be set on the yielded timing
+        Yields:
+            (PhaseTiming): Measures of the phase
+        """
+        timing = PhaseTiming(name)
+        timing.rows = rows
+        timing.rss_start = timing.rss_peak = rss_bytes()
+        with self.lock:
+            self.active.append(timing)
+
+        timing.start = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            timing.seconds = time.perf_counter() - timing.start
+            timing.rss_end = rss_bytes()
+            with self.lock:
+                self.active.remove(timing)
+                timing.rss_peak = max(timing.rss_peak, timing.rss_end)
+                self.phases.append(timing)
+
+            LOGGER.info("Phase %s: %.3fs%s, peak RSS %.0f MB", name, timing.seconds,
+                        "" if timing.rows_per_second is None
+                        else f", {timing.rows_per_second:,.0f} rows/s",
+                        timing.rss_peak / 2 ** 20)
+            self._log_phase(timing)
+
+    def _log_phase(self, timing):
+        """Log a phase to the W&B run of the step, if any"""
+        run = _wandb_run()
+        if run is None:
+            return
+        metrics = {f"phase/{key}": value for key, value in timing.as_dict().items()
+                   if key != "phase" and value is not None}
+        metrics["phase/name"] = timing.name
+        run.log(metrics)
+
+    def summary(self):
+        """Return the phases summed by name
+        Returns:
+            (dict): Calls, seconds, rows, rows/s and peak RSS per phase
+        """
+        totals = {}
+        for timing in self.phases:
+            total = totals.setdefault(timing.name, {
+                "calls": 0, "seconds": 0.0, "rows": None, "rss_peak_mb": 0.0})
+            total["calls"] += 1
+            total["seconds"] += timing.seconds
+            total["rss_peak_mb"] = max(total["rss_peak_mb"], timing.rss_peak / 2 ** 20)
+            if timing.rows is not None:
+                total["rows"] = (total["rows"] or 0) + timing.rows
+
+        for total in totals.values():
+            total["rows_per_second"] = total["rows"] / total["seconds"] \
+                if total["rows"] is not None and total["seconds"] else None
+        return totals
+
+    def trace_events(self):
+        """Return the phases as Chrome trace complete events"""
+        return [{
+            "name": timing.name,
+            "cat": self.step,
+            "ph": "X",
+            "ts": (timing.start - self.origin) * 1e6,
+            "dur": timing.seconds * 1e6,
+            "pid": os.getpid(),
+            "tid": timing.thread,
+            "args": timing.as_dict()
+        } for timing in self.phases]
+
+    def write_trace(self):
+        """Write the json trace of the step
+        Returns:
+            (str): Path to the trace file
+        """
+        os.makedirs(self.trace_dir, exist_ok=True)
+        path = os.path.join(self.trace_dir, "{}-{}-{}.json".format(
+            self.step, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.start_time)),
+            os.getpid()))
+
+        with open(path, "w") as fp:
+            json.dump({
+                "traceEvents": self.trace_events(),
+                "displayTimeUnit": "ms",
+                "metadata": {"step": self.step, "start_time": self.start_time,
+                             "summary": self.summary()}
+            }, fp, indent=1)
+        return path
+
+    def _write_profile(self, directory):
+        """Dump the cProfile stats and their text report into directory"""
+        os.makedirs(directory)
+        self.profiler.dump_stats(os.path.join(directory, f"{self.step}.prof"))
+
+        report = io.StringIO()
+        pstats.Stats(self.profiler, stream=report).sort_stats(
+            "cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        with open(os.path.join(directory, f"{self.step}.txt"), "w") as fp:
+            fp.write(report.getvalue())
+
+    def finish(self):
+        """Stop the sampler and profiler, log the summary to W&B, write the
+        json trace and publish the profile"""
+        if self.profiler is not None:
+            self.profiler.disable()
+        self._stop.set()
+        if self._sampler.is_alive():
+            self._sampler.join()
+
+        summary = self.summary()
+        run = _wandb_run()
+        if run is not None:
+            for name, total in summary.items():
+                for key, value in total.items():
+                    if value is not None:
+                        run.summary[f"{name}_{key}"] = value
+
+        LOGGER.info("%-20s %6s %10s %12s %12s", "phase", "calls", "seconds",
+                    "rows/s", "peak RSS MB")
+        for name, total in summary.items():
+            LOGGER.info("%-20s %6d %10.3f %12s %12.0f", name, total["calls"],
+                        total["seconds"],
+                        "-" if total["rows_per_second"] is None
+                        else f"{total['rows_per_second']:.0f}",
+                        total["rss_peak_mb"])
+        LOGGER.info("Trace of %s written to %s", self.step, self.write_trace())
+
+        if self.profiler is not None and run is not None:
+            from common.publisher import ArtifactPublisher
+
+            with ArtifactPublisher(run) as publisher:
+                path = publisher.path(f"{self.step}_profile")
+                self._write_profile(path)
+                publisher.publish(f"{self.step}_profile", "profile",
+                                  f"cProfile stats of the {self.step} step", path)
+
+
+def _wandb_run():
+    """Return the active W&B run, None when there is none"""
+    wandb = sys.modules.get("wandb")
+    return getattr(wandb, "run", None) if wandb is not None else None
+
+
+def current_tracer():
+    """Return the tracer of the running step, None outside a traced step"""
+    return _CURRENT
+
+
+@contextlib.contextmanager
+def phase(name, rows=None):
+    """Time a phase with the tracer of the running step, doing nothing
+    outside a traced step
+    Args:
+        name(str): Name of the phase
+        rows(int): Rows processed, can also be set on the yielded timing
+    Yields:
+        (PhaseTiming): Measures of the phase
+    """
+    tracer = _CURRENT
+    if tracer is None:
+        yield PhaseTiming(name)
+        return
+
+    with tracer.phase(name, rows) as timing:
+        yield timing
+
+
+def start_tracer(step):
+    """Start tracing a step, its phases go to the returned tracer until
+    stop_tracer is called
+    Args:
+        step(str): Name of the step, used in the metrics and trace file
+    Returns:
+        (Tracer): Tracer of the step
+    """
+    global _CURRENT
+    tracer = Tracer(step)
+    tracer.previous = _CURRENT
+    _CURRENT = tracer
+    tracer.start()
+    return tracer
+
+
+def stop_tracer(tracer):
+    """Finish a tracer returned by start_tracer and restore the tracer
+    active before it
+    Args:
+        tracer(Tracer): Tracer of the step
+    """
+    global _CURRENT
+    _CURRENT = tracer.previous
+    tracer.finish()
+
+
+def traced(step):
+    """Decorate the entry point of a step to trace its phases
+    Args:
+        step(str): Name of the step, used in the metrics and trace file
+    Returns:
+        (callable): Decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = start_tracer(step)
+            try:
+                with tracer.phase("total"):
+                    return function(*args, **kwargs)
+            finally:
+                stop_tracer(tracer)
+        return wrapper
+    return decorator
@@ -0,0 +1,158 @@
+"""
+Sparse features for the list columns of the listings, amenities and
+host_verifications, stored as string lists like '["Wifi", "Kitchen"]'.
+
+Those columns hold far fewer distinct strings than rows, so each list is
+parsed once per distinct string with a single vectorized regex, encoded
+as a row of a sparse matrix, and the rows are broadcast to the listings
+by indexing that matrix. The result is a scipy CSR matrix next to the
+numerical columns, which RandomForestClassifier fits and predicts on
+without building a dense frame with a column per amenity.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.validation import check_is_fitted
+
+LIST_COLUMNS = ['amenities', 'host_verifications']
+
+# Items of a list quoted with double (json) or single (python) quotes
+ITEM_PATTERN = r'"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\''
+
+
+def parse_lists(series):
+    """Parse the distinct strings of a list column
+    Args:
+        series(pd.Series): Column of string lists
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): Code of the distinct string
+    of each row (-1 when missing), and for every item found the code of
+    its string and the item itself
+    """
+    codes, uniques = pd.factorize(series)
+    items = pd.Series(uniques, dtype=object).astype(str).str.extractall(ITEM_PATTERN)
+
+    values = items[0].fillna(items[1]).to_numpy(dtype=object)
+    return codes, items.index.get_level_values(0).to_numpy(), values
+
+
+def _broadcast_rows(codes, item_codes, item_columns, n_columns):
+    """Return the binary CSR matrix of the rows, built on the distinct
+    strings and indexed by the code of each row"""
+    n_uniques = codes.max() + 1 if len(codes) else 0
+    keep = item_columns >= 0
+
+    by_unique = sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=np.float32),
+         (item_codes[keep], item_columns[keep])),
+        shape=(n_uniques + 1, n_columns))
+    # Items repeated in a list, or hashed to the same bucket, count once
+    by_unique.sum_duplicates()
+    by_unique.data[:] = 1.0
+
+    # Missing values get the code -1, which points to the appended empty row
+    return by_unique[np.where(codes < 0, n_uniques, codes)]
+
+
+class ListingFeatures(BaseEstimator, TransformerMixin):
+    """Numerical columns followed by the multi-hot encoding of the list
+    columns, as a float32 CSR matrix
+    Args:
+        numeric_columns(list): Columns passed through as they are
+        list_columns(list): Columns of string lists to encode
+        encoding(str): vocabulary, one column per item seen in fit at
+    least min_frequency times, at most max_features of the most frequent
+    ones per list column, or hashing, max_features buckets per list column
+    whatever the items, with nothing to learn
+        max_features(int): Width of the encoding of each list column
+        min_frequency(int): Listings an item must appear in to be kept by
+    the vocabulary encoding
+    """
+    def __init__(self, numeric_columns, list_columns=LIST_COLUMNS,
+                 encoding="vocabulary", max_features=256, min_frequency=1):
+        self.numeric_columns = numeric_columns
+        self.list_columns = list_columns
+        self.encoding = encoding
+        self.max_features = max_features
+        self.min_frequency = min_frequency
+
+    def fit(self, X, y=None):
+        """Learn the vocabulary of each list column
+        Args:
+            X(pd.DataFrame): Listings with the numeric and list columns
+            y: Ignored
+        Returns:
+            (ListingFeatures): Fitted encoder
+        """
+        if self.encoding not in ("vocabulary", "hashing"):
+            raise ValueError(f"Unknown encoding {self.encoding}")
+
+        self.feature_names_in_ = np.array(
+            list(self.numeric_columns) + list(self.list_columns), dtype=object)
+        self.vocabulary_ = {}
+
+        if self.encoding == "vocabulary":
+            for column in self.list_columns:
+                codes, item_codes, values = parse_lists(X[column])
+                items = pd.DataFrame({"code": item_codes, "item": values}) \
+                    .drop_duplicates()
+
+                # Listings holding each item, counting each list once per item
+                rows_per_string = np.bincount(codes[codes >= 0],
+                                              minlength=len(codes) and codes.max() + 1)
+                frequency = pd.Series(rows_per_string[items["code"].to_numpy()],
+                                      index=items["item"].to_numpy()) \
+                    .groupby(level=0).sum().sort_index()
+                frequency = frequency[frequency >= self.min_frequency]
+                # Most frequent items first, alphabetical order on ties
+                kept = frequency.sort_values(ascending=False, kind="stable") \
+                    .index[:self.max_features]
+                self.vocabulary_[column] = pd.Index(sorted(kept))
+
+        return self
+
+    def _item_columns(self, column, values):
+        """Return the encoded column of each item, -1 for unknown items"""
+        if self.encoding == "hashing":
+            hashes = pd.util.hash_array(values.astype(object))
+            return (hashes % np.uint64(self.max_features)).astype(np.int64)
+
+        return self.vocabulary_[column].get_indexer(values)
+
+    def _width(self, column):
+        """Return the number of encoded columns of a list column"""
+        return self.max_features if self.encoding == "hashing" \
+            else len(self.vocabulary_[column])
+
+    def transform(self, X):
+        """Return the feature matrix of the listings
+        Args:
+            X(pd.DataFrame): Listings with the numeric and list columns
+        Returns:
+            (sparse.csr_matrix): Float32 matrix, numeric columns first
+        """
+        check_is_fitted(self, "vocabulary_")
+
+        blocks = [sparse.csr_matrix(
+            X[list(self.numeric_columns)].to_numpy(dtype=np.float32))]
+        for column in self.list_columns:
+            codes, item_codes, values = parse_lists(X[column])
+            blocks.append(_broadcast_rows(
+                codes, item_codes, self._item_columns(column, values),
+                self._width(column)))
+
+        return sparse.hstack(blocks, format="csr", dtype=np.float32)
+
+    def get_feature_names_out(self, input_features=None):
+        """Return the names of the columns of the feature matrix"""
+        check_is_fitted(self, "vocabulary_")
+
+        names = list(self.numeric_columns)
+        for column in self.list_columns:
+            if self.encoding == "hashing":
+                names.extend(f"{column}#{bucket}" for bucket in range(self.max_features))
+            else:
+                names.extend(f"{column}={item}" for item in self.vocabulary_[column])
+
+        return np.array(names, dtype=object)
@@ -0,0 +1,70 @@
+"""
+Loading of the model exported by random_forest/run.py `export_model`
+and prediction over DataFrames of listings, shared by the evaluation
+and scoring steps. The export may carry in full_pipeline/ the cleaner
+fitted by the preprocessing step, applied to the listings before the
+model so raw listings can be scored.
+"""
+import logging
+import os
+
+from common.forest_io import COMPACT_DIRNAME, load_forest
+
+LOGGER = logging.getLogger()
+
+FULL_PIPELINE_DIRNAME = "full_pipeline"
+
+
+def load_model(model_path):
+    """Load an exported model, mapping the compact forest export into
+    memory when the export has one and unpickling the mlflow model
+    otherwise
+    Args:
+        model_path(str): Directory of the model export
+    Returns:
+        (object): Model with a predict method
+    """
+    compact_path = os.path.join(model_path, COMPACT_DIRNAME)
+    if os.path.isdir(compact_path):
+        LOGGER.info("Loading the compact forest export")
+        return load_forest(compact_path)
+
+    import mlflow.sklearn
+
+    return mlflow.sklearn.load_model(model_path)
+
+
+def load_pipeline(model_path):
+    """Load the cleaner exported with the model
+    Args:
+        model_path(str): Directory of the model export
+    Returns:
+        (ListingCleaner): Fitted cleaner, None when the export has none
+    """
+    pipeline_path = os.path.join(model_path, FULL_PIPELINE_DIRNAME)
+    if not os.path.isdir(pipeline_path):
+        return None
+
+    import mlflow.sklearn
+
+    return mlflow.sklearn.load_model(pipeline_path)
+
+
+def predict_frame(model, data, pipeline=None):
+    """Predict a DataFrame of listings, using only the columns the model
+    was fitted on
+    Args:
+        model(object): Model returned by load_model
+        data(pd.DataFrame): Listings to score
+        pipeline(ListingCleaner): Cleaner applied to the listings first
+    Returns:
+        (np.ndarray): Predictions, one per row
+    """
+    if pipeline is not None:
+        data = pipeline.transform(data)
+
+    columns = getattr(model, "feature_names_in_", None)
+    if columns is not None:
+        data = data[list(columns)]
+
+    return model.predict(data)
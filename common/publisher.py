@@ -0,0 +1,328 @@
+"""
+Publishing of the artifacts produced by the steps. An ArtifactPublisher
+writes each payload and logs it from a thread pool, so the tables of a
+step are serialized and uploaded at the same time instead of one after
+the other, and the step waits once, for all of them, before it ends.
+Csv payloads can be gzip compressed before the upload; every reader of
+the repo infers the compression from the .gz extension.
+
+Artifacts go to W&B, or, when `main.artifact_store.backend` is local in
+config.yaml, to a LocalArtifactStore: a directory with one folder per
+artifact version, which the steps also read their inputs from, so the
+whole pipeline runs offline.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.instrumentation import phase
+
+LOGGER = logging.getLogger()
+
+# Payloads gzip compression applies to, columnar formats are compressed
+# by their own writers
+COMPRESSIBLE = (".csv",)
+
+LATEST_FILENAME = "latest"
+METADATA_FILENAME = "metadata.json"
+
+
+class ArtifactNotFoundError(ValueError):
+    """Raised by a LocalArtifactStore for an artifact, or a version of it,
+    it does not hold, as wandb raises CommError"""
+
+
+def _hash_files(path):
+    """Return the sha256 of the relative paths and content of the files
+    under path"""
+    digest = hashlib.sha256()
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            filename = os.path.join(root, name)
+            digest.update(os.path.relpath(filename, path).encode())
+            with open(filename, "rb") as fp:
+                for block in iter(lambda: fp.read(2 ** 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def _parse_name(artifact_name):
+    """Split a fully qualified artifact name into its name and alias"""
+    name, _, alias = artifact_name.rpartition("/")[2].partition(":")
+    return name, alias or LATEST_FILENAME
+
+
+class LocalArtifact:
+    """Version of an artifact in a LocalArtifactStore, with the methods of
+    wandb.Artifact the steps and the ArtifactCache use"""
+    def __init__(self, name, version_dir):
+        self.name = name
+        self.version_dir = version_dir
+        with open(os.path.join(version_dir, METADATA_FILENAME)) as fp:
+            self.metadata = json.load(fp)
+        self.digest = self.metadata["digest"]
+        self.type = self.metadata["type"]
+
+    def download(self, root=None):
+        """Return a directory with the artifact files, copied to root
+        when given"""
+        files = os.path.join(self.version_dir, "files")
+        if root is None:
+            return files
+
+        shutil.copytree(files, root, dirs_exist_ok=True)
+        return root
+
+    def file(self, root=None):
+        """Return the path to the single file of the artifact"""
+        files = self.download(root)
+        names = os.listdir(files)
+        if len(names) != 1:
+            raise ValueError(
+                f"Artifact {self.name} has {len(names)} files, expected one")
+        return os.path.join(files, names[0])
+
+    def wait(self):
+        """Artifacts are stored when logged, nothing to wait for"""
+        return self
+
+
+class LocalArtifactStore:
+    """File-backed stand-in for the W&B artifact storage. Each logged
+    artifact gets a new version directory `<name>/v<N>` holding its files
+    and metadata, and `<name>/latest` names the last version
+    Args:
+        root(str): Directory of the store, created if needed
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def log_artifact(self, name, artifact_type, description, path):
+        """Store a new version of an artifact
+        Args:
+            name(str): Name of the artifact
+            artifact_type(str): Type of the artifact
+            description(str): Description of the artifact
+            path(str): File or directory with the payload
+        Returns:
+            (LocalArtifact): Stored version
+        """
+        artifact_dir = os.path.join(self.root, name)
+        os.makedirs(artifact_dir, exist_ok=True)
+
+        # Creating the directory reserves the version number, even
+        # against other steps logging the same artifact
+        version = len([entry for entry in os.listdir(artifact_dir)
+                       if entry.startswith("v")])
+        while True:
+            version_dir = os.path.join(artifact_dir, f"v{version}")
+            try:
+                os.mkdir(version_dir)
+                break
+            except FileExistsError:
+                version += 1
+
+        files = os.path.join(version_dir, "files")
+        if os.path.isdir(path):
+            shutil.copytree(path, files)
+        else:
+            os.mkdir(files)
+            shutil.copy(path, files)
+
+        with open(os.path.join(version_dir, METADATA_FILENAME), "w") as fp:
+            json.dump({"type": artifact_type, "description": description,
+                       "digest": _hash_files(files)}, fp)
+
+        # Write then rename so readers never see a partial alias
+        latest = os.path.join(artifact_dir, LATEST_FILENAME)
+        with open(latest + ".tmp", "w") as fp:
+            fp.write(f"v{version}")
+        os.replace(latest + ".tmp", latest)
+
+        LOGGER.info("Stored %s:v%d in %s", name, version, self.root)
+        return LocalArtifact(name, version_dir)
+
+    def use_artifact(self, artifact_name):
+        """Return a stored artifact version
+        Args:
+            artifact_name(str): Artifact name, with an optional project
+    prefix and a version or latest alias
+        Returns:
+            (LocalArtifact): Artifact version
+        Raises:
+            ArtifactNotFoundError: The store has no such artifact version
+        """
+        name, alias = _parse_name(artifact_name)
+        artifact_dir = os.path.join(self.root, name)
+
+        if alias == LATEST_FILENAME:
+            latest = os.path.join(artifact_dir, LATEST_FILENAME)
+            if not os.path.exists(latest):
+                raise ArtifactNotFoundError(
+                    f"Artifact {artifact_name} not found in {self.root}")
+            with open(latest) as fp:
+                alias = fp.read().strip()
+
+        version_dir = os.path.join(artifact_dir, alias)
+        if not os.path.exists(os.path.join(version_dir, METADATA_FILENAME)):
+            raise ArtifactNotFoundError(
+                f"Artifact {artifact_name} not found in {self.root}")
+        return LocalArtifact(name, version_dir)
+
+
+def local_store():
+    """Return the LocalArtifactStore configured by main.py through the
+    environment, or None when artifacts go to W&B"""
+    if os.environ.get("ARTIFACT_STORE_BACKEND", "wandb") != "local":
+        return None
+
+    return LocalArtifactStore(os.path.expanduser(os.environ.get(
+        "ARTIFACT_STORE_DIR",
+        os.path.join("~", ".cache", "mlops_airbnb", "store"))))
+
+
+def use_artifact(run, artifact_name):
+    """Declare the use of an artifact in the configured store
+    Args:
+        run(wandb.Run): Current run
+        artifact_name(str): Fully qualified name for the artifact
+    Returns:
+        (wandb.Artifact or LocalArtifact): Artifact
+    """
+    store = local_store()
+    if store is not None:
+        return store.use_artifact(artifact_name)
+    return run.use_artifact(artifact_name)
+
+
+def compress_file(path, level=6):
+    """Gzip a file next to itself and remove the original
+    Args:
+        path(str): File to compress
+        level(int): gzip compression level
+    Returns:
+        (str): Path to the compressed file
+    """
+    with open(path, "rb") as source, \
+            gzip.open(path + ".gz", "wb", compresslevel=level) as target:
+        shutil.copyfileobj(source, target, length=2 ** 20)
+    os.remove(path)
+    return path + ".gz"
+
+
+class ArtifactPublisher:
+    """Write and log artifacts from a thread pool, then wait for all of
+    them at once. Use it as a context manager, leaving the block waits
+    for the uploads and removes the staged payloads
+    Args:
+        run(wandb.Run): Current run
+        max_workers(int): Payloads written and logged at the same time,
+    defaults to ARTIFACT_UPLOAD_WORKERS or 4
+        compression(str): none or gzip, applied to csv payloads, defaults
+    to ARTIFACT_COMPRESSION or none
+        store(LocalArtifactStore): Store receiving the artifacts, defaults
+    to the configured one, None logs them to W&B
+    """
+    def __init__(self, run, max_workers=None, compression=None, store=None):
+        self.run = run
+        self.compression = compression or os.environ.get("ARTIFACT_COMPRESSION", "none")
+        if self.compression not in ("none", "gzip"):
+            raise ValueError(f"Unknown compression {self.compression}")
+        self.store = store if store is not None else local_store()
+
+        self.executor = ThreadPoolExecutor(
+            max_workers or int(os.environ.get("ARTIFACT_UPLOAD_WORKERS", 4)))
+        self.staging = tempfile.mkdtemp(prefix="publish-")
+        self.futures = []
+        # log_artifact is called from the pool, one call at a time
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.wait()
+        else:
+            self.close()
+
+    def path(self, filename):
+        """Return a fresh staging path for a payload
+        Args:
+            filename(str): Name of the payload file or directory
+        Returns:
+            (str): Path, removed once the artifacts are uploaded
+        """
+        return os.path.join(tempfile.mkdtemp(dir=self.staging), filename)
+
+    def publish(self, name, artifact_type, description, path, write=None):
+        """Write and log an artifact in the thread pool
+        Args:
+            name(str): Name of the artifact
+            artifact_type(str): Type of the artifact
+            description(str): Description of the artifact
+            path(str): File or directory of the payload, from self.path
+            write(callable): Called with path to write the payload, None
+    when it is already written
+        Returns:
+            (Future): Future of the logged artifact
+        """
+        future = self.executor.submit(
+            self._publish, name, artifact_type, description, path, write)
+        self.futures.append(future)
+        return future
+
+    def _publish(self, name, artifact_type, description, path, write):
+        """Write, compress and log one artifact"""
+        if write is not None:
+            write(path)
+
+        if self.compression == "gzip" and os.path.isfile(path) \
+                and path.endswith(COMPRESSIBLE):
+            size = os.path.getsize(path)
+            path = compress_file(path)
+            LOGGER.info("Compressed %s from %d to %d bytes",
+                        name, size, os.path.getsize(path))
+
+        if self.store is not None:
+            return self.store.log_artifact(name, artifact_type, description, path)
+
+        import wandb
+
+        artifact = wandb.Artifact(name=name, type=artifact_type, description=description)
+        if os.path.isdir(path):
+            artifact.add_dir(path)
+        else:
+            artifact.add_file(path)
+
+        LOGGER.info("Logging artifact %s", name)
+        with self.lock:
+            self.run.log_artifact(artifact)
+        return artifact
+
+    def wait(self):
+        """Wait for every artifact to be logged and uploaded, raising the
+        first error met
+        Returns:
+            (list): Logged artifacts, in publication order
+        """
+        try:
+            with phase("upload"):
+                artifacts = [future.result() for future in self.futures]
+                for artifact in artifacts:
+                    artifact.wait()
+            return artifacts
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the thread pool and remove the staged payloads"""
+        self.executor.shutdown(wait=True)
+        shutil.rmtree(self.staging, ignore_errors=True)
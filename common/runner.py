@@ -0,0 +1,102 @@
+"""
+In-process execution of the pipeline steps. Instead of starting one
+`mlflow.run` per step, with its own process, conda environment and
+imports, main.py can import the `process_args` of each step and call it
+in the same interpreter, handing the published tables to the next steps
+in memory.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+import time
+
+from common.artifact_cache import enable_memory_handoff
+
+LOGGER = logging.getLogger()
+
+
+def load_step(step_path, module_name):
+    """Import the run.py module of a step
+    Args:
+        step_path(str): Directory of the step
+        module_name(str): Name given to the imported module
+    Returns:
+        (module, float): Step module and the seconds spent importing it
+    """
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(step_path, "run.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    return module, time.perf_counter() - start
+
+
+def _run_data_checks(step_path, parameters):
+    """Run the data_checks pytest suite in the current interpreter"""
+    import pytest
+
+    arguments = [step_path, "-s", "-vv", "-p", "no:cacheprovider"]
+    for name, value in parameters.items():
+        arguments.extend([f"--{name}", str(value)])
+
+    exit_code = pytest.main(arguments)
+    if exit_code != 0:
+        raise RuntimeError(f"Data checks failed with exit code {exit_code}")
+
+
+def run_in_process(step, step_path, parameters):
+    """Run a step in the current interpreter
+    Args:
+        step(str): Name of the step
+        step_path(str): Directory of the step
+        parameters(dict): Values of the step command line arguments
+    Returns:
+        (dict): Seconds spent importing and running the step
+    """
+    import wandb
+
+    enable_memory_handoff()
+    working_dir = os.getcwd()
+
+    # Steps import their sibling modules and write temporary files
+    # relative to their own directory, as they do under mlflow run
+    sys.path.insert(0, step_path)
+    os.chdir(step_path)
+    try:
+        if os.path.exists(os.path.join(step_path, "run.py")):
+            module, import_seconds = load_step(step_path, f"{step}_run")
+
+            start = time.perf_counter()
+            module.process_args(argparse.Namespace(**parameters))
+        else:
+            import_seconds = 0.0
+            start = time.perf_counter()
+            _run_data_checks(step_path, parameters)
+
+        run_seconds = time.perf_counter() - start
+    finally:
+        # Close the W&B run of the step, the next step starts a new one
+        wandb.finish()
+        os.chdir(working_dir)
+        sys.path.remove(step_path)
+
+    return {"import": import_seconds, "run": run_seconds}
+
+
+def log_timings(timings):
+    """Log a table with the seconds spent in each step. Steps run through
+    mlflow have no separate import time, their run time includes the
+    process start, the conda environment activation and the imports
+    Args:
+        timings(dict): Import and run seconds keyed by step name
+    """
+    LOGGER.info("%-15s %10s %10s %10s", "step", "import(s)", "run(s)", "total(s)")
+    for step, seconds in timings.items():
+        import_seconds = seconds["import"]
+        LOGGER.info("%-15s %10s %10.2f %10.2f", step,
+                    "-" if import_seconds is None else f"{import_seconds:.2f}",
+                    seconds["run"], (import_seconds or 0.0) + seconds["run"])
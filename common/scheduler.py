@@ -0,0 +1,139 @@
+"""
+Scheduler running the pipeline steps as a dependency graph. A step
+starts as soon as every step it depends on has finished, with up to
+max_workers steps running at the same time. When a step fails the steps
+depending on it are not started, while independent branches carry on.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+LOGGER = logging.getLogger()
+
+
+class StepResult:
+    """Outcome of a step: status is one of done, failed or upstream_failed"""
+    def __init__(self, status, start=None, end=None, error=None):
+        self.status = status
+        self.start = start
+        self.end = end
+        self.error = error
+
+    @property
+    def seconds(self):
+        """Wall time of the step, zero when it did not run"""
+        return self.end - self.start if self.start is not None else 0.0
+
+
+def validate_graph(steps, dependencies):
+    """Check that every dependency is a known step and the graph has no cycle
+    Args:
+        steps(list): Names of all the pipeline steps
+        dependencies(dict): Steps each step depends on
+    """
+    for step, upstream in dependencies.items():
+        unknown = set(upstream) - set(steps)
+        if step not in steps or unknown:
+            raise ValueError(
+                f"Unknown steps in the dependencies of {step}: {unknown or step}")
+
+    visiting, visited = set(), set()
+
+    def visit(step):
+        if step in visiting:
+            raise ValueError(f"Dependency cycle through step {step}")
+        if step not in visited:
+            visiting.add(step)
+            for upstream in dependencies.get(step, []):
+                visit(upstream)
+            visiting.remove(step)
+            visited.add(step)
+
+    for step in steps:
+        visit(step)
+
+
+def run_graph(steps, dependencies, run_step, max_workers=1):
+    """Run steps concurrently following their dependencies
+    Args:
+        steps(list): Names of the steps to run, in their preferred order
+        dependencies(dict): Steps each step depends on, dependencies on
+    steps outside of steps are considered satisfied
+        run_step(Callable): Function receiving a step name and running it
+        max_workers(int): Maximum number of steps running at the same time
+    Returns:
+        (dict): StepResult keyed by step name
+    """
+    results = {}
+    pending = list(steps)
+    running = {}
+    lock = threading.Lock()
+
+    def timed_run(step):
+        start = time.perf_counter()
+        try:
+            run_step(step)
+        except Exception as excep:  # reported through the step result
+            LOGGER.exception("Step %s failed", step)
+            with lock:
+                results[step] = StepResult("failed", start, time.perf_counter(), excep)
+            return
+        with lock:
+            results[step] = StepResult("done", start, time.perf_counter())
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for step in list(pending):
+                upstream = [name for name in dependencies.get(step, []) if name in steps]
+
+                if any(name in results and results[name].status != "done"
+                       for name in upstream):
+                    LOGGER.warning("Skipping %s, an upstream step failed", step)
+                    results[step] = StepResult("upstream_failed")
+                    pending.remove(step)
+                elif all(name in results for name in upstream) and \
+                        len(running) < max_workers:
+                    LOGGER.info("Starting step %s", step)
+                    running[executor.submit(timed_run, step)] = step
+                    pending.remove(step)
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                running.pop(future)
+
+    return results
+
+
+def critical_path(results, dependencies):
+    """Return the chain of dependent steps with the longest total run time,
+    the one bounding the pipeline wall time however many workers are used
+    Args:
+        results(dict): StepResult keyed by step name
+        dependencies(dict): Steps each step depends on
+    Returns:
+        (list, float): Steps of the critical path and its total seconds
+    """
+    finish = {}
+    previous = {}
+
+    def longest(step):
+        if step not in finish:
+            upstream = [name for name in dependencies.get(step, []) if name in results]
+            best = max(upstream, key=longest, default=None)
+            previous[step] = best
+            finish[step] = results[step].seconds + (finish[best] if best else 0.0)
+        return finish[step]
+
+    if not results:
+        return [], 0.0
+
+    last = max(results, key=longest)
+    path = [last]
+    while previous[path[-1]] is not None:
+        path.append(previous[path[-1]])
+
+    return path[::-1], finish[last]
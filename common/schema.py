@@ -0,0 +1,119 @@
+"""
+Compact dtypes of the clean dataset. The preprocessing leaves every
+integer column as int64 and the text columns as Python strings, while
+availabilities and night counts fit in a few bytes and the room types,
+neighbourhoods and response times take a handful of values. `downcast`
+converts a table to the dtypes of CLEAN_SCHEMA: categoricals for the
+repeated strings, booleans for the 't'/'f' flags and the narrowest
+numeric types, so a clean row takes a fraction of its former memory.
+
+The steps reading the clean dataset and its splits apply it as they read
+them, through the `schema` argument of read_artifact and iter_table, so
+every step sees the same dtypes whatever the artifact format. Integer
+values outside the range of their schema type are kept in the narrowest
+type holding them instead of overflowing, and float columns are stored
+as float32, the precision the random forest trains in.
+"""
+import logging
+import numpy as np
+import pandas as pd
+
+LOGGER = logging.getLogger()
+
+# Strings of the boolean flags of the raw listings
+BOOLEAN_VALUES = {'t': True, 'f': False}
+
+INTEGER_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+CLEAN_SCHEMA = {
+    'room_type': 'category',
+    'neighbourhood_cleansed': 'category',
+    'host_response_time': 'category',
+    'host_is_superhost': 'bool',
+    'instant_bookable': 'bool',
+    'host_identity_verified': 'bool',
+    'accommodates': 'int16',
+    'bedrooms': 'int16',
+    'beds': 'int16',
+    'host_listings_count': 'int32',
+    'availability_30': 'int8',
+    'availability_60': 'int8',
+    'availability_90': 'int8',
+    'availability_365': 'int16',
+    'number_of_reviews': 'int32',
+    'minimum_nights': 'int32',
+    'maximum_nights': 'int32',
+    'price': 'float32',
+    'bathrooms': 'float32',
+    'host_response_rate': 'float32'
+}
+
+
+def _to_integer(series, dtype):
+    """Cast a column to dtype, or to the narrowest wider integer type
+    holding its values, nullable when it has missing values"""
+    minimum, maximum = series.min(), series.max()
+    for candidate in INTEGER_TYPES[INTEGER_TYPES.index(np.dtype(dtype).type):]:
+        info = np.iinfo(candidate)
+        if pd.isna(minimum) or (info.min <= minimum and maximum <= info.max):
+            break
+    if candidate != np.dtype(dtype).type:
+        LOGGER.warning("Column %s ranges from %s to %s, kept as %s instead of %s",
+                       series.name, minimum, maximum, np.dtype(candidate), dtype)
+
+    if series.hasnans:
+        # Nullable integers, named with a capital letter
+        return series.astype(np.dtype(candidate).name.capitalize())
+    return series.astype(candidate)
+
+
+def _to_boolean(series):
+    """Cast a column of 't'/'f' flags to booleans, nullable when it has
+    missing values, leaving it unchanged if it holds other values"""
+    if pd.api.types.is_bool_dtype(series):
+        return series
+
+    flags = series.map(BOOLEAN_VALUES)
+    if flags.isna().sum() != series.isna().sum():
+        # True and False as written to csv by a previous downcast
+        flags = series.map({**BOOLEAN_VALUES, 'True': True, 'False': False,
+                            True: True, False: False})
+        if flags.isna().sum() != series.isna().sum():
+            LOGGER.warning("Column %s is not a t/f flag, kept as %s",
+                           series.name, series.dtype)
+            return series
+
+    return flags.astype("boolean" if series.hasnans else bool)
+
+
+def downcast(data, schema=CLEAN_SCHEMA):
+    """Return data with the compact dtypes of the schema, columns outside
+    the schema are kept as they are
+    Args:
+        data(pd.DataFrame): Table to convert
+        schema(dict): dtype of each column, category, bool, intN or
+    floatN
+    Returns:
+        (pd.DataFrame): Converted table, data itself when nothing changed
+    """
+    converted = {}
+    for column, dtype in schema.items():
+        if column not in data:
+            continue
+        series = data[column]
+
+        if dtype == 'category':
+            if not pd.api.types.is_categorical_dtype(series):
+                converted[column] = series.astype('category')
+        elif dtype == 'bool':
+            if not pd.api.types.is_bool_dtype(series):
+                converted[column] = _to_boolean(series)
+        elif np.issubdtype(np.dtype(dtype), np.integer):
+            if series.dtype != np.dtype(dtype):
+                converted[column] = _to_integer(series, dtype)
+        elif series.dtype != np.dtype(dtype):
+            converted[column] = series.astype(dtype)
+
+    if not converted:
+        return data
+    return data.assign(**converted)
@@ -0,0 +1,56 @@
+"""
+Tests of the parsed copies kept by the artifact cache
+"""
+import os
+import pandas as pd
+import pytest
+
+from common.artifact_cache import PARSED_FILENAME, ArtifactCache
+from common.publisher import LocalArtifactStore
+
+TABLE = pd.DataFrame({"price": ["$10.00", "$20.00"], "beds": [1, 2],
+                      "amenities": ['["Wifi"]', '["Kitchen"]']})
+
+
+@pytest.fixture
+def artifact(tmp_path):
+    """Csv artifact of a local store"""
+    path = tmp_path / "table.csv"
+    TABLE.to_csv(path, index=False)
+    return LocalArtifactStore(str(tmp_path / "store")).log_artifact(
+        "table.csv", "raw_data", "", str(path))
+
+
+def parsed_copies(cache, artifact):
+    """Return the parsed copies kept for an artifact"""
+    return sorted(name for name in os.listdir(cache._entry(artifact))
+                  if name.endswith(".feather"))
+
+
+def test_subset_parses_only_its_columns(tmp_path, artifact):
+    cache = ArtifactCache(str(tmp_path / "cache"), enabled=True)
+
+    data = cache.read_table(artifact, columns=["beds", "price"])
+    assert list(data.columns) == ["beds", "price"]
+    pd.testing.assert_frame_equal(data, TABLE[["beds", "price"]])
+
+    copies = parsed_copies(cache, artifact)
+    assert len(copies) == 1 and copies[0] != PARSED_FILENAME
+    assert list(pd.read_feather(os.path.join(cache._entry(artifact), copies[0])).columns) \
+        == ["price", "beds"]
+
+    # Hit on the copy of the same subset, in any order
+    pd.testing.assert_frame_equal(cache.read_table(artifact, columns=["price", "beds"]),
+                                  TABLE[["price", "beds"]])
+    assert parsed_copies(cache, artifact) == copies
+
+
+def test_full_copy_serves_subsets(tmp_path, artifact):
+    cache = ArtifactCache(str(tmp_path / "cache"), enabled=True)
+
+    pd.testing.assert_frame_equal(cache.read_table(artifact), TABLE)
+    assert parsed_copies(cache, artifact) == [PARSED_FILENAME]
+
+    pd.testing.assert_frame_equal(cache.read_table(artifact, columns=["amenities"]),
+                                  TABLE[["amenities"]])
+    assert parsed_copies(cache, artifact) == [PARSED_FILENAME]
@@ -0,0 +1,85 @@
+"""
+Tests of the csv, parquet and feather artifacts, written whole or chunk
+by chunk and read back with the dtypes of the clean data schema
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.artifact_io import (
+    TableWriter, artifact_filename, get_format, iter_table, read_table, write_table)
+from common.schema import CLEAN_SCHEMA, downcast
+
+FORMATS = ["csv", "parquet", "feather"]
+
+
+def clean_listings(n_rows, seed=0):
+    """Return clean listings with the dtypes of CLEAN_SCHEMA, sorted so
+    that chunks hold different categories"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        "room_type": rng.choice(["Entire home/apt", "Private room", "Shared room"], n_rows),
+        "neighbourhood_cleansed": rng.choice(["Copacabana", "Ipanema", "Leblon"], n_rows),
+        "host_response_time": rng.choice(["within an hour", "within a day"], n_rows),
+        "host_is_superhost": rng.choice(["t", "f"], n_rows),
+        "instant_bookable": rng.choice(["t", "f"], n_rows),
+        "host_identity_verified": rng.choice(["t", "f"], n_rows),
+        "host_verifications": rng.choice(["['email', 'phone']", "['phone']"], n_rows),
+        "amenities": [f'["Wifi", "Item {i}"]' for i in range(n_rows)],
+        "price": rng.uniform(50, 900, n_rows).round(2),
+        "bathrooms": rng.choice([0.5, 1.0, 1.5, 2.0], n_rows),
+        "host_response_rate": rng.uniform(0, 1, n_rows).round(2),
+        "availability_365": rng.integers(0, 366, n_rows),
+        "maximum_nights": rng.integers(1, 1125, n_rows),
+    })
+    for column in ("accommodates", "bedrooms", "beds", "host_listings_count",
+                   "availability_30", "availability_60", "availability_90",
+                   "number_of_reviews", "minimum_nights"):
+        data[column] = rng.integers(0, 30, n_rows)
+
+    data = data.sort_values(["room_type", "host_response_time"], ignore_index=True)
+    return downcast(data)
+
+
+@pytest.mark.parametrize("artifact_format", FORMATS)
+def test_chunked_round_trip(tmp_path, artifact_format):
+    data = clean_listings(1000)
+    path = str(tmp_path / artifact_filename("clean_data", artifact_format))
+
+    with TableWriter(path) as writer:
+        for start in range(0, len(data), 150):
+            writer.write(data.iloc[start:start + 150])
+
+    # The categories are those of the whole table, in the order of the file
+    result = read_table(path, schema=CLEAN_SCHEMA)
+    pd.testing.assert_frame_equal(result, data, check_categorical=False)
+
+    chunks = list(iter_table(path, chunksize=300, schema=CLEAN_SCHEMA))
+    assert [len(chunk) for chunk in chunks] == [300, 300, 300, 100]
+    for start, chunk in zip(range(0, len(data), 300), chunks):
+        assert chunk.dtypes.astype(str).to_dict() == data.dtypes.astype(str).to_dict()
+        pd.testing.assert_frame_equal(chunk.reset_index(drop=True),
+                                      data.iloc[start:start + 300].reset_index(drop=True),
+                                      check_categorical=False)
+
+
+@pytest.mark.parametrize("artifact_format", FORMATS)
+def test_whole_round_trip(tmp_path, artifact_format):
+    data = clean_listings(200)
+    path = str(tmp_path / artifact_filename("clean_data", artifact_format))
+    write_table(data, path)
+
+    pd.testing.assert_frame_equal(read_table(path, schema=CLEAN_SCHEMA), data,
+                                  check_categorical=False)
+    columns = ["room_type", "price"]
+    pd.testing.assert_frame_equal(read_table(path, columns=columns, schema=CLEAN_SCHEMA),
+                                  data[columns], check_categorical=False)
+
+
+def test_formats():
+    assert artifact_filename("train_data", "parquet") == "train_data.parquet"
+    assert get_format("raw_data.csv.gz") == "csv"
+    with pytest.raises(ValueError, match="Unknown artifact format"):
+        artifact_filename("train_data", "orc")
+    with pytest.raises(ValueError, match="Could not infer"):
+        get_format("train_data.orc")
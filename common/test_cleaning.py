@@ -0,0 +1,86 @@
+"""
+Tests of the fill values learned by the listings cleaner, which must be
+those of the SimpleImputer fits it replaced
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.impute import SimpleImputer
+
+from common.cleaning import (
+    COLUMNS_IMPUTER_CATEGORICAL, COLUMNS_IMPUTER_NUMERICAL, ListingCleaner)
+
+
+def raw_listings(n_rows, seed=0):
+    """Return raw listings with missing values in every imputed column"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({column: rng.integers(0, 30, n_rows).astype(float)
+                         for column in COLUMNS_IMPUTER_NUMERICAL})
+    for column in COLUMNS_IMPUTER_CATEGORICAL:
+        data[column] = rng.choice(["a", "b", "c", "d"], n_rows, p=[0.1, 0.4, 0.4, 0.1])
+    data = data.mask(rng.random(data.shape) < 0.1)
+    return data
+
+
+def imputed(data, columns, strategy):
+    """Return the statistics SimpleImputer learns on the columns of data"""
+    imputer = SimpleImputer(strategy=strategy).fit(data[columns].astype(
+        float if strategy == "median" else object))
+    return dict(zip(columns, imputer.statistics_))
+
+
+def test_fit_matches_simple_imputer():
+    data = raw_listings(1001)
+    cleaner = ListingCleaner().fit(data)
+
+    assert cleaner.fill_values_ == {
+        **imputed(data, COLUMNS_IMPUTER_NUMERICAL, "median"),
+        **imputed(data, COLUMNS_IMPUTER_CATEGORICAL, "most_frequent")}
+
+
+@pytest.mark.parametrize("max_categories", [10, 10000])
+def test_fit_is_exact_with_more_ties_than_counters(max_categories):
+    # Nearly unique amenities, every distinct value ties
+    data = raw_listings(12001)
+    data["amenities"] = [f'["Wifi", "Item {i}"]' for i in
+                         np.random.default_rng(1).permutation(len(data))]
+    data.loc[0, "amenities"] = np.nan
+
+    cleaner = ListingCleaner(max_categories).fit(data)
+
+    expected = imputed(data, ["amenities"], "most_frequent")["amenities"]
+    assert cleaner.fill_values_["amenities"] == expected == min(data["amenities"].dropna())
+    assert not cleaner.fill(data)["amenities"].isna().any()
+
+
+def test_partial_fit_keeps_the_largest_counters():
+    rng = np.random.default_rng(2)
+    data = raw_listings(6000)
+    # A mode in 1/5 of the rows, the other rows are unique
+    data["amenities"] = np.where(rng.random(len(data)) < 0.2, "mode",
+                                 [f"item {i}" for i in range(len(data))])
+
+    cleaner = ListingCleaner(max_categories=50)
+    for start in range(0, len(data), 700):
+        cleaner.partial_fit(data.iloc[start:start + 700])
+
+    assert len(cleaner.counts_["amenities"]) == 50
+    assert cleaner.fill_values_["amenities"] == "mode"
+    # Numerical columns are counted exactly
+    assert cleaner.fill_values_["beds"] == data["beds"].median()
+
+
+def test_partial_fit_never_empties_the_sketch():
+    data = raw_listings(300)
+    data["amenities"] = [f"item {i:03d}" for i in range(len(data))]
+
+    first, second = ListingCleaner(max_categories=10), ListingCleaner(max_categories=10)
+    for start in range(0, len(data), 40):
+        first.partial_fit(data.iloc[start:start + 40])
+        # The counters kept do not depend on the order of the rows
+        second.partial_fit(data.iloc[start:start + 40].iloc[::-1])
+
+    assert len(first.counts_["amenities"]) == 10
+    assert first.fill_values_["amenities"] in set(data["amenities"])
+    pd.testing.assert_series_equal(first.counts_["amenities"], second.counts_["amenities"])
+    assert first.fill_values_ == second.fill_values_
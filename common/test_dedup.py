@@ -0,0 +1,86 @@
+"""
+Tests of the row fingerprints and of the fingerprint set deduplicating
+the raw listings across chunks and runs
+"""
+import os
+import numpy as np
+import pandas as pd
+
+from common.dedup import FingerprintSet
+from common.hashing import row_fingerprints
+
+
+def listings(n_rows, seed=0):
+    """Return n_rows listings, with repeated rows"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "host_id": rng.integers(0, 40, n_rows),
+        "room_type": rng.choice(["Entire home/apt", "Private room"], n_rows),
+        "price": rng.choice([50.0, 80.0, np.nan], n_rows)
+    })
+
+
+def test_row_fingerprints_match_duplicated():
+    data = listings(2000)
+    fingerprints = row_fingerprints(data)
+
+    assert fingerprints.dtype == np.uint64
+    np.testing.assert_array_equal(pd.Series(fingerprints).duplicated().to_numpy(),
+                                  data.duplicated().to_numpy())
+    # The dtypes of the columns, as read from csv or parquet, do not count
+    as_read = data.astype({"host_id": float, "room_type": "category"})
+    np.testing.assert_array_equal(row_fingerprints(as_read), fingerprints)
+
+
+def test_row_fingerprints_depend_on_column_order():
+    data = pd.DataFrame({"a": ["x", "y"], "b": ["y", "x"]})
+
+    fingerprints = row_fingerprints(data)
+    assert fingerprints[0] != fingerprints[1]
+    assert row_fingerprints(data, ["b", "a"])[0] == fingerprints[1]
+
+
+def test_keep_across_chunks():
+    data = listings(2000)
+    fingerprints = FingerprintSet()
+
+    keep = np.concatenate([fingerprints.keep(row_fingerprints(data.iloc[start:start + 300]))
+                           for start in range(0, len(data), 300)])
+
+    np.testing.assert_array_equal(keep, ~data.duplicated().to_numpy())
+    assert fingerprints.duplicates == int(data.duplicated().sum())
+    assert fingerprints.seen == 0
+    np.testing.assert_array_equal(fingerprints.kept, np.unique(row_fingerprints(data)))
+
+
+def test_fingerprints_persist_across_runs(tmp_path):
+    path = str(tmp_path / "dedup" / "fingerprints.npy")
+    first, second = listings(500), listings(500, seed=1)
+
+    fingerprints = FingerprintSet(path)
+    fingerprints.keep(row_fingerprints(first))
+    fingerprints.save()
+    assert os.listdir(tmp_path / "dedup") == ["fingerprints.npy"]
+
+    # The next snapshot keeps only the rows not kept by the first one
+    fingerprints = FingerprintSet(path)
+    keep = fingerprints.keep(row_fingerprints(second))
+    repeated = pd.concat([first, second]).duplicated().to_numpy()[len(first):]
+    np.testing.assert_array_equal(keep, ~repeated)
+    assert fingerprints.seen > 0
+    assert fingerprints.removed == int(repeated.sum())
+    fingerprints.save()
+
+    # Running a snapshot again keeps no row
+    fingerprints = FingerprintSet(path)
+    assert not fingerprints.keep(row_fingerprints(first)).any()
+    assert fingerprints.removed == len(first)
+
+
+def test_set_without_path():
+    fingerprints = FingerprintSet()
+    fingerprints.keep(row_fingerprints(listings(100)))
+    fingerprints.save()
+
+    assert fingerprints.path is None
+    assert len(fingerprints.previous) == 0
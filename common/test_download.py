@@ -0,0 +1,143 @@
+"""
+Tests of the resumable chunked download, against a local HTTP server
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from common.download import ChunkedDownload, download_csv, resolve_url
+
+CSV = ("id,price,room_type\n" +
+       "".join(f"{i},{i % 300}.0,Private room\n" for i in range(20000))).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves the files of the server, with byte ranges unless disabled,
+    failing the ranges starting at the offsets in server.failing"""
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        with self.server.lock:
+            self.server.requests.append(match and int(match.group(1)))
+        if match and self.server.ranges:
+            start, end = int(match.group(1)), int(match.group(2))
+            if start in self.server.failing:
+                self.send_error(500)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    """Local server of a csv file and of its gzip compression"""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.files = {"/listings.csv": CSV, "/listings.csv.gz": gzip.compress(CSV)}
+    httpd.ranges, httpd.failing = True, set()
+    httpd.lock, httpd.requests = threading.Lock(), []
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def read(path):
+    with open(path, "rb") as fp:
+        return fp.read()
+
+
+def test_chunked_download(tmp_path, server):
+    path = download_csv(server.url + "/listings.csv", str(tmp_path), "listings.csv",
+                        sha256=hashlib.sha256(CSV).hexdigest(), chunk_size=50000)
+
+    assert read(path) == CSV
+    # The probe, then one range request per chunk
+    assert len(server.requests) == 1 + -(-len(CSV) // 50000)
+    assert os.listdir(tmp_path) == ["listings.csv"]
+
+
+def test_failed_download_is_resumed(tmp_path, server):
+    path = str(tmp_path / "listings.download")
+    server.failing = {100000}
+
+    with pytest.raises(IOError):
+        ChunkedDownload(server.url + "/listings.csv", path, chunk_size=50000,
+                        max_retries=1).run()
+    with open(path + ".part.json") as fp:
+        done = json.load(fp)["done"]
+    assert 2 not in done and len(done) > 0
+
+    server.failing = set()
+    server.requests.clear()
+    ChunkedDownload(server.url + "/listings.csv", path, chunk_size=50000).run()
+
+    assert read(path) == CSV
+    # Only the chunks missing from the first attempt are requested again
+    assert sorted(server.requests[1:]) == \
+        [index * 50000 for index in range(-(-len(CSV) // 50000)) if index not in done]
+    assert not os.path.exists(path + ".part.json")
+
+
+def test_checksum_mismatch(tmp_path, server):
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        download_csv(server.url + "/listings.csv", str(tmp_path), "listings.csv",
+                     sha256="0" * 64)
+    assert os.listdir(tmp_path) == []
+
+
+def test_gzip_source(tmp_path, server):
+    path = download_csv(server.url + "/listings.csv.gz", str(tmp_path), "listings.csv",
+                        chunk_size=50000)
+    assert read(path) == CSV
+
+    path = download_csv(server.url + "/listings.csv.gz", str(tmp_path), "kept.csv",
+                        decompress=False)
+    assert path.endswith("kept.csv.gz")
+    assert gzip.decompress(read(path)) == CSV
+
+
+def test_server_without_ranges(tmp_path, server):
+    server.ranges = False
+    path = download_csv(server.url + "/listings.csv", str(tmp_path), "listings.csv",
+                        chunk_size=50000)
+
+    assert read(path) == CSV
+    # The probe, then the whole file in one request
+    assert len(server.requests) == 2
+
+
+def test_html_page_is_rejected(tmp_path, server):
+    server.files["/page"] = b"<!DOCTYPE html>\n<html></html>\n"
+    with pytest.raises(ValueError, match="html page"):
+        download_csv(server.url + "/page", str(tmp_path), "listings.csv")
+
+
+def test_resolve_url():
+    assert resolve_url("https://drive.google.com/file/d/abc123/view?usp=sharing") == \
+        "https://drive.usercontent.google.com/download?id=abc123&export=download&confirm=t"
+    assert resolve_url("https://drive.google.com/uc?id=xyz&export=download").endswith(
+        "id=xyz&export=download&confirm=t")
+    assert resolve_url("https://example.com/listings.csv") == "https://example.com/listings.csv"
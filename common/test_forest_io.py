@@ -0,0 +1,83 @@
+"""
+Tests of the compact forest export, whose predictions must match the
+RandomForestClassifier it was packed from
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from common import forest_io
+from common.forest_io import CompactForest, load_forest, save_forest
+
+
+@pytest.fixture(scope="module")
+def data():
+    """Features and string classes of a three-class problem"""
+    X, y = make_classification(n_samples=600, n_features=8, n_informative=5,
+                               n_classes=3, random_state=0)
+    X = pd.DataFrame(X, columns=[f"feature_{i}" for i in range(X.shape[1])])
+    return X, np.array(["low", "mid", "high"])[y]
+
+
+@pytest.fixture(scope="module")
+def forest(data):
+    X, y = data
+    return RandomForestClassifier(n_estimators=15, max_depth=8,
+                                  random_state=0).fit(X, y)
+
+
+def test_matches_sklearn(tmp_path, data, forest):
+    X, _ = data
+    save_forest(forest, str(tmp_path))
+    compact = load_forest(str(tmp_path))
+
+    assert compact.n_estimators == forest.n_estimators
+    assert list(compact.classes_) == list(forest.classes_)
+    assert list(compact.feature_names_in_) == list(X.columns)
+    np.testing.assert_allclose(compact.predict_proba(X), forest.predict_proba(X),
+                               rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(compact.predict(X), forest.predict(X))
+
+
+def test_leaves_match_sklearn(data, forest):
+    X, _ = data
+    compact = CompactForest.from_estimator(forest)
+
+    leaves = compact.apply(X)
+    assert leaves.shape == (len(X), forest.n_estimators)
+    # Leaves are numbered across trees, offset by the root of each tree
+    np.testing.assert_array_equal(leaves - np.asarray(compact.roots), forest.apply(X))
+
+
+def test_blocks_give_the_same_predictions(monkeypatch, data, forest):
+    X, _ = data
+    expected = CompactForest.from_estimator(forest).predict_proba(X)
+
+    # Blocks of 7 rows for 15 trees
+    monkeypatch.setattr(forest_io, "BLOCK_SIZE", 7 * forest.n_estimators)
+    compact = CompactForest.from_estimator(forest)
+    np.testing.assert_array_equal(compact.predict_proba(X), expected)
+    assert compact.apply(X.iloc[:0]).shape == (0, forest.n_estimators)
+
+
+def test_pipeline_features_are_applied(tmp_path, data):
+    X, y = data
+    model = Pipeline([("scale", StandardScaler()),
+                      ("forest", RandomForestClassifier(n_estimators=5, random_state=0))])
+    model.fit(X, y)
+
+    save_forest(model, str(tmp_path))
+    compact = load_forest(str(tmp_path), mmap=False)
+
+    np.testing.assert_allclose(compact.predict_proba(X), model.predict_proba(X),
+                               rtol=0, atol=1e-12)
+
+
+def test_wrong_number_of_features(forest, data):
+    X, _ = data
+    with pytest.raises(ValueError, match="expected 8 features"):
+        CompactForest.from_estimator(forest).predict(X.iloc[:, :3])
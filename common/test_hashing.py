@@ -0,0 +1,66 @@
+"""
+Tests of the row hashes and of the hash-based train/test split
+"""
+import numpy as np
+import pandas as pd
+
+from common.hashing import hash_split, mix_seed, row_hashes, unit_interval
+
+
+def listings(n_rows, seed=0):
+    """Return n_rows distinct listings"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "id": np.arange(n_rows),
+        "room_type": rng.choice(["Entire home/apt", "Private room", "Shared room"], n_rows),
+        "accommodates": rng.integers(1, 10, n_rows)
+    })
+
+
+def test_row_hashes_ignore_position_and_dtype():
+    data = listings(100)
+    hashes = row_hashes(data)
+
+    # The same rows in another order, index and dtypes hash alike
+    shuffled = data.sample(frac=1, random_state=0)
+    np.testing.assert_array_equal(row_hashes(shuffled.reset_index(drop=True)),
+                                  hashes[shuffled.index])
+    as_read = data.astype({"accommodates": float, "room_type": "category"})
+    np.testing.assert_array_equal(row_hashes(as_read), hashes)
+
+    # Only the key columns count
+    np.testing.assert_array_equal(row_hashes(data, ["id"]),
+                                  row_hashes(data.assign(accommodates=0), ["id"]))
+    assert len(np.unique(hashes)) == len(data)
+
+
+def test_split_is_stable_when_rows_are_appended():
+    data = listings(5000)
+    test = hash_split(data, 0.3, seed=42, columns=["id"])
+
+    appended = pd.concat([data, listings(5000, seed=1).assign(id=lambda d: d["id"] + 5000)])
+    np.testing.assert_array_equal(hash_split(appended, 0.3, seed=42, columns=["id"])[:5000],
+                                  test)
+    # Chunks are assigned as the whole table
+    chunks = [hash_split(data.iloc[start:start + 700], 0.3, 42, ["id"])
+              for start in range(0, len(data), 700)]
+    np.testing.assert_array_equal(np.concatenate(chunks), test)
+
+
+def test_split_ratio_and_seed():
+    data = listings(20000)
+    test = hash_split(data, 0.3, seed=42)
+
+    assert abs(test.mean() - 0.3) < 0.015
+    other = hash_split(data, 0.3, seed=7)
+    assert abs(other.mean() - 0.3) < 0.015
+    # Independent seeds share about 0.3 * 0.3 of the rows in test
+    assert abs((test & other).mean() - 0.09) < 0.01
+
+
+def test_unit_interval_is_uniform():
+    values = unit_interval(mix_seed(np.arange(100000, dtype=np.uint64), 3))
+
+    assert values.min() >= 0 and values.max() < 1
+    histogram, _ = np.histogram(values, bins=10, range=(0, 1))
+    assert np.all(np.abs(histogram - 10000) < 500)
@@ -0,0 +1,36 @@
+"""
+Tests of the step fingerprints of the incremental mode
+"""
+from common.incremental import StepState
+
+
+def test_fingerprint_follows_state_files(tmp_path):
+    state = StepState(str(tmp_path / "state.json"), "project")
+    source = tmp_path / "step"
+    source.mkdir()
+    (source / "run.py").write_text("print('step')")
+    fingerprint_file = tmp_path / "fingerprints.npy"
+
+    def fingerprint():
+        return state.fingerprint([], {"data.chunksize": 0}, [str(source)],
+                                 [str(fingerprint_file)])
+
+    missing = fingerprint()
+    assert fingerprint() == missing
+
+    fingerprint_file.write_bytes(b"first run")
+    first = fingerprint()
+    assert first != missing
+
+    fingerprint_file.write_bytes(b"second run")
+    assert fingerprint() not in (missing, first)
+
+
+def test_recorded_fingerprint_is_up_to_date(tmp_path):
+    state = StepState(str(tmp_path / "state.json"), "project")
+    fingerprint = state.fingerprint([], {}, [], [str(tmp_path / "missing.npy")])
+    state.record("preprocess", fingerprint, [])
+
+    reloaded = StepState(str(tmp_path / "state.json"), "project")
+    assert reloaded.is_up_to_date("preprocess", fingerprint)
+    assert not reloaded.is_up_to_date("preprocess", "other")
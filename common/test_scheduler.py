@@ -0,0 +1,93 @@
+"""
+Tests of the scheduler running the steps as a dependency graph
+"""
+import threading
+import time
+import pytest
+
+from common.scheduler import StepResult, critical_path, run_graph, validate_graph
+
+DEPENDENCIES = {"preprocess": ["download"], "segregate": ["preprocess"],
+                "profile": ["segregate"], "random_forest": ["segregate"],
+                "evaluate": ["segregate", "random_forest"]}
+STEPS = ["download", "preprocess", "segregate", "profile", "random_forest", "evaluate"]
+
+
+def test_steps_start_after_their_dependencies():
+    finished = []
+
+    def run_step(step):
+        time.sleep(0.01)
+        finished.append(step)
+
+    results = run_graph(STEPS, DEPENDENCIES, run_step, max_workers=3)
+
+    assert {result.status for result in results.values()} == {"done"}
+    for step, upstream in DEPENDENCIES.items():
+        assert all(finished.index(name) < finished.index(step) for name in upstream)
+
+
+def test_failure_skips_downstream_steps_only():
+    def run_step(step):
+        if step == "random_forest":
+            raise RuntimeError("training failed")
+
+    results = run_graph(STEPS, DEPENDENCIES, run_step, max_workers=2)
+
+    assert results["random_forest"].status == "failed"
+    assert str(results["random_forest"].error) == "training failed"
+    assert results["evaluate"].status == "upstream_failed"
+    assert results["evaluate"].seconds == 0.0
+    assert results["profile"].status == "done"
+
+
+def test_failure_propagates_transitively():
+    def run_step(step):
+        if step == "download":
+            raise OSError("network down")
+
+    results = run_graph(STEPS, DEPENDENCIES, run_step, max_workers=2)
+
+    assert results["download"].status == "failed"
+    assert all(results[step].status == "upstream_failed" for step in STEPS[1:])
+
+
+def test_steps_outside_the_run_are_satisfied():
+    results = run_graph(["segregate", "profile"], DEPENDENCIES, lambda step: None)
+
+    assert {step: result.status for step, result in results.items()} == \
+        {"segregate": "done", "profile": "done"}
+
+
+def test_max_workers_bounds_concurrency():
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def run_step(step):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    run_graph([f"step_{i}" for i in range(6)], {}, run_step, max_workers=2)
+
+    assert peak[0] == 2
+
+
+def test_validate_graph():
+    validate_graph(STEPS, DEPENDENCIES)
+
+    with pytest.raises(ValueError, match="cycle"):
+        validate_graph(["a", "b"], {"a": ["b"], "b": ["a"]})
+    with pytest.raises(ValueError, match="Unknown"):
+        validate_graph(["a"], {"a": ["b"]})
+
+
+def test_critical_path():
+    results = {"a": StepResult("done", 0.0, 1.0), "b": StepResult("done", 1.0, 4.0),
+               "c": StepResult("done", 1.0, 2.0), "d": StepResult("done", 4.0, 5.0)}
+    dependencies = {"b": ["a"], "c": ["a"], "d": ["b", "c"]}
+
+    assert critical_path(results, dependencies) == (["a", "b", "d"], 5.0)
@@ -0,0 +1,85 @@
+"""
+Tests of the single-pass data report and of the Kolmogorov-Smirnov tests
+on value counts, which must match scipy.stats.ks_2samp on the samples
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats
+
+from common.validation import (
+    DataReport, build_profile, ks_2samp_counts, ks_2samp_profile,
+    load_profile, save_profile)
+
+
+def counts(sample):
+    """Return the value counts of a sample"""
+    return pd.Series(sample).value_counts()
+
+
+@pytest.mark.parametrize("n1, n2", [(300, 500), (20000, 15000)])
+def test_ks_2samp_counts_matches_scipy(n1, n2):
+    rng = np.random.default_rng(0)
+    # Few distinct values, so the samples have many ties
+    sample1 = rng.poisson(4.0, n1).astype(float)
+    sample2 = rng.poisson(4.3, n2).astype(float)
+
+    statistic, p_value = ks_2samp_counts(counts(sample1), counts(sample2))
+    expected = scipy.stats.ks_2samp(sample1, sample2, alternative="two-sided")
+
+    assert statistic == pytest.approx(expected[0], abs=1e-12)
+    assert p_value == pytest.approx(expected[1], rel=1e-6, abs=1e-12)
+
+
+def test_ks_2samp_counts_rejects_empty_samples():
+    with pytest.raises(ValueError, match="empty"):
+        ks_2samp_counts(counts([1.0]), pd.Series(dtype=np.int64))
+
+
+def test_report_of_chunks_matches_whole_table():
+    rng = np.random.default_rng(1)
+    data = pd.DataFrame({"price": rng.normal(100, 20, 1000).round(),
+                         "beds": rng.integers(0, 5, 1000).astype(float),
+                         "room_type": rng.choice(["Entire home/apt", "Private room"], 1000)})
+    data.loc[::7, "beds"] = np.nan
+
+    def report(chunks):
+        return DataReport.from_chunks(chunks, ["room_type"], ["price", "beds"])
+
+    whole = report([data])
+    chunked = report([data.iloc[start:start + 128] for start in range(0, len(data), 128)])
+
+    assert chunked.n_rows == whole.n_rows == len(data)
+    assert chunked.nulls == whole.nulls
+    assert chunked.nulls["beds"] == int(data["beds"].isna().sum())
+    assert chunked.minimum == whole.minimum and chunked.maximum == whole.maximum
+    assert chunked.maximum["price"] == data["price"].max()
+    for column in ("price", "beds"):
+        pd.testing.assert_series_equal(chunked.distributions[column],
+                                       whole.distributions[column])
+    pd.testing.assert_series_equal(chunked.categories["room_type"],
+                                   whole.categories["room_type"])
+    assert chunked.out_of_range("beds", 0, 3)
+    assert not chunked.out_of_range("beds", 0, 4)
+
+
+def test_profile_matches_the_reference_sample(tmp_path):
+    rng = np.random.default_rng(2)
+    reference = pd.DataFrame({"price": rng.normal(100, 20, 3000).round()})
+    sample = rng.normal(103, 20, 800).round()
+
+    exact_path, sketch_path = str(tmp_path / "exact.json"), str(tmp_path / "sketch.json")
+    report = DataReport.from_chunks([reference], distribution_columns=["price"])
+    save_profile(build_profile(report), exact_path)
+    save_profile(build_profile(report, max_values=20), sketch_path)
+
+    expected = ks_2samp_counts(report.distributions["price"], counts(sample))
+    exact = load_profile(exact_path)["columns"]["price"]
+    assert ks_2samp_profile(exact, counts(sample)) == pytest.approx(expected)
+
+    # A sketch of 20 values is off by at most the share of the reference
+    # rows between two kept values
+    sketch = load_profile(sketch_path)["columns"]["price"]
+    assert not sketch["exact"]
+    statistic, _ = ks_2samp_profile(sketch, counts(sample))
+    assert abs(statistic - expected[0]) <= np.diff(sketch["cumulative"], prepend=0).max() / 3000
@@ -0,0 +1,288 @@
+"""
+Validation engine behind the data_checks step. Instead of every check
+scanning the whole frame again, a DataReport gathers in a single pass
+the statistics all of them need: row count, dtypes, null counts, numeric
+minimum and maximum, category counts and value distributions. Reports
+are updated chunk by chunk, so tables too large to load are validated by
+streaming over them, and the checks then only assert against the report.
+
+The Kolmogorov-Smirnov test runs on the value distributions of the
+report, sorted unique values with their counts, giving the statistic
+and p-value of scipy.stats.ks_2samp without sorting the samples again.
+
+A report of the reference dataset is also summarized into a profile, a
+small json document with the cumulative distribution, histogram and
+category frequencies of each column, so drift checks compare new data
+to the profile without reading the reference dataset at all.
+"""
+import json
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+# Largest sample size for which ks_2samp computes the exact p-value
+KS_EXACT_MAX_N = 10000
+
+
+def _merge_dtype(first, second):
+    """Return the dtype of a column whose chunks have the two dtypes"""
+    if first == second:
+        return first
+    if pd.api.types.is_categorical_dtype(first) and \
+            pd.api.types.is_categorical_dtype(second):
+        return first
+    if pd.api.types.is_numeric_dtype(first) and pd.api.types.is_numeric_dtype(second) \
+            and not pd.api.types.is_bool_dtype(first) \
+            and not pd.api.types.is_bool_dtype(second):
+        if isinstance(first, np.dtype) and isinstance(second, np.dtype):
+            return np.promote_types(first, second)
+        # Nullable integers mixed with floats, as a csv column whose
+        # chunks are not all missing values
+        if pd.api.types.is_float_dtype(first) or pd.api.types.is_float_dtype(second):
+            return np.dtype(np.float64)
+        return first
+    return np.dtype(object)
+
+
+def _add_counts(counts, new_counts):
+    """Add two value counts, keeping the values sorted"""
+    if counts is None:
+        return new_counts.sort_index()
+    return counts.add(new_counts, fill_value=0).astype(np.int64).sort_index()
+
+
+class DataReport:
+    """Statistics of a table, computed in one pass over each chunk
+    Args:
+        categorical_columns(list): Columns whose category counts are kept
+        distribution_columns(list): Numerical columns whose distribution
+    of values is kept for the Kolmogorov-Smirnov tests
+    """
+    def __init__(self, categorical_columns=(), distribution_columns=()):
+        self.categorical_columns = list(categorical_columns)
+        self.distribution_columns = list(distribution_columns)
+
+        self.n_rows = 0
+        self.dtypes = {}
+        self.nulls = {}
+        self.minimum = {}
+        self.maximum = {}
+        self.categories = {}
+        self.distributions = {}
+
+    @classmethod
+    def from_chunks(cls, chunks, categorical_columns=(), distribution_columns=()):
+        """Return the report of a table read chunk by chunk
+        Args:
+            chunks(Iterable): DataFrames with the rows of the table
+            categorical_columns(list): Columns whose category counts are kept
+            distribution_columns(list): Columns whose distribution is kept
+        Returns:
+            (DataReport): Report of all the chunks
+        """
+        report = cls(categorical_columns, distribution_columns)
+        for chunk in chunks:
+            report.update(chunk)
+        return report
+
+    def update(self, chunk):
+        """Add the statistics of a chunk of the table
+        Args:
+            chunk(pd.DataFrame): Rows of the table
+        """
+        self.n_rows += len(chunk)
+
+        for column, dtype in chunk.dtypes.items():
+            self.dtypes[column] = _merge_dtype(self.dtypes.get(column, dtype), dtype)
+
+        for column, nulls in chunk.isna().sum().items():
+            self.nulls[column] = self.nulls.get(column, 0) + int(nulls)
+
+        # Minimum and maximum of every numerical column over one 2d block,
+        # fmin and fmax skip the missing values
+        numeric = chunk.select_dtypes(include="number")
+        if len(numeric) and len(numeric.columns):
+            values = numeric.to_numpy(dtype=np.float64, na_value=np.nan)
+            for column, minimum, maximum in zip(numeric.columns,
+                                                np.fmin.reduce(values, axis=0),
+                                                np.fmax.reduce(values, axis=0)):
+                self.minimum[column] = np.fmin(self.minimum.get(column, np.nan), minimum)
+                self.maximum[column] = np.fmax(self.maximum.get(column, np.nan), maximum)
+
+        for column in self.categorical_columns:
+            self.categories[column] = _add_counts(
+                self.categories.get(column),
+                chunk[column].astype(object).value_counts(dropna=False))
+
+        for column in self.distribution_columns:
+            self.distributions[column] = _add_counts(
+                self.distributions.get(column),
+                chunk[column].dropna().astype(np.float64).value_counts())
+
+    def out_of_range(self, column, minimum, maximum):
+        """Check whether the non-null values of a column leave a range
+        Args:
+            column(str): Numerical column
+            minimum(float): Smallest value allowed
+            maximum(float): Largest value allowed
+        Returns:
+            (bool): True when a value is below minimum or above maximum
+        """
+        return bool(self.minimum[column] < minimum or self.maximum[column] > maximum)
+
+
+def ks_2samp_counts(counts1, counts2):
+    """Two-sided two-sample Kolmogorov-Smirnov test on value counts, with
+    the statistic and p-value scipy.stats.ks_2samp returns on the samples
+    Args:
+        counts1(pd.Series): Counts of the first sample, indexed by value
+        counts2(pd.Series): Counts of the second sample, indexed by value
+    Returns:
+        (float, float): KS statistic and p-value
+    """
+    counts1, counts2 = counts1.sort_index(), counts2.sort_index()
+    n1, n2 = int(counts1.sum()), int(counts2.sum())
+    if min(n1, n2) == 0:
+        raise ValueError("Data passed to ks_2samp must not be empty")
+
+    if max(n1, n2) <= KS_EXACT_MAX_N:
+        # Small samples use the exact distribution, rebuilding them is cheap
+        result = scipy.stats.ks_2samp(
+            np.repeat(counts1.index.to_numpy(dtype=np.float64), counts1.to_numpy()),
+            np.repeat(counts2.index.to_numpy(dtype=np.float64), counts2.to_numpy()),
+            alternative='two-sided')
+        return result[0], result[1]
+
+    # Empirical distribution functions at every distinct value, the
+    # largest gap between them is reached at one of those values
+    values = np.union1d(counts1.index.to_numpy(dtype=np.float64),
+                        counts2.index.to_numpy(dtype=np.float64))
+    cdfs = []
+    for counts, n_values in ((counts1, n1), (counts2, n2)):
+        cumulative = np.append(0, np.cumsum(counts.to_numpy()))
+        position = np.searchsorted(counts.index.to_numpy(dtype=np.float64),
+                                   values, side='right')
+        cdfs.append(cumulative[position] / n_values)
+
+    differences = cdfs[0] - cdfs[1]
+    statistic = max(np.clip(-differences.min(), 0, 1), differences.max())
+
+    # Smirnov's asymptotic distribution, as ks_2samp uses for large samples
+    m, n = sorted([float(n1), float(n2)], reverse=True)
+    p_value = scipy.stats.kstwo.sf(statistic, np.round(m * n / (m + n)))
+    return float(statistic), float(np.clip(p_value, 0, 1))
+
+
+def _column_profile(counts, max_values, bins):
+    """Return the profile of the value counts of a numerical column"""
+    values = counts.index.to_numpy(dtype=np.float64)
+    cumulative = np.cumsum(counts.to_numpy(dtype=np.int64))
+    n_values = int(cumulative[-1]) if len(cumulative) else 0
+
+    exact = len(values) <= max_values
+    if not exact:
+        # Quantile sketch: the values where the cumulative count crosses
+        # each of max_values evenly spaced ranks, always with the largest
+        # value, keeping their exact cumulative counts
+        ranks = np.linspace(0, n_values, max_values + 1)[1:]
+        keep = np.unique(np.searchsorted(cumulative, ranks, side='left'))
+        values, cumulative = values[keep], cumulative[keep]
+
+    histogram, edges = np.histogram(counts.index.to_numpy(dtype=np.float64),
+                                    bins=bins, weights=counts.to_numpy()) \
+        if n_values else (np.zeros(0), np.zeros(0))
+
+    return {
+        "count": n_values,
+        "exact": bool(exact),
+        "values": values.tolist(),
+        "cumulative": cumulative.tolist(),
+        "histogram": {"edges": edges.tolist(),
+                      "counts": histogram.astype(np.int64).tolist()}
+    }
+
+
+def build_profile(report, max_values=10000, bins=50):
+    """Summarize the report of a reference dataset for drift checks
+    Args:
+        report(DataReport): Report with the distributions of the numerical
+    columns and the counts of the categorical ones
+        max_values(int): Columns with more distinct values keep a quantile
+    sketch of that many values instead of their whole distribution
+        bins(int): Number of bins of the histogram of each column
+    Returns:
+        (dict): Profile, serializable as json
+    """
+    return {
+        "n_rows": report.n_rows,
+        "nulls": report.nulls,
+        "minimum": {column: float(value) for column, value in report.minimum.items()},
+        "maximum": {column: float(value) for column, value in report.maximum.items()},
+        "columns": {column: _column_profile(counts, max_values, bins)
+                    for column, counts in report.distributions.items()},
+        "categories": {column: {str(value): float(frequency) for value, frequency
+                                in (counts / counts.sum()).items()}
+                       for column, counts in report.categories.items()}
+    }
+
+
+def save_profile(profile, path):
+    """Write a profile as json
+    Args:
+        profile(dict): Profile returned by build_profile
+        path(str): Path of the json file
+    """
+    with open(path, "w") as fp:
+        json.dump(profile, fp)
+
+
+def load_profile(path):
+    """Read a profile written by save_profile
+    Args:
+        path(str): Path of the json file
+    Returns:
+        (dict): Profile
+    """
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def ks_2samp_profile(column_profile, counts):
+    """Two-sided Kolmogorov-Smirnov test of a sample against the profile of
+    a reference column. Exact profiles give the statistic and p-value of
+    scipy.stats.ks_2samp on the two samples. Quantile sketches know the
+    reference distribution function exactly at the kept values only, the
+    statistic is then off by at most the share of rows between two of them
+    Args:
+        column_profile(dict): Profile of the column in the reference data
+        counts(pd.Series): Counts of the sample values, indexed by value
+    Returns:
+        (float, float): KS statistic and p-value
+    """
+    values = np.asarray(column_profile["values"], dtype=np.float64)
+    cumulative = np.asarray(column_profile["cumulative"], dtype=np.int64)
+
+    if column_profile["exact"]:
+        reference = pd.Series(np.diff(cumulative, prepend=0), index=values)
+        return ks_2samp_counts(reference, counts)
+
+    counts = counts.sort_index()
+    n1, n2 = int(column_profile["count"]), int(counts.sum())
+    if min(n1, n2) == 0:
+        raise ValueError("Data passed to ks_2samp must not be empty")
+
+    # Distribution functions at the kept reference values and at every
+    # distinct value of the sample
+    sample_values = counts.index.to_numpy(dtype=np.float64)
+    points = np.union1d(values, sample_values)
+    reference_cdf = np.append(0, cumulative)[
+        np.searchsorted(values, points, side='right')] / n1
+    sample_cdf = np.append(0, np.cumsum(counts.to_numpy()))[
+        np.searchsorted(sample_values, points, side='right')] / n2
+
+    differences = reference_cdf - sample_cdf
+    statistic = max(np.clip(-differences.min(), 0, 1), differences.max())
+
+    m, n = sorted([float(n1), float(n2)], reverse=True)
+    p_value = scipy.stats.kstwo.sf(statistic, np.round(m * n / (m + n)))
+    return float(statistic), float(np.clip(p_value, 0, 1))
@@ -2,47 +2,86 @@
 Author: Matheus Silva
 Date: July 2022
 """
+import os
+import sys
 import pytest
-import pandas as pd
 import wandb
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.artifact_cache import artifact_file, read_artifact  # noqa: E402
+from common.artifact_io import iter_table  # noqa: E402
+from common.instrumentation import phase, start_tracer, stop_tracer  # noqa: E402
+from common.schema import CLEAN_SCHEMA  # noqa: E402
+from common.validation import DataReport, load_profile  # noqa: E402
+
+# Numerical columns compared between the reference and sample datasets
+KS_COLUMNS = ['accommodates', 'bedrooms', 'beds', 'price']
+
+# Columns whose categories are checked on the clean dataset
+CATEGORICAL_COLUMNS = ['room_type']
+
 run = wandb.init(job_type="data_checks")
 
 def pytest_addoption(parser):
     """Create parse arguments to pytest"""
     parser.addoption("--clean_data_artifact", action="store")
-    parser.addoption("--reference_artifact", action="store")
+    parser.addoption("--reference_profile", action="store")
     parser.addoption("--sample_artifact", action="store")
     parser.addoption("--ks_alpha", action="store")
+    parser.addoption("--chunksize", action="store", default="0")
+
+def pytest_configure(config):
+    """Trace the phases of the data checks"""
+    config.tracer = start_tracer("check_data")
+
+def pytest_unconfigure(config):
+    """Write the trace of the data checks"""
+    stop_tracer(config.tracer)
+
+def build_report(request, artifact_name, columns=None, **report_columns):
+    """Return the report of an artifact, computed in one pass over the
+    whole table or, when --chunksize is positive, over chunks of rows"""
+    chunksize = int(request.config.option.chunksize)
+    if chunksize > 0:
+        chunks = iter_table(artifact_file(run, artifact_name), columns=columns,
+                            chunksize=chunksize, schema=CLEAN_SCHEMA)
+    else:
+        chunks = [read_artifact(run, artifact_name, columns=columns,
+                                schema=CLEAN_SCHEMA)]
+
+    with phase("report") as timing:
+        report = DataReport.from_chunks(chunks, **report_columns)
+        timing.rows = report.n_rows
+    return report
 
 @pytest.fixture(scope="session")
-def full_data(request):
-    """Access wandb artifacts and return the completed clean dataset"""
+def data_report(request):
+    """Access wandb artifacts and return the report of the clean dataset"""
     clean_data_artifact = request.config.option.clean_data_artifact
     if clean_data_artifact is None:
         pytest.fail("--clean_data_artifact missing on command line")
 
-    local_path = run.use_artifact(clean_data_artifact).file()
-    return pd.read_csv(local_path)
+    return build_report(request, clean_data_artifact,
+                        categorical_columns=CATEGORICAL_COLUMNS)
 
 @pytest.fixture(scope="session")
 def splitted_data(request):
-    """Access wandb artifacts and return the splitted clean datasets"""
-    reference_artifact = request.config.option.reference_artifact
-    if reference_artifact is None:
-        pytest.fail("--clean_data_artifact missing on command line")
+    """Access wandb artifacts and return the profile of the reference
+    dataset and the report of the sample, with the distributions of the
+    KS columns"""
+    reference_profile = request.config.option.reference_profile
+    if reference_profile is None:
+        pytest.fail("--reference_profile missing on command line")
 
     sample_artifact = request.config.option.sample_artifact
     if sample_artifact is None:
         pytest.fail("--sample_artifact missing on command line")
 
-    local_path = run.use_artifact(reference_artifact).file()
-    sample1 = pd.read_csv(local_path)
-
-    local_path = run.use_artifact(sample_artifact).file()
-    sample2 = pd.read_csv(local_path)
+    profile = load_profile(artifact_file(run, reference_profile))
+    sample = build_report(request, sample_artifact, columns=KS_COLUMNS,
+                          distribution_columns=KS_COLUMNS)
 
-    return sample1, sample2
+    return profile, sample
 
 @pytest.fixture(scope="session")
 def ks_alpha(request):
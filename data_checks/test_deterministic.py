@@ -5,50 +5,57 @@ Date: July 2022
 import pandas as pd
 
 
-def test_dataset_size(full_data):
+def is_string_like_dtype(column):
+    """Check if column, or dtype, holds strings, as object or categorical"""
+    return pd.api.types.is_object_dtype(column) or \
+        pd.api.types.is_categorical_dtype(column)
+
+
+def test_dataset_size(data_report):
     """Check if dataset has more than 3000 rows"""
-    assert len(full_data) > 3000, "The choosen Dataset is smaller than 3000 rows."
+    assert data_report.n_rows > 3000, "The choosen Dataset is smaller than 3000 rows."
 
 
-def test_column_presence_and_type(full_data):
-    """Check if dataset has all needed columns with the correct type"""
+def test_column_presence_and_type(data_report):
+    """Check if dataset has all needed columns with the compact types of
+    common/schema.py"""
 
     required_columns = {
-        "room_type": pd.api.types.is_object_dtype,
-        "accommodates": pd.api.types.is_int64_dtype,
+        "room_type": is_string_like_dtype,
+        "accommodates": pd.api.types.is_integer_dtype,
         "bathrooms": pd.api.types.is_float_dtype,
-        "bedrooms": pd.api.types.is_int64_dtype,
-        "beds": pd.api.types.is_int64_dtype,
+        "bedrooms": pd.api.types.is_integer_dtype,
+        "beds": pd.api.types.is_integer_dtype,
         "price": pd.api.types.is_float_dtype,
-        "host_listings_count": pd.api.types.is_int64_dtype,
-        "availability_30": pd.api.types.is_int64_dtype,
-        "availability_60": pd.api.types.is_int64_dtype,
-        "availability_90": pd.api.types.is_int64_dtype,
-        "availability_365": pd.api.types.is_int64_dtype,
-        "number_of_reviews": pd.api.types.is_int64_dtype,
-        "minimum_nights": pd.api.types.is_int64_dtype,
-        "maximum_nights": pd.api.types.is_int64_dtype,
-        "neighbourhood_cleansed": pd.api.types.is_object_dtype,
-        "host_is_superhost": pd.api.types.is_object_dtype,
-        "host_response_time": pd.api.types.is_object_dtype,
+        "host_listings_count": pd.api.types.is_integer_dtype,
+        "availability_30": pd.api.types.is_integer_dtype,
+        "availability_60": pd.api.types.is_integer_dtype,
+        "availability_90": pd.api.types.is_integer_dtype,
+        "availability_365": pd.api.types.is_integer_dtype,
+        "number_of_reviews": pd.api.types.is_integer_dtype,
+        "minimum_nights": pd.api.types.is_integer_dtype,
+        "maximum_nights": pd.api.types.is_integer_dtype,
+        "neighbourhood_cleansed": is_string_like_dtype,
+        "host_is_superhost": pd.api.types.is_bool_dtype,
+        "host_response_time": is_string_like_dtype,
         "host_response_rate": pd.api.types.is_float_dtype,
-        "instant_bookable": pd.api.types.is_object_dtype,
-        "host_identity_verified": pd.api.types.is_object_dtype,
+        "instant_bookable": pd.api.types.is_bool_dtype,
+        "host_identity_verified": pd.api.types.is_bool_dtype,
         "host_verifications": pd.api.types.is_object_dtype,
         "amenities": pd.api.types.is_object_dtype
     }
 
     # Check column presence
-    assert set(full_data.columns.values).issuperset(
+    assert set(data_report.dtypes).issuperset(
         set(required_columns.keys()))
 
     for col_name, format_verification_funct in required_columns.items():
 
-        assert format_verification_funct(full_data[col_name]), \
+        assert format_verification_funct(data_report.dtypes[col_name]), \
             f"Column {col_name} failed test {format_verification_funct}"
 
 
-def test_class_names(full_data):
+def test_class_names(data_report):
     """Check that only the known classes are present"""
     known_classes = [
         'Entire home/apt',
@@ -57,10 +64,10 @@ def test_class_names(full_data):
         'Hotel room'
     ]
 
-    assert full_data["room_type"].isin(known_classes).all()
+    assert set(data_report.categories["room_type"].index).issubset(known_classes)
 
 
-def test_column_ranges(full_data):
+def test_column_ranges(data_report):
     """Check if all columns have meaningful data ranges"""
     ranges = {
         "accommodates": (1, 999),
@@ -80,7 +87,8 @@ def test_column_ranges(full_data):
 
     for col_name, (minimum, maximum) in ranges.items():
 
-        assert full_data[col_name].dropna().between(minimum, maximum).all(), (
+        assert not data_report.out_of_range(col_name, minimum, maximum), (
             f"Column {col_name} failed the test. Should be between {minimum} and {maximum}, "
-            f"instead min={full_data[col_name].min()} and max={full_data[col_name].max()}"
+            f"instead min={data_report.minimum[col_name]} and "
+            f"max={data_report.maximum[col_name]}"
         )
@@ -2,11 +2,15 @@
 Author: Matheus Silva
 Date: July 2022
 """
-import scipy.stats
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.validation import ks_2samp_profile  # noqa: E402
 
 def test_kolmogorov_smirnov(splitted_data, ks_alpha):
-    """Check if train/test datasets are correct"""
-    sample1, sample2 = splitted_data
+    """Check if the test dataset follows the profile of the train dataset"""
+    profile, sample = splitted_data
 
     numerical_columns = ['accommodates', 'bedrooms', 'beds', 'price']
 
@@ -16,10 +20,10 @@ def test_kolmogorov_smirnov(splitted_data, ks_alpha):
     for col in numerical_columns:
         # two-sided: The null hypothesis is that the two distributions are identical
         # the alternative is that they are not identical.
-        _, p_value = scipy.stats.ks_2samp(
-            sample1[col],
-            sample2[col],
-            alternative='two-sided'
+        # computed on the reference profile and the sample value counts
+        _, p_value = ks_2samp_profile(
+            profile["columns"][col],
+            sample.distributions[col]
         )
         # NOTE: as always, the p-value should be interpreted as the probability of
         # obtaining a test statistic (TS) equal or more extreme that the one we got
@@ -7,9 +7,14 @@ and create a wandb artifact.
 import argparse
 import logging
 import os
-import gdown
+import sys
 import wandb
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.download import download_csv  # noqa: E402
+from common.instrumentation import phase, traced  # noqa: E402
+from common.publisher import ArtifactPublisher  # noqa: E402
+
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(message)s",
                     datefmt='%d-%m-%Y %H:%M:%S')
@@ -17,6 +22,7 @@ logging.basicConfig(level=logging.INFO,
 LOGGER = logging.getLogger()
 
 
+@traced("download")
 def process_args(args):
     """Process args passed by cmdline and fetch raw data
     Args:
@@ -25,29 +31,33 @@ def process_args(args):
         args.artifact_name:  Name for the artifact
         args.artifact_type: Type for the artifact
         args.artifact_description: Description for the artifact
+        args.sha256: Expected sha256 of the downloaded file, "null" skips
+    the check
+        args.n_workers: Byte ranges downloaded at the same time
+        args.chunk_size_mb: Size of each byte range in MB
+        args.download_dir: Directory keeping partial downloads to resume
     """
     run = wandb.init(job_type="download_data")
 
     LOGGER.info("Dowloading file from %s", args.input_url)
-    filename = gdown.download(args.input_url, quiet=False)
-    file_validation(filename)
-    raw_data = get_csv_file(filename)
-
-    LOGGER.info("Creating W&B artifact")
-    artifact = wandb.Artifact(
-        name=args.artifact_name,
-        type=args.artifact_type,
-        description=args.artifact_description
-    )
-    artifact.add_file(raw_data)
+    with phase("download"):
+        raw_data = download_csv(
+            args.input_url,
+            os.path.expanduser(args.download_dir),
+            args.artifact_name,
+            sha256=args.sha256 if args.sha256 != "null" else None,
+            chunk_size=int(args.chunk_size_mb * 2 ** 20),
+            n_workers=args.n_workers
+        )
 
     LOGGER.info("Logging artifact to wandb project")
-    run.log_artifact(artifact)
+    with ArtifactPublisher(run) as publisher:
+        publisher.publish(args.artifact_name, args.artifact_type,
+                          args.artifact_description, raw_data)
 
     LOGGER.info("Removing csv temporary file")
     os.remove(raw_data)
 
-    run.finish()
 
 if __name__ == "__main__":
     PARSER = argparse.ArgumentParser(
@@ -83,5 +93,37 @@ if __name__ == "__main__":
         default="",
         required=False
     )
+
+    PARSER.add_argument(
+        "--sha256",
+        type=str,
+        help="Expected sha256 of the downloaded file, null skips the check",
+        default="null",
+        required=False
+    )
+
+    PARSER.add_argument(
+        "--n_workers",
+        type=int,
+        help="Byte ranges downloaded at the same time",
+        default=4,
+        required=False
+    )
+
+    PARSER.add_argument(
+        "--chunk_size_mb",
+        type=float,
+        help="Size of each byte range in MB",
+        default=8,
+        required=False
+    )
+
+    PARSER.add_argument(
+        "--download_dir",
+        type=str,
+        help="Directory keeping partial downloads, resumed by the next run",
+        default="~/.cache/mlops_airbnb/downloads",
+        required=False
+    )
     ARGS = PARSER.parse_args()
     process_args(ARGS)
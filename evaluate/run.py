@@ -1,80 +1,93 @@
+"""
+Author: Matheus Silva
+Date: July 2022
+This project is responsible for evaluating the exported random forest
+on the test artifact.
+"""
 import os
+import sys
 import argparse
 import logging
-import pandas as pd
+import time
 import numpy as np
 import wandb
-import mlflow
-from sklearn.pipeline import Pipeline
-from sklearn.metrics import mean_absolute_error
-from sklearn.metrics import explained_variance_score
-from sklearn.metrics import max_error
-from sklearn.metrics import mean_squared_error
+from sklearn.metrics import accuracy_score
+from sklearn.metrics import roc_auc_score
+from sklearn.metrics import ConfusionMatrixDisplay
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.artifact_cache import artifact_dir, read_artifact  # noqa: E402
+from common.instrumentation import phase, traced  # noqa: E402
+from common.model_io import load_model  # noqa: E402
+from common.schema import CLEAN_SCHEMA  # noqa: E402
+
 # configure logging
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(message)s",
                     datefmt='%d-%m-%Y %H:%M:%S')
 
 # reference for a logging obj
-logger = logging.getLogger()
+LOGGER = logging.getLogger()
 
 
+@traced("evaluate")
 def process_args(args):
+    """Process args passed by command line
+    Args:
+        args - command line arguments
+        args.model_export: Fully qualified name for the model export artifact
+        args.test_data: Fully qualified name for the test data artifact
+        args.target: Column predicted by the model
+    """
     run = wandb.init(job_type="test")
 
+    LOGGER.info("Downloading and reading the exported model")
+    model_export_path = artifact_dir(run, args.model_export)
+    start = time.perf_counter()
+    with phase("load_model"):
+        model = load_model(model_export_path)
+    run.summary["model_load_seconds"] = time.perf_counter() - start
+
     LOGGER.info("Downloading and reading test artifact")
-    test_data_path = run.use_artifact(args.test_data).file()
-    df_test = pd.read_csv(test_data_path)
+    features = list(model.feature_names_in_)
+    df_test = read_artifact(run, args.test_data, columns=features + [args.target],
+                            schema=CLEAN_SCHEMA)
 
     LOGGER.info("Extracting target from dataframe")
-    x_test = df_test.copy()
-    y_test = x_test.pop("price")
-    
-    LOGGER.info("Downloading and reading the exported model")
-    model_export_path = run.use_artifact(args.model_export).download()
-    full_pipeline_path = os.path.join(model_export_path, 'full_pipeline')
-    regressor_path = os.path.join(model_export_path, 'regressor')
-
-    full_pipeline = mlflow.sklearn.load_model(full_pipeline_path)
-    regressor = mlflow.keras.load_model(regressor_path)
-    pipe = Pipeline(steps=[('full_pipeline', full_pipeline),
-                           ('regressor', regressor)
-                           ]
-                    )
+    x_test = df_test[features]
+    y_test = df_test[args.target]
 
     ## Predict test data
-    predict = pipe.predict(x_test)
+    with phase("predict", rows=len(x_test)):
+        proba = model.predict_proba(x_test)
+        predict = model.classes_[np.argmax(proba, axis=1)]
 
     # Evaluation Metrics
     LOGGER.info("Evaluation metrics")
-    # Metric: MAE
-    mae = mean_absolute_error(y_test, predict)
-    run.summary["MAE"] = mae
-
-    # Metric: RMSE
-    rmse = np.sqrt(mean_squared_error(y_test, predict))
-    run.summary["RMSE"] = rmse
-
-    # Metric: Max Error
-    max_err = max_error(y_test, predict)
-    run.summary["Max Error"] = max_err
-    
-    # Metric: Explained Variance Score
-    evs = explained_variance_score(y_test, predict)
-    run.summary["Explained Variance Score"] = evs
-
-    LOGGER.info("Plotting predictions")
-    plt.scatter(predict, y_test)
-    plt.xlabel("Predicted")
-    plt.ylabel("True")
+    # Metric: AUC, one-vs-rest over the class probabilities
+    auc = roc_auc_score(y_test, proba[:, 1] if proba.shape[1] == 2 else proba,
+                        multi_class="ovr", average="macro", labels=model.classes_)
+    run.summary["AUC"] = auc
+
+    # Metric: Accuracy
+    acc = accuracy_score(y_test, predict)
+    run.summary["Accuracy"] = acc
+    LOGGER.info("AUC %.4f, accuracy %.4f", auc, acc)
+
+    LOGGER.info("Plotting the confusion matrix")
+    fig_cm, sub_cm = plt.subplots(figsize=(10, 10))
+    ConfusionMatrixDisplay.from_predictions(
+        y_test, predict, labels=model.classes_, normalize="true", ax=sub_cm)
+    fig_cm.tight_layout()
 
     LOGGER.info("Uploading image")
     run.log(
         {
-            "predicted": wandb.Image(plt)
+            "confusion_matrix": wandb.Image(fig_cm)
         }
+    )
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -96,6 +109,14 @@ if __name__ == "__main__":
         required=True,
     )
 
+    parser.add_argument(
+        "--target",
+        type=str,
+        help="Name of the column predicted by the model",
+        required=False,
+        default="room_type",
+    )
+
     ARGS = parser.parse_args()
 
-    process_args(ARGS)
\ No newline at end of file
+    process_args(ARGS)
@@ -2,11 +2,195 @@
 Creator: Matheus Silva
 Date: Jul. 2022
 """
+import logging
 import mlflow
 import os
+import time
 import hydra
 from omegaconf import DictConfig, OmegaConf
 
+from common.incremental import StepState
+from common.instrumentation import Tracer
+from common.runner import log_timings, run_in_process
+from common.scheduler import critical_path, run_graph, validate_graph
+
+LOGGER = logging.getLogger()
+
+# Directory of each step, in their preferred order. The order they run
+# in is set by main.dependencies in config.yaml
+STEP_PATHS = {
+    "download": "download",
+    "preprocess": "preprocessing",
+    "segregate": "segregation",
+    "profile": "profiling",
+    "check_data": "data_checks",
+    "random_forest": "random_forest",
+    "evaluate": "evaluate"
+}
+
+
+def step_parameters(step, config):
+    """Return the parameters of the mlflow run of a step
+    Args:
+        step(str): Name of the step
+        config(DictConfig): Pipeline configuration
+    Returns:
+        (dict): Parameters passed to the step entry point
+    """
+    if step == "download":
+        return {
+            "input_url": config["data"]["input_url"],
+            "artifact_name": "raw_data.csv",
+            "artifact_type": "raw_data",
+            "artifact_description": "Raw data from airbnb house prices in Rio de Janeiro",
+            "sha256": config["data"]["download"]["sha256"],
+            "n_workers": config["data"]["download"]["n_workers"],
+            "chunk_size_mb": config["data"]["download"]["chunk_size_mb"],
+            "download_dir": config["data"]["download"]["dir"]
+        }
+
+    if step == "preprocess":
+        return {
+            "input_artifact": "raw_data.csv:latest",
+            "artifact_name": "clean_data.csv",
+            "artifact_type": "clean_data",
+            "artifact_description": "Preprocessed data",
+            "chunksize": config["data"]["chunksize"],
+            "artifact_format": config["main"]["artifact_format"],
+            "pipeline_artifact": config["data"]["pipeline_artifact"],
+            "fingerprint_file": config["data"]["dedup"]["fingerprint_file"]
+        }
+
+    if step == "segregate":
+        return {
+            "input_artifact": "clean_data.csv:latest",
+            "artifact_root": "data",
+            "artifact_type": "segregated_data",
+            "test_size": config["data"]["test_size"],
+            "stratify": config["data"]["stratify"],
+            "random_state": config["main"]["random_seed"],
+            "artifact_format": config["main"]["artifact_format"],
+            "split_mode": config["data"]["split"]["mode"],
+            "key_columns": config["data"]["split"]["key_columns"],
+            "chunksize": config["data"]["split"]["chunksize"]
+        }
+
+    if step == "profile":
+        return {
+            "input_artifact": config["data"]["reference_dataset"],
+            "artifact_name": "reference_profile.json",
+            "artifact_type": "reference_profile",
+            "artifact_description": "Profile of the reference dataset for the drift checks",
+            "max_values": config["data"]["profile"]["max_values"],
+            "bins": config["data"]["profile"]["bins"],
+            "chunksize": config["data"]["chunksize"]
+        }
+
+    if step == "check_data":
+        return {
+            "clean_data_artifact": "clean_data.csv:latest",
+            "reference_profile": config["data"]["reference_profile"],
+            "sample_artifact": config["data"]["sample_dataset"],
+            "ks_alpha": config["data"]["ks_alpha"],
+            "chunksize": config["data"]["chunksize"]
+        }
+
+    if step == "random_forest":
+        # Serialize random forest configuration
+        model_config = os.path.abspath("random_forest_config.yml")
+
+        with open(model_config, "w+") as fp:
+            fp.write(OmegaConf.to_yaml(config["random_forest_pipeline"]))
+
+        return {
+            "train_data": "train_data.csv:latest",
+            "model_config": model_config,
+            "export_artifact": config["random_forest_pipeline"]["export_artifact"],
+            "pipeline_artifact": f"{config['data']['pipeline_artifact']}:latest",
+            "random_seed": config["main"]["random_seed"],
+            "val_size": config["data"]["val_size"],
+            "stratify": config["data"]["stratify"]
+        }
+
+    if step == "evaluate":
+        return {
+            "model_export": f"{config['random_forest_pipeline']['export_artifact']}:latest",
+            "test_data": "test_data.csv:latest",
+            "target": config["data"]["stratify"]
+        }
+
+    raise ValueError(f"Unknown step {step}")
+
+
+def step_artifacts(step, config):
+    """Return the input and output artifacts of a step
+    Args:
+        step(str): Name of the step
+        config(DictConfig): Pipeline configuration
+    Returns:
+        (list, list): Input artifact names and output artifact names
+    """
+    export_artifact = config["random_forest_pipeline"]["export_artifact"]
+
+    artifacts = {
+        "download": ([], ["raw_data.csv"]),
+        "preprocess": (["raw_data.csv:latest"],
+                       ["clean_data.csv", config["data"]["pipeline_artifact"]]),
+        "segregate": (["clean_data.csv:latest"], ["train_data.csv", "test_data.csv"]),
+        "profile": ([config["data"]["reference_dataset"]], ["reference_profile.json"]),
+        "check_data": (["clean_data.csv:latest",
+                        config["data"]["reference_profile"],
+                        config["data"]["sample_dataset"]], []),
+        "random_forest": (["train_data.csv:latest",
+                           f"{config['data']['pipeline_artifact']}:latest"],
+                          [export_artifact]),
+        "evaluate": ([f"{export_artifact}:latest", "test_data.csv:latest"], [])
+    }
+    return artifacts[step]
+
+
+def step_config(step, config):
+    """Return the slice of the configuration a step depends on
+    Args:
+        step(str): Name of the step
+        config(DictConfig): Pipeline configuration
+    Returns:
+        (dict): Configuration values used by the step
+    """
+    slices = {
+        "download": ["data.input_url", "data.download.sha256"],
+        "preprocess": ["data.chunksize", "main.artifact_format",
+                       "data.pipeline_artifact", "data.dedup.fingerprint_file"],
+        "segregate": ["data.test_size", "data.stratify", "main.random_seed",
+                      "main.artifact_format", "data.split"],
+        "profile": ["data.profile", "data.chunksize"],
+        "check_data": ["data.ks_alpha", "data.chunksize"],
+        "random_forest": ["random_forest_pipeline", "main.random_seed",
+                          "data.val_size", "data.stratify", "data.pipeline_artifact"],
+        "evaluate": ["data.stratify"]
+    }
+    config_slice = {}
+    for key in slices[step]:
+        value = OmegaConf.select(config, key)
+        config_slice[key] = OmegaConf.to_container(value) \
+            if OmegaConf.is_config(value) else value
+    return config_slice
+
+
+def step_files(step, config):
+    """Return the local files holding state a step reads and updates
+    besides its artifacts
+    Args:
+        step(str): Name of the step
+        config(DictConfig): Pipeline configuration
+    Returns:
+        (list): Paths to the files
+    """
+    if step == "preprocess" and config["data"]["dedup"]["fingerprint_file"] != "null":
+        return [os.path.expanduser(config["data"]["dedup"]["fingerprint_file"])]
+    return []
+
+
 # This automatically reads in the configuration
 @hydra.main(config_name='config')
 def process_args(config: DictConfig):
@@ -15,6 +199,28 @@ def process_args(config: DictConfig):
     os.environ["WANDB_PROJECT"] = config["main"]["project_name"]
     os.environ["WANDB_RUN_GROUP"] = config["main"]["experiment_name"]
 
+    # Local cache of the artifacts shared by all steps
+    cache_config = config["main"]["artifact_cache"]
+    os.environ["ARTIFACT_CACHE_ENABLED"] = str(cache_config["enabled"]).lower()
+    os.environ["ARTIFACT_CACHE_DIR"] = os.path.expanduser(cache_config["dir"])
+    os.environ["ARTIFACT_CACHE_MAX_SIZE_MB"] = str(cache_config["max_size_mb"])
+
+    # Artifact store and publisher settings, read by common/publisher.py
+    store_config = config["main"]["artifact_store"]
+    os.environ["ARTIFACT_STORE_BACKEND"] = store_config["backend"]
+    os.environ["ARTIFACT_STORE_DIR"] = os.path.expanduser(store_config["dir"])
+    os.environ["ARTIFACT_UPLOAD_WORKERS"] = str(store_config["upload_workers"])
+    os.environ["ARTIFACT_COMPRESSION"] = store_config["compression"]
+    if store_config["backend"] == "local":
+        # Runs still log their metrics, to local W&B files
+        os.environ.setdefault("WANDB_MODE", "offline")
+
+    # Phase instrumentation settings, read by common/instrumentation.py
+    instrumentation = config["main"]["instrumentation"]
+    os.environ["INSTRUMENTATION_TRACE_DIR"] = os.path.expanduser(instrumentation["trace_dir"])
+    os.environ["INSTRUMENTATION_PROFILE"] = instrumentation["profile"]
+    os.environ["INSTRUMENTATION_RSS_INTERVAL"] = str(instrumentation["rss_interval"])
+
     # You can get the path at the root of the MLflow project with this:
     root_path = hydra.utils.get_original_cwd()
 
@@ -25,87 +231,79 @@ def process_args(config: DictConfig):
     else:
         steps_to_execute = list(config["main"]["execute_steps"])
 
-    # Download step
-    if "download" in steps_to_execute:
-        _ = mlflow.run(
-            os.path.join(root_path, "download"),
-            "main",
-            parameters={
-                "input_url": config["data"]["input_url"],
-                "artifact_name": "raw_data.csv",
-                "artifact_type": "raw_data",
-                "artifact_description": "Raw data from airbnb house prices in Rio de Janeiro"
-            }
-        )
-
-    if "preprocess" in steps_to_execute:
-        _ = mlflow.run(
-            os.path.join(root_path, "preprocessing"),
-            "main",
-            parameters={
-                "input_artifact": "raw_data.csv:latest",
-                "artifact_name": "clean_data.csv",
-                "artifact_type": "clean_data",
-                "artifact_description": "Preprocessed data"
-            }
-        )
-
-    if "segregate" in steps_to_execute:
-        _ = mlflow.run(
-            os.path.join(root_path, "segregation"),
-            "main",
-            parameters={
-                "input_artifact": "clean_data.csv:latest",
-                "artifact_root": "data",
-                "artifact_type": "segregated_data",
-                "test_size": config["data"]["test_size"],
-                "stratify": config["data"]["stratify"],
-                "random_state": config["main"]["random_seed"]
-            }
-        )
-
-    if "check_data" in steps_to_execute:
-        _ = mlflow.run(
-            os.path.join(root_path, "data_checks"),
-            "main",
-            parameters={
-                "clean_data_artifact": "clean_data.csv:latest",
-                "reference_artifact": config["data"]["reference_dataset"],
-                "sample_artifact": config["data"]["sample_dataset"],
-                "ks_alpha": config["data"]["ks_alpha"]
-            }
-        )
-
-    if "random_forest" in steps_to_execute:
-        # Serialize random forest configuration
-        model_config = os.path.abspath("random_forest_config.yml")
+    # Fingerprints of previous runs, to skip the steps that did not change
+    incremental = config["main"]["incremental"]
+    state = StepState(os.path.expanduser(incremental["state_file"]),
+                      config["main"]["project_name"]) if incremental["enabled"] else None
 
-        with open(model_config, "w+") as fp:
-            fp.write(OmegaConf.to_yaml(config["random_forest_pipeline"]))
+    timings = {}
+
+    def execute_step(step):
+        """Run a step unless its fingerprint shows it is up to date"""
+        step_path = os.path.join(root_path, STEP_PATHS[step])
+        inputs, outputs = step_artifacts(step, config)
+
+        def fingerprint():
+            """Return the fingerprint of the step in its current state"""
+            return state.fingerprint(
+                inputs,
+                step_config(step, config),
+                [step_path, os.path.join(root_path, "common")],
+                step_files(step, config)
+            )
+
+        if state is not None:
+            if state.is_up_to_date(step, fingerprint()):
+                LOGGER.info("Skipping %s, inputs, config and source are unchanged", step)
+                return
+
+        with tracer.phase(step):
+            if config["main"]["runner"] == "in_process":
+                timings[step] = run_in_process(step, step_path, step_parameters(step, config))
+            else:
+                start = time.perf_counter()
+                _ = mlflow.run(
+                    step_path,
+                    "main",
+                    parameters=step_parameters(step, config)
+                )
+                timings[step] = {"import": None, "run": time.perf_counter() - start}
+
+        if state is not None:
+            # Recorded with the files as the run left them: preprocess adds
+            # the rows it kept to its fingerprint file, and running it again
+            # on the same raw data would drop all of them
+            state.record(step, fingerprint(), outputs)
+
+    # Steps run as soon as the steps they depend on are done
+    dependencies = OmegaConf.to_container(config["main"]["dependencies"])
+    validate_graph(list(STEP_PATHS), dependencies)
+
+    max_workers = config["main"]["max_workers"]
+    if config["main"]["runner"] == "in_process" and max_workers > 1:
+        # In-process steps share the working directory and the W&B run
+        LOGGER.warning("The in_process runner runs one step at a time")
+        max_workers = 1
+
+    steps = [step for step in STEP_PATHS if step in steps_to_execute]
+    # The steps of the pipeline, each a phase of its own trace
+    tracer = Tracer("pipeline", profile="none")
+    tracer.start()
+    start = time.perf_counter()
+    try:
+        results = run_graph(steps, dependencies, execute_step, max_workers)
+    finally:
+        tracer.finish()
+    wall_seconds = time.perf_counter() - start
 
-        _ = mlflow.run(
-            os.path.join(root_path, "random_forest"),
-            "main",
-            parameters={
-                "train_data": "train_data.csv:latest",
-                "model_config": model_config,
-                "export_artifact": config["random_forest_pipeline"]["export_artifact"],
-                "random_seed": config["main"]["random_seed"],
-                "val_size": config["data"]["val_size"],
-                "stratify": config["data"]["stratify"]
-            }
-        )
-
-    if "evaluate" in steps_to_execute:
-        _ = mlflow.run(
-            os.path.join(root_path, "evaluate"),
-            "main",
-            parameters={
-                "model_export": f"{config['random_forest_pipeline']['export_artifact']}:latest",
-                "test_data": "test_data.csv:latest"
-            }
-        )
+    log_timings(timings)
+    path, path_seconds = critical_path(results, dependencies)
+    LOGGER.info("Pipeline wall time %.2fs, critical path %s (%.2fs)",
+                wall_seconds, " -> ".join(path), path_seconds)
 
+    failed = [step for step, result in results.items() if result.status != "done"]
+    if failed:
+        raise RuntimeError(f"Steps not completed: {', '.join(failed)}")
 
 if __name__ == "__main__":
-    process_args()
\ No newline at end of file
+    process_args()
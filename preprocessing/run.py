@@ -5,13 +5,27 @@ This project is responsible for fetching the raw data
 and clean the data, generating a new artifact in wandb project.
 """
 import argparse
+import functools
 import logging
 import os
+import sys
 import pandas as pd
-import numpy as np
-from sklearn.impute import SimpleImputer
+import mlflow
 import wandb
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.artifact_io import (  # noqa: E402
+    TableWriter, artifact_filename, as_read, iter_table, write_table)
+from common.artifact_cache import ArtifactCache, keep_table  # noqa: E402
+from common.cleaning import (  # noqa: E402
+    COLUMNS, COLUMNS_DROP, FILL_COLUMNS, ListingCleaner, clean_columns)
+from common.dedup import FingerprintSet  # noqa: E402
+from common.hashing import row_fingerprints  # noqa: E402
+from common.instrumentation import phase, traced  # noqa: E402
+from common.model_io import FULL_PIPELINE_DIRNAME  # noqa: E402
+from common.publisher import ArtifactPublisher, use_artifact  # noqa: E402
+from common.schema import downcast  # noqa: E402
+
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(message)s",
                     datefmt='%d-%m-%Y %H:%M:%S')
@@ -19,99 +33,157 @@ logging.basicConfig(level=logging.INFO,
 LOGGER = logging.getLogger()
 
 
-def preprocess_data(raw_data):
-    """Return the processed DataFrame
+def rows_to_clean(raw_data, fingerprints):
+    """Return the rows of the raw data with every required column whose
+    fingerprint is new. Only those rows reach the fingerprint set, so a
+    row dropped for a missing value is kept once a later dump fills it in
+    Args:
+        raw_data(pd.DataFrame): Raw listings
+        fingerprints(FingerprintSet): Fingerprints of the rows already
+    kept, updated with the rows kept
+    Returns:
+        (np.ndarray): Boolean mask of the rows to clean
+    """
+    keep = raw_data[COLUMNS_DROP].notna().all(axis=1).to_numpy()
+    keep[keep] = fingerprints.keep(row_fingerprints(raw_data, COLUMNS)[keep])
+    return keep
+
+def preprocess_data(raw_data, fingerprints=None):
+    """Return the processed DataFrame and the cleaner fitted on it
     Args:
         raw_data(pd.DataFrame): DataFrame to clean data
+        fingerprints(FingerprintSet): Fingerprints of the rows already
+    kept, None keeps the first occurrence of each row of raw_data
     Returns:
-        (pd.DataFrame): Processed dataFrame
+        (pd.DataFrame, ListingCleaner): Processed dataFrame and fitted cleaner
     """
-    LOGGER.info("Selecting columns")
-    columns = ['room_type', 'accommodates', 'bathrooms_text',
-               'bedrooms', 'beds', 'price', 'host_listings_count',
-               'availability_30', 'availability_60', 'availability_90',
-               'availability_365', 'number_of_reviews', 'minimum_nights',
-               'maximum_nights', 'neighbourhood_cleansed', 'host_is_superhost',
-               'host_response_time', 'host_response_rate', 'instant_bookable',
-               'host_identity_verified', 'host_verifications', 'amenities']
-    raw_data = raw_data[columns]
-
-    LOGGER.info("Dropping duplicates")
-    raw_data = raw_data.drop_duplicates(ignore_index=True)
+    if fingerprints is None:
+        fingerprints = FingerprintSet()
+
+    LOGGER.info("Dropping duplicates and rows missing %s", COLUMNS_DROP)
+    with phase("dedupe", rows=len(raw_data)):
+        # Both filters as one mask, so the selected columns are copied once
+        clean_data = raw_data.loc[rows_to_clean(raw_data, fingerprints), FILL_COLUMNS]
+        clean_data.index = pd.RangeIndex(len(clean_data))
 
     LOGGER.info("Treating missing values")
-    columns_drop = ['room_type', 'bathrooms_text', 'price']
-    columns_imputer_numerical = [
-            'accommodates', 'bedrooms', 'beds', 'host_listings_count',
-            'availability_30', 'availability_60', 'availability_90',
-            'availability_365', 'number_of_reviews', 'minimum_nights',
-            'maximum_nights']
-    columns_imputer_categorical = [
-            'neighbourhood_cleansed', 'host_is_superhost', 'host_response_time',
-            'host_response_rate', 'instant_bookable', 'host_identity_verified',
-            'host_verifications', 'amenities']
-
-    clean_data = raw_data.dropna(subset=columns_drop).reset_index(drop=True)
-
-    numerical_inputer = SimpleImputer(strategy='median', missing_values=np.nan)
-    array = clean_data[columns_imputer_numerical].values
-    array = numerical_inputer.fit_transform(array)
-    imputer_numerical_df = pd.DataFrame(
-        array, columns=columns_imputer_numerical)
-
-    numerical_inputer = SimpleImputer(
-        strategy='most_frequent', missing_values=np.nan)
-    array = clean_data[columns_imputer_categorical].values
-    array = numerical_inputer.fit_transform(array)
-    imputer_categorical_df = pd.DataFrame(
-        array, columns=columns_imputer_categorical)
-
-    clean_data = pd.concat(
-        [clean_data[columns_drop], imputer_categorical_df, imputer_numerical_df],
-        axis=1
-    )
-    
-    LOGGER.info("Treating bathrooms_text column")
-    clean_data['bathrooms'] = clean_data['bathrooms_text'].apply(
-        treat_bathroom_text)
-    clean_data = clean_data.drop(axis=1, labels=['bathrooms_text'])
-
-    LOGGER.info("Treating price column")
-    clean_data['price'] = clean_data['price'].apply(
-        lambda x: float(x[1:].replace(',', '')) if isinstance(x, str) else x)
-
-    LOGGER.info("Treating host_response_rate column")
-    clean_data["host_response_rate"] = clean_data["host_response_rate"].apply(
-        lambda x: float(x.replace('%', ''))/100
-    )
+    with phase("impute", rows=len(clean_data)):
+        cleaner = ListingCleaner().fit(clean_data)
+        clean_data = cleaner.fill(clean_data, copy=False)
+
+    LOGGER.info("Cleaning columns")
+    with phase("clean_strings", rows=len(clean_data)):
+        clean_data = clean_columns(clean_data)
 
-    LOGGER.info("Treating integer column")
-    integer_columns = [
-            'accommodates', 'bedrooms', 'beds', 'host_listings_count',
-            'availability_30', 'availability_60', 'availability_90',
-            'availability_365', 'number_of_reviews', 'minimum_nights',
-            'maximum_nights']
-    clean_data[integer_columns] = clean_data[integer_columns].round(
-        0).astype(int)
+    LOGGER.info("Downcasting columns")
+    with phase("downcast", rows=len(clean_data)):
+        return downcast(clean_data), cleaner
+
+def read_chunks(artifact_path, chunksize, fingerprints):
+    """Yield the selected columns of the raw data without duplicates and
+    without missing values in the required columns
+    Args:
+        artifact_path(str): Path to the raw data file
+        chunksize(int): Number of rows read at once
+        fingerprints(FingerprintSet): Fingerprints of the rows already
+    kept, updated with the rows of each chunk
+    Yields:
+        (pd.DataFrame): Chunk of the raw data
+    """
+    chunks = iter_table(artifact_path, columns=COLUMNS, chunksize=chunksize)
+    while True:
+        with phase("read") as timing:
+            chunk = next(chunks, None)
+            timing.rows = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return
 
-    return clean_data
+        with phase("dedupe", rows=len(chunk)):
+            # A frame of its own, which the cleaner fills in place
+            chunk = chunk.loc[rows_to_clean(chunk, fingerprints), FILL_COLUMNS]
+        yield chunk
 
-def treat_bathroom_text(value):
-    """Treat bathroom_text column
+def fit_cleaner(artifact_path, chunksize, fingerprint_file=None):
+    """Return the cleaner fitted in a first pass over the chunks of the
+    raw data
     Args:
-        value(Any): Value from bathroom_text column
+        artifact_path(str): Path to the raw data file
+        chunksize(int): Number of rows read at once
+        fingerprint_file(str): File of the fingerprints of the previous
+    runs, None to only drop the duplicates of the raw data
     Returns:
-        (float): the float treated value for bathroom_text item
+        (ListingCleaner): Fitted cleaner
     """
-    if not isinstance(value, str):
-        return value
+    cleaner = ListingCleaner()
+    for chunk in read_chunks(artifact_path, chunksize, FingerprintSet(fingerprint_file)):
+        with phase("fit_imputer", rows=len(chunk)):
+            cleaner.partial_fit(chunk)
 
-    try:
-        return float(value.split(' ')[0])
-    except ValueError as excep:
-        LOGGER.debug(excep)
-        return 0.5
+    return cleaner
+
+def preprocess_stream(artifact_path, output_path, chunksize, fingerprints=None):
+    """Clean the raw data chunk by chunk, appending each cleaned chunk
+    to output_path, so memory does not grow with the input size
+    Args:
+        artifact_path(str): Path to the raw data file
+        output_path(str): Path to the output file, its extension sets
+    the artifact format
+        chunksize(int): Number of rows read at once
+        fingerprints(FingerprintSet): Fingerprints of the rows already
+    kept, None keeps the first occurrence of each row of the raw data
+    Returns:
+        (ListingCleaner): Cleaner fitted on the raw data
+    """
+    if fingerprints is None:
+        fingerprints = FingerprintSet()
+
+    LOGGER.info("Computing imputation values")
+    # The first pass starts from the same fingerprints as the second
+    cleaner = fit_cleaner(artifact_path, chunksize, fingerprints.path)
+
+    LOGGER.info("Cleaning chunks of %d rows", chunksize)
+    with TableWriter(output_path) as writer:
+        for chunk in read_chunks(artifact_path, chunksize, fingerprints):
+            with phase("impute", rows=len(chunk)):
+                chunk = cleaner.fill(chunk, copy=False)
+            with phase("clean_strings", rows=len(chunk)):
+                chunk = clean_columns(chunk)
+            with phase("downcast", rows=len(chunk)):
+                chunk = downcast(chunk)
+            with phase("write", rows=len(chunk)):
+                writer.write(chunk)
+
+    if writer.schema is None:
+        LOGGER.warning("No rows left after cleaning")
+        # Columns and dtypes of the clean data, as a non-empty output has
+        write_table(downcast(clean_columns(pd.DataFrame(columns=FILL_COLUMNS))),
+                    output_path)
+
+    return cleaner
+
+def export_cleaner(publisher, cleaner, pipeline_artifact):
+    """Export the fitted cleaner as an mlflow sklearn model, added by the
+    random_forest step to the model export as its full_pipeline
+    Args:
+        publisher(ArtifactPublisher): Publisher of the step artifacts
+        cleaner(ListingCleaner): Fitted cleaner
+        pipeline_artifact(str): Name of the artifact
+    """
+    LOGGER.info("Exporting the fitted cleaner: %s", cleaner.fill_values_)
 
+    def save_cleaner(export_path):
+        """Save the cleaner where the publisher uploads it from"""
+        mlflow.sklearn.save_model(
+            cleaner,
+            export_path,
+            serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE
+        )
+
+    publisher.publish(pipeline_artifact, "preprocessing_pipeline",
+                      "Cleaner fitted on the raw data",
+                      publisher.path(FULL_PIPELINE_DIRNAME), save_cleaner)
+
+@traced("preprocess")
 def process_args(args):
     """Process args passed by command line
     Args:
@@ -120,34 +192,64 @@ def process_args(args):
         args.artifact_name:  Name for the artifact
         args.artifact_type: Type for the artifact
         args.artifact_description: Description for the artifact
+        args.chunksize: Rows read at once in streaming mode, 0 loads
+    the whole dataset
+        args.artifact_format: File format of the artifact, one of csv,
+    parquet or feather
+        args.pipeline_artifact: Name for the artifact of the fitted
+    cleaner, "null" to skip its export
+        args.fingerprint_file: File of the fingerprints of the rows kept
+    by the previous runs, whose rows are dropped, "null" to only drop
+    the duplicates of the raw data
     """
     run = wandb.init(job_type="preproccess_data")
 
     LOGGER.info("Dowloading artifact")
-    artifact = run.use_artifact(args.input_artifact)
-    artifact_path = artifact.file()
+    artifact = use_artifact(run, args.input_artifact)
+    cache = ArtifactCache()
+    fingerprints = FingerprintSet(
+        None if args.fingerprint_file == "null" else args.fingerprint_file)
 
-    raw_data = pd.read_csv(artifact_path)
+    # The clean data and the cleaner are written and uploaded at the same
+    # time, the publisher waits for both before leaving the block
+    with ArtifactPublisher(run) as publisher:
+        output_path = publisher.path(
+            artifact_filename("preprocessed_data", args.artifact_format))
 
-    LOGGER.info("Preprocessing dataset")
-    clean_data = preprocess_data(raw_data)
+        if args.chunksize > 0:
+            LOGGER.info("Preprocessing dataset in streaming mode")
+            cleaner = preprocess_stream(cache.file(artifact), output_path,
+                                        args.chunksize, fingerprints)
+            write = None
+        else:
+            with phase("read") as timing:
+                raw_data = cache.read_table(artifact, columns=COLUMNS)
+                timing.rows = len(raw_data)
 
-    clean_data.to_csv("preprocessed_data.csv", index=False)
+            LOGGER.info("Preprocessing dataset")
+            clean_data, cleaner = preprocess_data(raw_data, fingerprints)
 
-    LOGGER.info("Creating W&B artifact")
-    artifact = wandb.Artifact(
-        name=args.artifact_name,
-        type=args.artifact_type,
-        description=args.artifact_description
-    )
-    artifact.add_file("preprocessed_data.csv")
+            keep_table(args.artifact_name, as_read(clean_data, output_path))
+            write = functools.partial(write_table, clean_data)
 
-    LOGGER.info("Logging artifact to wandb project")
-    run.log_artifact(artifact)
+        LOGGER.info("Logging artifact to wandb project")
+        publisher.publish(args.artifact_name, args.artifact_type,
+                          args.artifact_description, output_path, write)
 
-    os.remove("preprocessed_data.csv")
+        if args.pipeline_artifact != "null":
+            export_cleaner(publisher, cleaner, args.pipeline_artifact)
 
-    run.finish()
+    LOGGER.info("Removed %d duplicated rows and %d rows of previous runs",
+                fingerprints.duplicates, fingerprints.seen)
+    if fingerprints.seen and not len(fingerprints.kept):
+        LOGGER.warning("Every row was kept by a previous run, the clean data is "
+                       "empty: remove %s to preprocess this raw data again",
+                       fingerprints.path)
+    run.summary["duplicates_removed"] = fingerprints.duplicates
+    run.summary["previously_seen_removed"] = fingerprints.seen
+    # Saved once the artifacts are published, a failed run leaves the
+    # fingerprints of the previous runs untouched
+    fingerprints.save()
 
 if __name__ == "__main__":
     PARSER = argparse.ArgumentParser(
@@ -184,5 +286,39 @@ if __name__ == "__main__":
         default="",
         required=False
     )
+
+    PARSER.add_argument(
+        "--chunksize",
+        type=int,
+        help="Rows read at once in streaming mode, 0 loads the whole dataset",
+        required=False,
+        default=0
+    )
+
+    PARSER.add_argument(
+        "--artifact_format",
+        type=str,
+        help="File format of the artifact, one of csv, parquet or feather",
+        required=False,
+        default="csv"
+    )
+
+    PARSER.add_argument(
+        "--pipeline_artifact",
+        type=str,
+        help="Name for the artifact of the fitted cleaner. Use 'null' for no export.",
+        required=False,
+        default="null"
+    )
+
+    PARSER.add_argument(
+        "--fingerprint_file",
+        type=str,
+        help="File of the fingerprints of the rows kept by the previous runs, "
+             "whose rows are dropped. Use 'null' to only drop the duplicates "
+             "of the raw data.",
+        required=False,
+        default="null"
+    )
     ARGS = PARSER.parse_args()
     process_args(ARGS)
@@ -0,0 +1,78 @@
+"""
+Tests of the selection of the raw rows to clean
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import synthetic_listings
+from common.artifact_io import read_table
+from common.cleaning import COLUMNS, COLUMNS_IMPUTER_NUMERICAL, ListingCleaner
+from common.dedup import FingerprintSet
+from common.schema import CLEAN_SCHEMA
+from preprocessing.run import fit_cleaner, preprocess_data, preprocess_stream, rows_to_clean
+
+
+def raw_rows(values, price):
+    """Return raw listings with the same value in every column but price"""
+    data = pd.DataFrame({column: list(values) for column in COLUMNS})
+    data["price"] = price
+    return data
+
+
+def test_duplicates_are_dropped():
+    fingerprints = FingerprintSet()
+    keep = rows_to_clean(raw_rows("aba", ["$1.00"] * 3), fingerprints)
+
+    np.testing.assert_array_equal(keep, [True, True, False])
+    assert fingerprints.duplicates == 1 and fingerprints.seen == 0
+
+
+def test_rows_missing_required_values_are_not_remembered(tmp_path):
+    path = str(tmp_path / "fingerprints.npy")
+
+    first = FingerprintSet(path)
+    keep = rows_to_clean(raw_rows("ab", ["$1.00", None]), first)
+    np.testing.assert_array_equal(keep, [True, False])
+    assert first.removed == 0
+    first.save()
+
+    # A later dump fills in the price of the second listing
+    second = FingerprintSet(path)
+    keep = rows_to_clean(raw_rows("ab", ["$1.00", "$1.00"]), second)
+    np.testing.assert_array_equal(keep, [False, True])
+    assert second.seen == 1 and second.duplicates == 0
+
+
+def test_streaming_fit_with_more_tied_values_than_counters(tmp_path):
+    path = str(tmp_path / "raw.csv")
+    # Unique amenities, more of them than the counters of the cleaner
+    data = raw_rows("a" * 12001, "$1.00")
+    data[COLUMNS_IMPUTER_NUMERICAL] = 1
+    data["amenities"] = [f'["Wifi", "Item {i}"]' for i in range(len(data))]
+    data.loc[0, "amenities"] = np.nan
+    data.to_csv(path, index=False)
+
+    cleaner = fit_cleaner(path, chunksize=5000)
+
+    assert len(cleaner.counts_["amenities"]) == ListingCleaner().max_categories
+    # The value the one-shot fit, and SimpleImputer, pick on the tie
+    assert cleaner.fill_values_["amenities"] == \
+        ListingCleaner().fit(data).fill_values_["amenities"] == \
+        min(data["amenities"].dropna())
+    assert not cleaner.fill(data)["amenities"].isna().any()
+
+
+@pytest.mark.parametrize("extension", ["csv", "parquet", "feather"])
+def test_stream_matches_whole_table(tmp_path, extension):
+    raw_path = str(tmp_path / "raw.csv")
+    # Sorted, so the chunks hold different response time categories
+    synthetic_listings(1000, seed=1).sort_values("host_response_time", kind="mergesort") \
+        .to_csv(raw_path, index=False)
+    output_path = str(tmp_path / f"clean.{extension}")
+
+    preprocess_stream(raw_path, output_path, chunksize=100)
+
+    expected, _ = preprocess_data(read_table(raw_path))
+    pd.testing.assert_frame_equal(read_table(output_path, schema=CLEAN_SCHEMA), expected,
+                                  check_categorical=False)
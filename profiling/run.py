@@ -0,0 +1,156 @@
+"""
+This project is responsible for summarizing the reference dataset (the
+train split) into a compact profile: the distribution of every numerical
+column, kept whole or as a quantile sketch, their histograms and the
+frequencies of the categorical columns. The data checks compare new data
+to this profile instead of downloading the reference dataset again.
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+import wandb
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.artifact_cache import artifact_file, read_artifact  # noqa: E402
+from common.artifact_io import CATEGORICAL_COLUMNS, iter_table  # noqa: E402
+from common.instrumentation import phase, traced  # noqa: E402
+from common.publisher import ArtifactPublisher  # noqa: E402
+from common.schema import CLEAN_SCHEMA  # noqa: E402
+from common.validation import DataReport, build_profile, save_profile  # noqa: E402
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s %(message)s",
+                    datefmt='%d-%m-%Y %H:%M:%S')
+
+LOGGER = logging.getLogger()
+
+
+def profile_chunks(chunks, max_values, bins):
+    """Return the profile of a table read chunk by chunk
+    Args:
+        chunks(Iterable): DataFrames with the rows of the table
+        max_values(int): Distinct values kept per numerical column before
+    falling back to a quantile sketch
+        bins(int): Number of bins of the histograms
+    Returns:
+        (dict): Profile of the table
+    """
+    chunks = iter(chunks)
+    first = next(chunks)
+
+    # Every numerical column gets a distribution, the known categorical
+    # columns their frequencies
+    numerical_columns = first.select_dtypes(include="number").columns
+    categorical_columns = [column for column in CATEGORICAL_COLUMNS
+                           if column in first.columns]
+
+    report = DataReport.from_chunks(itertools.chain([first], chunks),
+                                    categorical_columns=categorical_columns,
+                                    distribution_columns=numerical_columns)
+    return build_profile(report, max_values=max_values, bins=bins)
+
+
+@traced("profile")
+def process_args(args):
+    """
+    Arguments
+        args - command line arguments
+        args.input_artifact: Fully qualified name for the reference dataset
+        args.artifact_name: Name for the W&B artifact with the profile
+        args.artifact_type: Type of the artifact
+        args.artifact_description: Description for the artifact
+        args.max_values: Distinct values kept per numerical column before
+    falling back to a quantile sketch of that many values
+        args.bins: Number of bins of the histograms
+        args.chunksize: Number of rows read at a time, 0 reads the dataset
+    at once
+    """
+    run = wandb.init(job_type="data_profile")
+
+    LOGGER.info("Reading the reference dataset %s", args.input_artifact)
+    if args.chunksize > 0:
+        chunks = iter_table(artifact_file(run, args.input_artifact),
+                            chunksize=args.chunksize, schema=CLEAN_SCHEMA)
+    else:
+        chunks = [read_artifact(run, args.input_artifact, schema=CLEAN_SCHEMA)]
+
+    with phase("profile") as timing:
+        profile = profile_chunks(chunks, args.max_values, args.bins)
+        timing.rows = profile["n_rows"]
+    LOGGER.info("Profiled %d rows, %d numerical and %d categorical columns",
+                profile["n_rows"], len(profile["columns"]), len(profile["categories"]))
+
+    with ArtifactPublisher(run) as publisher:
+        temp_path = publisher.path(args.artifact_name)
+        save_profile(profile, temp_path)
+        LOGGER.info("Profile size %d bytes", os.path.getsize(temp_path))
+
+        LOGGER.info("Logging artifact")
+        publisher.publish(args.artifact_name, args.artifact_type,
+                          args.artifact_description, temp_path)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Profile the reference dataset for the drift checks",
+        fromfile_prefix_chars="@"
+    )
+
+    PARSER.add_argument(
+        "--input_artifact",
+        type=str,
+        help="Fully qualified name for the reference dataset",
+        required=True
+    )
+
+    PARSER.add_argument(
+        "--artifact_name",
+        type=str,
+        help="Name for the W&B artifact that will be created",
+        required=True
+    )
+
+    PARSER.add_argument(
+        "--artifact_type",
+        type=str,
+        help="Type for the artifact",
+        required=False,
+        default="reference_profile"
+    )
+
+    PARSER.add_argument(
+        "--artifact_description",
+        type=str,
+        help="Description for the artifact",
+        required=False,
+        default="Profile of the reference dataset"
+    )
+
+    PARSER.add_argument(
+        "--max_values",
+        type=int,
+        help="Distinct values kept per numerical column before falling back "
+             "to a quantile sketch of that many values",
+        required=False,
+        default=2000
+    )
+
+    PARSER.add_argument(
+        "--bins",
+        type=int,
+        help="Number of bins of the histograms",
+        required=False,
+        default=50
+    )
+
+    PARSER.add_argument(
+        "--chunksize",
+        type=int,
+        help="Number of rows read at a time, 0 reads the dataset at once",
+        required=False,
+        default=0
+    )
+    ARGS = PARSER.parse_args()
+    process_args(ARGS)
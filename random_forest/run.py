@@ -1,19 +1,26 @@
 import argparse
 import logging
 import os
+import sys
 from sklearn.ensemble import RandomForestClassifier
 
+import time
+import shutil
 import yaml
-import tempfile
+from joblib import effective_n_jobs
 import mlflow
 from mlflow.models import infer_signature
 from sklearn.impute import SimpleImputer
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import wandb
 from sklearn.model_selection import train_test_split
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingRandomSearchCV
 from sklearn.neighbors import LocalOutlierFactor
+from sklearn.ensemble import IsolationForest
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.preprocessing import LabelEncoder
 from sklearn.preprocessing import OneHotEncoder
@@ -29,6 +36,15 @@ from sklearn.metrics import accuracy_score
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.tree import plot_tree
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.artifact_cache import artifact_dir, read_artifact  # noqa: E402
+from common.forest_io import COMPACT_DIRNAME, save_forest  # noqa: E402
+from common.instrumentation import phase, traced  # noqa: E402
+from common.list_features import LIST_COLUMNS, ListingFeatures  # noqa: E402
+from common.model_io import FULL_PIPELINE_DIRNAME  # noqa: E402
+from common.publisher import ArtifactNotFoundError, ArtifactPublisher  # noqa: E402
+from common.schema import CLEAN_SCHEMA  # noqa: E402
+
 # configure logging
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(message)s",
@@ -37,6 +53,12 @@ logging.basicConfig(level=logging.INFO,
 # reference for a logging obj
 logger = logging.getLogger()
 
+# numerical columns of the clean dataset used as features
+FEATURES = ['accommodates', 'bathrooms', 'bedrooms', 'beds', 'price',
+            'host_listings_count', 'availability_30', 'availability_60',
+            'availability_90', 'availability_365', 'number_of_reviews',
+            'minimum_nights', 'maximum_nights', 'host_response_rate']
+
 
 #Custom Transformer that extracts columns passed as argument to its constructor 
 class FeatureSelector( BaseEstimator, TransformerMixin ):
@@ -53,13 +75,25 @@ class FeatureSelector( BaseEstimator, TransformerMixin ):
         return X[ self.feature_names ]
         
 
+@traced("random_forest")
 def process_args(args):
 
     run = wandb.init(job_type="train")
 
+    # Get the configuration for the pipeline
+    with open(args.model_config) as fp:
+        model_config = yaml.safe_load(fp)
+
+    # Add it to the W&B configuration so the values for the hyperparams
+    # are tracked
+    wandb.config.update(model_config)
+
+    list_config = model_config.get("list_features", {"enabled": False})
+    columns = FEATURES + (LIST_COLUMNS if list_config["enabled"] else [])
+
     logger.info("Downloading and reading train artifact")
-    local_path = run.use_artifact(args.train_data).file()
-    df_train = pd.read_csv(local_path)
+    df_train = read_artifact(run, args.train_data, columns=columns + [args.stratify],
+                             schema=CLEAN_SCHEMA)
 
     # Spliting train.csv into train and validation dataset
     logger.info("Spliting data into train/val")
@@ -76,17 +110,20 @@ def process_args(args):
     logger.info("x val: {}".format(x_val.shape))
     logger.info("y val: {}".format(y_val.shape))
 
-    logger.info("Removal Outliers")
-    # temporary variable
-    x = x_train.select_dtypes("int64").copy()
+    outlier_config = model_config.get("outlier", {"method": "lof"})
+    logger.info("Removal Outliers [%s]", outlier_config["method"])
+    start = time.perf_counter()
 
     # identify outlier in the dataset
-    lof = LocalOutlierFactor()
-    outlier = lof.fit_predict(x)
-    mask = outlier != -1
+    with phase("outliers", rows=len(x_train)):
+        mask = outlier_mask(x_train.select_dtypes("integer"), outlier_config, args.random_seed)
+    run.summary["outlier_method"] = outlier_config["method"]
+    run.summary["outlier_seconds"] = time.perf_counter() - start
+    run.summary["outlier_removed"] = int((~mask).sum())
 
     logger.info("x_train shape [original]: {}".format(x_train.shape))
     logger.info("x_train shape [outlier removal]: {}".format(x_train.loc[mask,:].shape))
+    logger.info("Outlier removal took %.2fs", run.summary["outlier_seconds"])
 
     # dataset without outlier, note this step could be done during the preprocesing stage
     x_train = x_train.loc[mask,:].copy()
@@ -94,29 +131,44 @@ def process_args(args):
 
     # Pipeline generation
     logger.info("Pipeline generation")
-    
-    # Get the configuration for the pipeline
-    with open(args.model_config) as fp:
-        model_config = yaml.safe_load(fp)
-        
-    # Add it to the W&B configuration so the values for the hyperparams
-    # are tracked
-    wandb.config.update(model_config)
-
-    rf = RandomForestClassifier(class_weight = 'balanced', n_estimators=10)
 
-    # training 
-    logger.info("Training")
-    rf.fit(x_train, y_train)
+    # Sparse multi-hot encoding of the list columns next to the numerical ones
+    features = None
+    feature_names = list(x_train.columns)
+    if list_config["enabled"]:
+        with phase("features", rows=len(x_train) + len(x_val)):
+            features = ListingFeatures(FEATURES, encoding=list_config["encoding"],
+                                       max_features=list_config["max_features"],
+                                       min_frequency=list_config["min_frequency"]).fit(x_train)
+            x_train_features = features.transform(x_train)
+            x_val_features = features.transform(x_val)
+        feature_names = list(features.get_feature_names_out())
+
+        logger.info("Encoded %s into %d sparse columns, %.2f%% non-zero",
+                    LIST_COLUMNS, x_train_features.shape[1] - len(FEATURES),
+                    100 * x_train_features.nnz / np.prod(x_train_features.shape))
+    else:
+        x_train_features, x_val_features = x_train, x_val
+    run.summary["n_features"] = len(feature_names)
+
+    if model_config.get("search", {}).get("enabled", False):
+        with phase("search", rows=len(y_train)):
+            rf = search_model(run, model_config, args, x_train_features, y_train)
+    else:
+        rf = fit_forest(run, model_config, args, x_train_features, y_train, feature_names)
+    run.summary["n_estimators"] = rf.n_estimators
 
     # predict
     logger.info("Infering")
-    predict = rf.predict(x_val)
+    with phase("predict", rows=len(y_val)):
+        predict = rf.predict(x_val_features)
     
     # Evaluation Metrics
     logger.info("Evaluation metrics")
-    # Metric: AUC
-    auc = roc_auc_score(y_val, predict, average="macro")
+    # Metric: AUC, one-vs-rest over the class probabilities
+    proba = rf.predict_proba(x_val_features)
+    auc = roc_auc_score(y_val, proba[:, 1] if proba.shape[1] == 2 else proba,
+                        multi_class="ovr", average="macro")
     run.summary["AUC"] = auc
     
     # Metric: Accuracy
@@ -125,42 +177,249 @@ def process_args(args):
     
     # Export if required
     if args.export_artifact != "null":
-        export_model(run, rf, x_val, predict, args.export_artifact)
-
-        
-def export_model(run, rf, x_val, val_pred, export_artifact):
-
-    # Infer the signature of the model
-    signature = infer_signature(x_val, val_pred)
-
-    with tempfile.TemporaryDirectory() as temp_dir:
-
-        export_path = os.path.join(temp_dir, "model_export")
-
-        mlflow.sklearn.save_model(
-            rf, # our pipeline
-            export_path, # Path to a directory for the produced package
-            serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE,
-            signature=signature, # input and output schema
-            input_example=x_val.iloc[:2], # the first few examples
-        )
-
-        artifact = wandb.Artifact(
-            export_artifact,
-            type="model_export",
-            description="Random Forest pipeline export",
-        )
-        
-        # NOTE that we use .add_dir and not .add_file
-        # because the export directory contains several
-        # files
-        artifact.add_dir(export_path)
-
-        run.log_artifact(artifact)
+        pipeline_path = None
+        if args.pipeline_artifact != "null":
+            logger.info("Downloading the fitted cleaner")
+            pipeline_path = artifact_dir(run, args.pipeline_artifact)
+
+        # The exported model receives the listings columns, not the matrix
+        model = rf if features is None else \
+            Pipeline(steps=[("features", features), ("random_forest", rf)])
+        with phase("export"):
+            export_model(run, model, x_val, predict, args.export_artifact,
+                         model_config.get("export_format", "both"), pipeline_path)
+
+
+
+def outlier_mask(x, outlier_config, random_seed):
+    """Return a mask flagging the rows of x that are not outliers
+    Args:
+        x(pd.DataFrame): Numerical columns used to find outliers
+        outlier_config(dict): Outlier stage configuration, its method is
+    one of lof (exact LOF over all rows), lof_sample (LOF fitted on a
+    sample of sample_size rows and applied to every row as novelty
+    detection), isolation_forest or none
+        random_seed(int): Seed for the sampling and the isolation forest
+    Returns:
+        (np.ndarray): True for the rows to keep
+    """
+    method = outlier_config["method"]
+    n_jobs = outlier_config.get("n_jobs")
+
+    if method == "none":
+        return np.ones(len(x), dtype=bool)
+
+    if method == "lof":
+        outlier = LocalOutlierFactor(n_jobs=n_jobs).fit_predict(x)
+    elif method == "lof_sample":
+        sample = x.sample(n=min(outlier_config["sample_size"], len(x)),
+                          random_state=random_seed)
+        lof = LocalOutlierFactor(novelty=True, n_jobs=n_jobs).fit(sample)
+        outlier = lof.predict(x)
+    elif method == "isolation_forest":
+        isolation = IsolationForest(
+            contamination=outlier_config.get("contamination", "auto"),
+            n_jobs=n_jobs, random_state=random_seed)
+        outlier = isolation.fit_predict(x)
+    else:
+        raise ValueError(f"Unknown outlier method {method}")
+
+    return outlier != -1
+
+
+def get_model(run, model_config, args, feature_names, y_train):
+    """Return the random forest described by the model configuration.
+    When warm_start is set and the last exported forest has the same
+    hyperparameters, features and classes and fewer trees than configured,
+    that forest is returned with the configured number of trees, so fit
+    only grows the missing trees. A forest with as many trees would be
+    left unchanged by fit, so the forest is then trained from scratch.
+    Args:
+        run(wandb.Run): Current run
+        model_config(dict): Random forest pipeline configuration
+        args - command line arguments
+        feature_names(list): Names of the columns the forest is fitted on
+        y_train(pd.Series): Training target
+    Returns:
+        (RandomForestClassifier): Forest to fit
+    """
+    rf = RandomForestClassifier(random_state=args.random_seed,
+                                **model_config["random_forest"])
+
+    if not model_config.get("warm_start", False) or args.export_artifact == "null":
+        return rf
+
+    try:
+        previous_path = artifact_dir(run, f"{args.export_artifact}:latest")
+        if not os.path.exists(os.path.join(previous_path, "MLmodel")):
+            raise OSError("the last export has no mlflow model to warm start from")
+        previous = mlflow.sklearn.load_model(previous_path)
+    except (wandb.errors.CommError, ArtifactNotFoundError, OSError) as excep:
+        logger.info("No previous forest to warm start from: %s", excep)
+        return rf
+
+    # Forests exported with the list features are the last pipeline step
+    previous_names = getattr(previous, "feature_names_in_", [])
+    if isinstance(previous, Pipeline):
+        previous_names = previous[0].get_feature_names_out()
+        previous = previous[-1]
+
+    # Parameters that can change between warm started fits
+    growing = {"n_estimators", "n_jobs", "warm_start", "verbose"}
+    params = {key: value for key, value in rf.get_params().items() if key not in growing}
+    previous_params = {key: value for key, value in previous.get_params().items()
+                       if key not in growing}
+
+    if not isinstance(previous, RandomForestClassifier) or params != previous_params \
+            or previous.n_estimators >= rf.n_estimators \
+            or list(previous_names) != list(feature_names) \
+            or set(previous.classes_) != set(y_train.unique()):
+        logger.info("Previous forest does not match the configuration, "
+                    "training from scratch")
+        return rf
+
+    logger.info("Warm starting from %d trees", previous.n_estimators)
+    previous.set_params(n_estimators=rf.n_estimators, n_jobs=rf.n_jobs, warm_start=True)
+    return previous
+
+
+def fit_forest(run, model_config, args, x_train, y_train, feature_names):
+    """Fit the random forest of the model configuration, growing the last
+    exported forest when it can be warm started
+    Args:
+        run(wandb.Run): Current run
+        model_config(dict): Random forest pipeline configuration
+        args - command line arguments
+        x_train(pd.DataFrame or sparse.csr_matrix): Training features
+        y_train(pd.Series): Training target
+        feature_names(list): Names of the columns of x_train
+    Returns:
+        (RandomForestClassifier): Fitted forest
+    """
+    rf = get_model(run, model_config, args, feature_names, y_train)
+    previous_trees = len(getattr(rf, "estimators_", []))
+
+    # training
+    logger.info("Training %d new trees on %d jobs",
+                rf.n_estimators - previous_trees, effective_n_jobs(rf.n_jobs))
+    with phase("fit", rows=len(y_train)):
+        rf.fit(x_train, y_train)
+    run.summary["warm_start_trees"] = previous_trees
+    return rf
+
+
+def search_model(run, model_config, args, x_train, y_train):
+    """Return the best random forest found by successive halving over
+    the ranges in model_config["search"]["param_distributions"]. Every
+    round fits the remaining candidates on a larger subsample of the
+    training rows and keeps the best 1/factor of them, so bad candidates
+    are dropped after cheap fits on few rows. Candidates are evaluated
+    in a pool of worker processes.
+    Args:
+        run(wandb.Run): Current run
+        model_config(dict): Random forest pipeline configuration
+        args - command line arguments
+        x_train(pd.DataFrame or sparse.csr_matrix): Training features
+        y_train(pd.Series): Training target
+    Returns:
+        (RandomForestClassifier): Best forest, refitted on all rows
+    """
+    search_config = model_config["search"]
+
+    # Parallelism comes from the candidates, each forest uses one core
+    base_params = dict(model_config["random_forest"], n_jobs=1)
+    search = HalvingRandomSearchCV(
+        RandomForestClassifier(random_state=args.random_seed, **base_params),
+        search_config["param_distributions"],
+        n_candidates=search_config["n_candidates"],
+        factor=search_config["factor"],
+        resource="n_samples",
+        min_resources=search_config["min_resources"],
+        cv=search_config["cv"],
+        scoring=search_config["scoring"],
+        n_jobs=search_config["n_jobs"],
+        random_state=args.random_seed,
+        refit=True
+    )
 
-        # Make sure the artifact is uploaded before the temp dir
-        # gets deleted
-        artifact.wait()        
+    logger.info("Searching hyperparameters over %d candidates on %d jobs",
+                search_config["n_candidates"], effective_n_jobs(search_config["n_jobs"]))
+    search.fit(x_train, y_train)
+
+    # Log every trial, the rounds of successive halving are the iterations
+    results = pd.DataFrame(search.cv_results_)
+    columns = ["iter", "n_resources", "mean_test_score", "std_test_score",
+               "mean_fit_time", "params"]
+    for trial, row in results[columns].iterrows():
+        run.log({"trial": trial, "iteration": row["iter"],
+                 "n_resources": row["n_resources"],
+                 "mean_test_score": row["mean_test_score"],
+                 "std_test_score": row["std_test_score"],
+                 "mean_fit_time": row["mean_fit_time"],
+                 **{f"param_{key}": value for key, value in row["params"].items()}})
+    run.log({"search_trials": wandb.Table(
+        dataframe=results[columns].astype({"params": str}))})
+
+    logger.info("Best hyperparameters %s, %s %.4f", search.best_params_,
+                search_config["scoring"], search.best_score_)
+    run.summary["best_params"] = search.best_params_
+    run.summary["best_score"] = search.best_score_
+
+    rf = search.best_estimator_
+    rf.set_params(n_jobs=model_config["random_forest"].get("n_jobs"))
+    return rf
+
+
+def export_model(run, rf, x_val, val_pred, export_artifact, export_format="both",
+                 pipeline_path=None):
+    """Export the forest as a W&B artifact
+    Args:
+        run(wandb.Run): Current run
+        rf(RandomForestClassifier or Pipeline): Fitted forest, behind the
+    list features when they are enabled
+        x_val(pd.DataFrame): Validation features, used for the signature
+        val_pred(np.ndarray): Validation predictions, used for the signature
+        export_artifact(str): Name of the artifact
+        export_format(str): mlflow (cloudpickled sklearn model), compact
+    (memory-mappable tree arrays in compact_forest/, see common/forest_io.py)
+    or both. Warm start needs the mlflow model
+        pipeline_path(str): Directory of the cleaner fitted by the
+    preprocessing step, exported in full_pipeline/ when given
+    """
+    if export_format not in ("mlflow", "compact", "both"):
+        raise ValueError(f"Unknown export format {export_format}")
+
+    with ArtifactPublisher(run) as publisher:
+
+        export_path = publisher.path("model_export")
+
+        if export_format in ("mlflow", "both"):
+            # Infer the signature of the model
+            signature = infer_signature(x_val, val_pred)
+
+            mlflow.sklearn.save_model(
+                rf, # our pipeline
+                export_path, # Path to a directory for the produced package
+                serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE,
+                signature=signature, # input and output schema
+                input_example=x_val.iloc[:2], # the first few examples
+            )
+            run.summary["export_mlflow_bytes"] = os.path.getsize(
+                os.path.join(export_path, "model.pkl"))
+
+        if export_format in ("compact", "both"):
+            run.summary["export_compact_bytes"] = save_forest(
+                rf, os.path.join(export_path, COMPACT_DIRNAME))
+
+        if pipeline_path is not None:
+            shutil.copytree(pipeline_path,
+                            os.path.join(export_path, FULL_PIPELINE_DIRNAME))
+
+        # The export directory contains several files, uploaded as a
+        # directory. The publisher waits for the upload before the staged
+        # export gets deleted
+        publisher.publish(export_artifact, "model_export",
+                          "Random Forest pipeline export", export_path)
     
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -190,6 +449,15 @@ if __name__ == "__main__":
         default="null",
     )
 
+    parser.add_argument(
+        "--pipeline_artifact",
+        type=str,
+        help="Fully-qualified name for the fitted cleaner exported with the model. "
+             "Use 'null' to export the model alone.",
+        required=False,
+        default="null",
+    )
+
     parser.add_argument(
         "--random_seed",
         type=int,
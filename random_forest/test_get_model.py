@@ -0,0 +1,76 @@
+"""
+Tests of the choice of the forest to fit when warm_start is set
+"""
+import argparse
+import mlflow
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+
+from common.publisher import local_store
+from random_forest.run import fit_forest, get_model
+
+MODEL_CONFIG = {"random_forest": {"n_estimators": 5, "max_depth": 3}, "warm_start": True}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Local artifact store in a temporary directory, without cache"""
+    monkeypatch.setenv("ARTIFACT_STORE_BACKEND", "local")
+    monkeypatch.setenv("ARTIFACT_STORE_DIR", str(tmp_path / "store"))
+    monkeypatch.setenv("ARTIFACT_CACHE_ENABLED", "false")
+    return local_store()
+
+
+def new_forest(store):
+    """Return the forest get_model gives for a first training run"""
+    args = argparse.Namespace(random_seed=42, export_artifact="model_export")
+    return get_model(None, MODEL_CONFIG, args, ["accommodates"],
+                     pd.Series(["a", "b"]))
+
+
+def test_no_previous_model(store):
+    rf = new_forest(store)
+
+    assert isinstance(rf, RandomForestClassifier)
+    assert rf.n_estimators == 5
+    assert not hasattr(rf, "estimators_")
+
+
+def test_previous_export_without_model(store, tmp_path):
+    payload = tmp_path / "payload"
+    payload.mkdir()
+    (payload / "README").write_text("not a model")
+    store.log_artifact("model_export", "model_export", "", str(payload))
+
+    assert not hasattr(new_forest(store), "estimators_")
+
+
+def test_warm_start_grows_the_previous_forest(store, tmp_path):
+    X, y = make_classification(n_samples=300, n_features=4, random_state=0)
+    X = pd.DataFrame(X, columns=[f"feature_{i}" for i in range(4)])
+    y = pd.Series(y)
+    args = argparse.Namespace(random_seed=42, export_artifact="model_export")
+    run = argparse.Namespace(summary={})
+
+    first = fit_forest(run, MODEL_CONFIG, args, X, y, list(X.columns))
+    assert run.summary["warm_start_trees"] == 0
+    mlflow.sklearn.save_model(first, str(tmp_path / "export"))
+    store.log_artifact("model_export", "model_export", "", str(tmp_path / "export"))
+
+    config = dict(MODEL_CONFIG, random_forest=dict(MODEL_CONFIG["random_forest"],
+                                                   n_estimators=8))
+    grown = fit_forest(run, config, args, X, y, list(X.columns))
+    assert len(grown.estimators_) == 8
+    assert run.summary["warm_start_trees"] == 5
+    np.testing.assert_array_equal(grown.estimators_[0].predict(X.to_numpy()),
+                                  first.estimators_[0].predict(X.to_numpy()))
+
+    # As many trees as the previous forest, fit would add none
+    retrained = fit_forest(run, MODEL_CONFIG, args, X.iloc[:200], y.iloc[:200],
+                           list(X.columns))
+    assert run.summary["warm_start_trees"] == 0
+    assert len(retrained.estimators_) == 5
+    assert not retrained.warm_start
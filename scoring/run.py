@@ -0,0 +1,384 @@
+"""
+Author: Matheus Silva
+Date: July 2022
+This project is responsible for scoring new listings with the model
+exported by the random_forest step, either streaming a large file
+through a pool of worker processes (batch mode) or answering HTTP
+requests grouped in micro-batches (serve mode).
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.artifact_io import TableWriter, iter_table  # noqa: E402
+from common.instrumentation import phase, start_tracer, stop_tracer  # noqa: E402
+from common.model_io import load_model, load_pipeline, predict_frame  # noqa: E402
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s %(message)s",
+                    datefmt='%d-%m-%Y %H:%M:%S')
+
+LOGGER = logging.getLogger()
+
+# Model and cleaner loaded once by each worker process of the batch mode
+_WORKER_MODEL = None
+_WORKER_PIPELINE = None
+
+
+class LatencyStats:
+    """Thread-safe record of the rows and latency of each scoring call"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.rows = 0
+        self.latencies = []
+
+    def record(self, rows, seconds):
+        """Record a call scoring rows listings in seconds"""
+        with self.lock:
+            self.rows += rows
+            self.latencies.append(seconds)
+
+    def summary(self):
+        """Return the throughput and latency percentiles so far
+        Returns:
+            (dict): Rows, rows per second, p50 and p99 latency in ms
+        """
+        with self.lock:
+            elapsed = time.perf_counter() - self.start
+            latencies = np.array(self.latencies or [np.nan]) * 1000
+            return {
+                "rows": self.rows,
+                "calls": len(self.latencies),
+                "rows_per_second": self.rows / elapsed if elapsed else 0.0,
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99))
+            }
+
+
+def get_model_path(args):
+    """Return a local directory with the model export, downloading the
+    W&B artifact unless args.model_export is already a local directory"""
+    if os.path.isdir(args.model_export):
+        return args.model_export
+
+    import wandb
+    from common.artifact_cache import artifact_dir
+
+    run = wandb.init(job_type="scoring")
+    return artifact_dir(run, args.model_export)
+
+
+def _init_worker(model_path):
+    """Load the model once in each worker process"""
+    global _WORKER_MODEL, _WORKER_PIPELINE
+    _WORKER_MODEL = load_model(model_path)
+    _WORKER_PIPELINE = load_pipeline(model_path)
+
+
+def _score_chunk(chunk):
+    """Score a chunk in a worker process, returning the predictions and
+    the seconds spent"""
+    start = time.perf_counter()
+    predictions = predict_frame(_WORKER_MODEL, chunk, _WORKER_PIPELINE)
+    return predictions, time.perf_counter() - start
+
+
+def score_batch(model_path, input_path, output_path, chunksize, workers):
+    """Stream a file through the model in fixed-size chunks scored by a
+    pool of worker processes, appending the scored chunks to the output
+    in the input order
+    Args:
+        model_path(str): Directory of the model export
+        input_path(str): csv, parquet or feather file with the listings
+        output_path(str): File receiving the listings with a prediction column
+        chunksize(int): Number of rows of each chunk
+        workers(int): Number of worker processes
+    Returns:
+        (dict): Throughput and per-chunk latency percentiles
+    """
+    stats = LatencyStats()
+    # Chunks in flight are bounded so memory does not grow with the input
+    in_flight = collections.deque()
+
+    def write_oldest(writer):
+        chunk, future = in_flight.popleft()
+        predictions, seconds = future.result()
+        stats.record(len(chunk), seconds)
+        writer.write(chunk.assign(prediction=predictions))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model_path,)) as executor, \
+            TableWriter(output_path) as writer:
+        for chunk in iter_table(input_path, chunksize=chunksize):
+            in_flight.append((chunk, executor.submit(_score_chunk, chunk)))
+            if len(in_flight) >= 2 * workers:
+                write_oldest(writer)
+
+        while in_flight:
+            write_oldest(writer)
+
+    return stats.summary()
+
+
+class MicroBatcher:
+    """Group the listings of concurrent requests into batches of at most
+    max_batch_size rows, waiting at most max_wait_ms for a batch to fill
+    """
+    def __init__(self, model, max_batch_size, max_wait_ms, pipeline=None):
+        self.model = model
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.stats = LatencyStats()
+
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def predict(self, listings):
+        """Score listings, blocking until their batch is predicted
+        Args:
+            listings(list): Listings as dicts of column values
+        Returns:
+            (list): Predictions, one per listing
+        """
+        start = time.perf_counter()
+        request = {"listings": listings, "done": threading.Event()}
+        self.requests.put(request)
+        request["done"].wait()
+
+        self.stats.record(len(listings), time.perf_counter() - start)
+        if "error" in request:
+            raise request["error"]
+        return request["predictions"]
+
+    def _loop(self):
+        """Collect requests into batches and predict them"""
+        while True:
+            batch = [self.requests.get()]
+            rows = len(batch[0]["listings"])
+            deadline = time.perf_counter() + self.max_wait
+
+            while rows < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                rows += len(batch[-1]["listings"])
+
+            try:
+                data = pd.DataFrame(
+                    [listing for request in batch for listing in request["listings"]])
+                predictions = predict_frame(self.model, data, self.pipeline).tolist()
+                for request in batch:
+                    size = len(request["listings"])
+                    request["predictions"], predictions = \
+                        predictions[:size], predictions[size:]
+            except Exception as excep:  # returned to every request of the batch
+                for request in batch:
+                    request["error"] = excep
+
+            for request in batch:
+                request["done"].set()
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """POST /predict with a listing or a list of listings as json returns
+    their predictions, GET /stats returns the throughput and latency"""
+
+    def _reply(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):  # noqa: N802
+        if self.path == "/stats":
+            self._reply(200, self.server.batcher.stats.summary())
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):  # noqa: N802
+        if self.path != "/predict":
+            self._reply(404, {"error": "not found"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            listings = body if isinstance(body, list) else [body]
+            self._reply(200, {"predictions": self.server.batcher.predict(listings)})
+        except (ValueError, KeyError) as excep:
+            self._reply(400, {"error": str(excep)})
+
+    def log_message(self, format, *args):  # noqa: A002
+        LOGGER.debug(format, *args)
+
+
+class ScoringServer(ThreadingHTTPServer):
+    """HTTP server accepting many concurrent connections"""
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def serve(model_path, host, port, max_batch_size, max_wait_ms):
+    """Serve the model over HTTP until interrupted
+    Args:
+        model_path(str): Directory of the model export
+        host(str): Address to listen on
+        port(int): Port to listen on
+        max_batch_size(int): Maximum rows predicted at once
+        max_wait_ms(float): Maximum wait for a micro-batch to fill
+    """
+    server = ScoringServer((host, port), ScoringHandler)
+    server.batcher = MicroBatcher(load_model(model_path), max_batch_size, max_wait_ms,
+                                  load_pipeline(model_path))
+
+    LOGGER.info("Serving on http://%s:%d/predict", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        LOGGER.info("Scoring stats: %s", server.batcher.stats.summary())
+
+
+def process_args(args):
+    """Process args passed by command line
+    Args:
+        args - command line arguments
+        args.model_export: Model export artifact or local directory
+        args.mode: batch or serve
+        args.input_file: Listings to score in batch mode
+        args.output_file: Scored listings in batch mode
+        args.chunksize: Rows per chunk in batch mode
+        args.workers: Worker processes in batch mode
+        args.host: Address to listen on in serve mode
+        args.port: Port to listen on in serve mode
+        args.max_batch_size: Maximum rows per micro-batch in serve mode
+        args.max_wait_ms: Maximum wait for a micro-batch to fill in serve mode
+    """
+    model_path = get_model_path(args)
+
+    if args.mode == "batch":
+        LOGGER.info("Scoring %s in chunks of %d rows on %d workers",
+                    args.input_file, args.chunksize, args.workers)
+        # Only the batch mode is traced, the server runs until stopped
+        tracer = start_tracer("scoring")
+        try:
+            with phase("predict") as timing:
+                stats = score_batch(model_path, args.input_file, args.output_file,
+                                    args.chunksize, args.workers)
+                timing.rows = stats["rows"]
+        finally:
+            stop_tracer(tracer)
+        LOGGER.info("Scoring stats: %s", stats)
+    else:
+        serve(model_path, args.host, args.port, args.max_batch_size, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Score listings with the exported model",
+        fromfile_prefix_chars="@"
+    )
+
+    PARSER.add_argument(
+        "--model_export",
+        type=str,
+        help="Fully qualified name for the model export artifact, or a local directory",
+        required=True
+    )
+
+    PARSER.add_argument(
+        "--mode",
+        type=str,
+        choices=["batch", "serve"],
+        help="batch scores a file, serve answers HTTP requests",
+        required=False,
+        default="batch"
+    )
+
+    PARSER.add_argument(
+        "--input_file",
+        type=str,
+        help="csv, parquet or feather file with the listings to score",
+        required=False
+    )
+
+    PARSER.add_argument(
+        "--output_file",
+        type=str,
+        help="File receiving the scored listings, its extension sets the format",
+        required=False,
+        default="predictions.csv"
+    )
+
+    PARSER.add_argument(
+        "--chunksize",
+        type=int,
+        help="Rows scored at once in batch mode",
+        required=False,
+        default=100000
+    )
+
+    PARSER.add_argument(
+        "--workers",
+        type=int,
+        help="Worker processes in batch mode",
+        required=False,
+        default=os.cpu_count()
+    )
+
+    PARSER.add_argument(
+        "--host",
+        type=str,
+        help="Address to listen on in serve mode",
+        required=False,
+        default="127.0.0.1"
+    )
+
+    PARSER.add_argument(
+        "--port",
+        type=int,
+        help="Port to listen on in serve mode",
+        required=False,
+        default=8080
+    )
+
+    PARSER.add_argument(
+        "--max_batch_size",
+        type=int,
+        help="Maximum rows predicted at once in serve mode",
+        required=False,
+        default=256
+    )
+
+    PARSER.add_argument(
+        "--max_wait_ms",
+        type=float,
+        help="Maximum wait for a micro-batch to fill in serve mode",
+        required=False,
+        default=5.0
+    )
+    ARGS = PARSER.parse_args()
+
+    if ARGS.mode == "batch" and ARGS.input_file is None:
+        PARSER.error("--input_file is required in batch mode")
+    process_args(ARGS)
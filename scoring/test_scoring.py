@@ -0,0 +1,108 @@
+"""
+Tests of the batch scoring through the pool of worker processes and of
+the HTTP scoring through the micro-batcher
+"""
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from common.artifact_io import read_table
+from common.forest_io import COMPACT_DIRNAME, save_forest
+from common.model_io import load_model
+from scoring.run import MicroBatcher, ScoringHandler, ScoringServer, score_batch
+
+FEATURES = ["accommodates", "bedrooms", "beds"]
+
+
+@pytest.fixture(scope="module")
+def listings():
+    """Listings with the model features and a column the model ignores"""
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame({column: rng.integers(1, 8, 500) for column in FEATURES})
+    data["room_type"] = np.where(data["accommodates"] > 3, "Entire home/apt",
+                                 "Private room")
+    return data
+
+
+@pytest.fixture(scope="module")
+def model(listings, tmp_path_factory):
+    """Forest fitted on the listings, and the directory of its export"""
+    rf = RandomForestClassifier(n_estimators=5, max_depth=4, random_state=0)
+    rf.fit(listings[FEATURES], listings["room_type"])
+
+    model_path = tmp_path_factory.mktemp("model_export")
+    save_forest(rf, str(model_path / COMPACT_DIRNAME))
+    return rf, str(model_path)
+
+
+def test_batch_keeps_the_input_order(tmp_path, listings, model):
+    rf, model_path = model
+    input_path, output_path = str(tmp_path / "listings.csv"), str(tmp_path / "scored.csv")
+    listings.to_csv(input_path, index=False)
+
+    stats = score_batch(model_path, input_path, output_path, chunksize=60, workers=2)
+
+    scored = read_table(output_path)
+    pd.testing.assert_frame_equal(scored.drop(columns="prediction"), listings)
+    np.testing.assert_array_equal(scored["prediction"], rf.predict(listings[FEATURES]))
+    assert stats["rows"] == len(listings) and stats["calls"] == 9
+
+
+@pytest.fixture
+def server(model):
+    """Scoring server on a free local port"""
+    _, model_path = model
+    httpd = ScoringServer(("127.0.0.1", 0), ScoringHandler)
+    httpd.batcher = MicroBatcher(load_model(model_path), max_batch_size=16, max_wait_ms=20)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(url, body):
+    """Return the status and json body of a POST request"""
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as excep:
+        return excep.code, json.load(excep)
+
+
+def test_http_scores_concurrent_requests(server, listings, model):
+    rf, _ = model
+    records = json.loads(listings.head(40).to_json(orient="records"))
+    expected = rf.predict(listings.head(40)[FEATURES]).tolist()
+
+    # Concurrent requests of one listing each, grouped in micro-batches
+    results = [None] * len(records)
+
+    def score(index):
+        results[index] = post(server + "/predict", records[index])
+
+    threads = [threading.Thread(target=score, args=(index,)) for index in range(len(records))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [result[0] for result in results] == [200] * len(records)
+    assert [result[1]["predictions"][0] for result in results] == expected
+
+    status, body = post(server + "/predict", [{column: 2 for column in FEATURES}] * 3)
+    assert status == 200 and len(body["predictions"]) == 3
+
+    with urllib.request.urlopen(server + "/stats", timeout=10) as response:
+        assert json.load(response)["rows"] == len(records) + 3
+
+
+def test_http_rejects_listings_without_the_features(server):
+    status, body = post(server + "/predict", {"accommodates": 2})
+    assert status == 400 and "error" in body
@@ -7,11 +7,22 @@ and split into train and test data.
 import argparse
 import logging
 import os
-import tempfile
+import functools
+import sys
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 import wandb
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.artifact_io import (FORMATS, TableWriter, artifact_filename,  # noqa: E402
+                                as_read, iter_table, read_table, write_table)
+from common.artifact_cache import artifact_dir, keep_table, read_artifact  # noqa: E402
+from common.hashing import hash_split  # noqa: E402
+from common.instrumentation import phase, traced  # noqa: E402
+from common.publisher import ArtifactPublisher  # noqa: E402
+from common.schema import CLEAN_SCHEMA  # noqa: E402
+
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(message)s",
                     datefmt='%d-%m-%Y %H:%M:%S')
@@ -19,6 +30,82 @@ logging.basicConfig(level=logging.INFO,
 LOGGER = logging.getLogger()
 
 
+def table_files(path):
+    """Return the tabular files of an artifact directory, in name order
+    Args:
+        path(str): Directory with the artifact files
+    Returns:
+        (list): Paths to the csv, parquet and feather files
+    """
+    extensions = tuple(FORMATS.values()) + tuple(f"{ext}.gz" for ext in FORMATS.values())
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.endswith(extensions)]
+
+
+def iter_files(paths, chunksize, schema=None):
+    """Yield the rows of several tabular files, chunk by chunk
+    Args:
+        paths(list): Paths to csv, parquet or feather files
+        chunksize(int): Number of rows of each chunk, 0 reads each file
+    at once
+        schema(dict): Compact dtypes applied to each chunk
+    Yields:
+        (pd.DataFrame): Chunk of rows
+    """
+    for path in paths:
+        if chunksize > 0:
+            yield from iter_table(path, chunksize=chunksize, schema=schema)
+        else:
+            yield read_table(path, schema=schema)
+
+
+def split_stream(chunks, split_paths, test_size, seed, key_columns=None, stratify=None):
+    """Assign each row to train or test from the hash of its key and
+    append it to the file of its split, one chunk at a time
+    Args:
+        chunks(Iterable): DataFrames with the rows to split
+        split_paths(dict): Output path of the train and test splits
+        test_size(float): Expected fraction of rows in the test split
+        seed(int): Seed of the assignment
+        key_columns(list): Columns identifying a row, None uses all of them
+        stratify(str): Column whose class counts are returned, None
+    counts all rows as a single class
+    Returns:
+        (pd.DataFrame): Rows of each class (index) in each split (columns)
+    """
+    writers = {split: TableWriter(path) for split, path in split_paths.items()}
+    counts = {split: pd.Series(dtype=np.int64) for split in split_paths}
+    empty = None
+
+    try:
+        for chunk in chunks:
+            if empty is None:
+                empty = chunk.iloc[:0]
+            is_test = hash_split(chunk, test_size, seed, key_columns)
+            classes = chunk[stratify].astype(object) if stratify else \
+                pd.Series("all", index=chunk.index)
+
+            for split, mask in (("train", ~is_test), ("test", is_test)):
+                # Empty chunks would give parquet and feather a schema
+                # without the column types
+                if mask.any():
+                    writers[split].write(chunk[mask])
+                counts[split] = counts[split].add(
+                    classes[mask].value_counts(), fill_value=0)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    for split, writer in writers.items():
+        if writer.schema is None:
+            LOGGER.warning("No rows in the %s split", split)
+            write_table(empty if empty is not None else pd.DataFrame(),
+                        split_paths[split])
+
+    return pd.DataFrame(counts).fillna(0).astype(np.int64)
+
+
+@traced("segregate")
 def process_args(args):
     """
     Arguments
@@ -30,51 +117,84 @@ def process_args(args):
         args.random_state: Integer to use to seed the random number generator
         args.stratify: If provided, it is considered a column name to be used
     for stratified splitting
+        args.artifact_format: File format of the split artifacts, one of
+    csv, parquet or feather
+        args.split_mode: memory, train_test_split on the loaded dataset, or
+    hash, streaming split assigning each row from the hash of its key
+        args.key_columns: Comma separated columns identifying a row in hash
+    mode, null uses all the columns
+        args.chunksize: Rows read at once in hash mode, 0 reads each file
+    of the input artifact at once
     """
     run = wandb.init(job_type="data_segregation")
 
-    LOGGER.info("Downloading and reading artifact")
-    artifact = run.use_artifact(args.input_artifact)
-    artifact_path = artifact.file()
+    with ArtifactPublisher(run) as publisher:
 
-    data = pd.read_csv(artifact_path)
+        # Make the artifact names from the name of the splits plus the provided root
+        artifact_names = {split: f"{split}_{args.artifact_root}.csv"
+                          for split in ("train", "test")}
 
-    LOGGER.info("Splitting data into train, val and test")
-    splits = {}
+        # Get the staging paths of the split files
+        split_paths = {
+            split: publisher.path(artifact_filename(
+                f"{split}_{args.artifact_root}", args.artifact_format))
+            for split in artifact_names
+        }
 
-    splits["train"], splits["test"] = train_test_split(
-        data,
-        test_size=args.test_size,
-        random_state=args.random_state,
-        stratify=data[args.stratify] if args.stratify != 'null' else None
-    )
+        def publish(split, write=None):
+            """Upload a split in the background, writing it first if needed"""
+            LOGGER.info("Uploading the %s dataset to %s", split, artifact_names[split])
+            publisher.publish(artifact_names[split], args.artifact_type,
+                              f"{split} split of dataset {args.input_artifact}",
+                              split_paths[split], write)
+
+        if args.split_mode == "hash":
+            stratify = args.stratify if args.stratify != 'null' else None
+            key_columns = args.key_columns.split(",") if args.key_columns != 'null' else None
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
+            LOGGER.info("Streaming split of %s on the hash of its rows",
+                        args.input_artifact)
+            paths = table_files(artifact_dir(run, args.input_artifact))
+            with phase("split") as timing:
+                counts = split_stream(iter_files(paths, args.chunksize, CLEAN_SCHEMA), split_paths,
+                                      args.test_size, args.random_state, key_columns,
+                                      stratify)
+                timing.rows = int(counts.to_numpy().sum())
 
-        for split, data in splits.items():
+            # Rows are assigned independently of their class, so every
+            # class gets test_size of its rows up to sampling noise
+            for label, row in counts.iterrows():
+                LOGGER.info("%s: %d train, %d test rows (%.3f test)", label,
+                            row["train"], row["test"],
+                            row["test"] / max(row.sum(), 1))
 
-            # Make the artifact name from the name of the split plus the provided root
-            artifact_name = f"{split}_{args.artifact_root}.csv"
+            for split in split_paths:
+                publish(split)
 
-            # Get the path on disk within the temp directory
-            temp_path = os.path.join(tmp_dir, artifact_name)
+        elif args.split_mode == "memory":
+            LOGGER.info("Downloading and reading artifact")
+            data = read_artifact(run, args.input_artifact, schema=CLEAN_SCHEMA)
 
-            LOGGER.info("Uploading the %s dataset to %s", split, artifact_name)
+            LOGGER.info("Splitting data into train, val and test")
+            splits = {}
 
-            # Save then upload to W&B
-            data.to_csv(temp_path,index=False)
+            with phase("split", rows=len(data)):
+                splits["train"], splits["test"] = train_test_split(
+                    data,
+                    test_size=args.test_size,
+                    random_state=args.random_state,
+                    stratify=data[args.stratify] if args.stratify != 'null' else None
+                )
 
-            artifact = wandb.Artifact(
-                name=artifact_name,
-                type=args.artifact_type,
-                description=f"{split} split of dataset {args.input_artifact}",
-            )
-            artifact.add_file(temp_path)
+            for split, data in splits.items():
+                keep_table(artifact_names[split], as_read(data, split_paths[split]))
+                # Both splits are written and uploaded at the same time
+                publish(split, functools.partial(write_table, data))
 
-            LOGGER.info("Logging artifact")
-            run.log_artifact(artifact)
+        else:
+            raise ValueError(f"Unknown split mode {args.split_mode}")
 
-            artifact.wait()
+        LOGGER.info("Waiting for the uploads")
 
 
 if __name__ == "__main__":
@@ -127,5 +247,39 @@ if __name__ == "__main__":
         required=False,
         default='null'  # unfortunately mlflow does not support well optional parameters
     )
+
+    PARSER.add_argument(
+        "--artifact_format",
+        help="File format of the split artifacts, one of csv, parquet or feather",
+        type=str,
+        required=False,
+        default="csv"
+    )
+
+    PARSER.add_argument(
+        "--split_mode",
+        help="memory loads the dataset and calls train_test_split, hash streams "
+             "it and assigns each row from the hash of its key and the seed",
+        type=str,
+        required=False,
+        default="memory"
+    )
+
+    PARSER.add_argument(
+        "--key_columns",
+        help="Comma separated columns identifying a row in hash mode, "
+             "null uses all the columns",
+        type=str,
+        required=False,
+        default="null"
+    )
+
+    PARSER.add_argument(
+        "--chunksize",
+        help="Number of rows read at once in hash mode, 0 reads each file at once",
+        type=int,
+        required=False,
+        default=100000
+    )
     ARGS = PARSER.parse_args()
     process_args(ARGS)